@@ -1,20 +1,401 @@
 """This module contains AddressBook class used for storing, adding and modifying entries"""
 
-import pickle
-import textwrap as tw
+import sys
 import time
+import weakref
+from bisect import bisect_right
+from itertools import islice, repeat
+from operator import attrgetter
 
 from addressbook.ab_person import *
+from addressbook import ab_metrics as metrics
 from addressbook.ab_helpers import *
+from addressbook.ab_analytics import compute_stats
+from addressbook.ab_cache import QueryCache
+from addressbook.ab_collation import get_collation
+from addressbook.ab_history import History
+from addressbook import ab_merge
+from addressbook.ab_render import page, write_all
+from addressbook import ab_storage as storage
+from addressbook.ab_summary import Summary
+
+# rarely used modules, imported on first use
+pickle = LazyModule('pickle')
+tw = LazyModule('textwrap')
+# imports this module, so it can't be imported before it
+ab_tags = LazyModule('addressbook.ab_tags')
+
+
+# attributes the entries can be searched and sorted by
+SEARCH_KEYS = ('name', 'surname', 'personid', 'email', 'phone', 'birthday', 'year', 'month', 'day', 'city',
+               'streetname', 'streetnumber')
+
+
+def search_value(key, value):
+    """Convert a value typed in by the user to the form the attribute is stored in
+
+    Attributes:
+        key (str): Person's attribute
+        value (str): Value of the attribute
+    """
+    if key in ('name', 'surname', 'city'):
+        return value.title()
+    elif key == 'streetname':
+        return street_parser(value, '')[0]
+    elif key == 'phone':
+        return phone_parser(value)[0]
+    elif key == 'birthday':
+        y, m, d = date_parser(value)
+        return dt.date(y, m, d)
+    elif key in ('year', 'month', 'day'):
+        return int(value)
+    return value
+
+
+def sort_key(text):
+    """Convert a sorting key written as 'attribute', 'attribute:asc' or 'attribute:desc' to the form
+    accepted by 'AddressBook.sorting': (attribute, True for descending order)"""
+    name, _, order = text.partition(':')
+    if name not in SEARCH_KEYS or order not in ('', 'asc', 'desc'):
+        raise WrongInput("Invalid sorting key '{0}'. Use an attribute name, optionally followed by "
+                         "':asc' or ':desc'".format(text))
+    return name, order == 'desc'
+
+
+def sort_order(people, *atts, reverse=None, collation=None):
+    """Return positions of the people in the order they are sorted in by 'AddressBook.sorting'
+    (see there for the attributes). The sequence itself is not changed."""
+
+    specs = [(att, bool(reverse)) if isinstance(att, str) else (att[0], bool(att[1])) for att in atts]
+    coll = get_collation(collation) if collation is not None else None
+
+    # Keys of all the entries are read in one pass. Every distinct combination of keys is then given its
+    # rank, so comparisons (and collation keys) are computed once per distinct value, not once per entry,
+    # and the entries are sorted in a single pass by integer ranks.
+    rows = list(map(attrgetter(*(att for att, _ in specs)), people))
+    distinct = set(rows)
+    if len(specs) == 1:
+        rank = _ranks(distinct, specs[0][1], coll)
+    else:
+        columns = [_ranks({row[i] for row in distinct}, desc, coll) for i, (_, desc) in enumerate(specs)]
+        ordered = sorted(distinct, key=lambda row: tuple(map(dict.__getitem__, columns, row)))
+        rank = dict(zip(ordered, range(len(ordered))))
+    ranks = list(map(rank.__getitem__, rows))
+    return sorted(range(len(people)), key=ranks.__getitem__)
+
+
+def _ranks(values, desc, coll):
+    """Return dictionary of ranks of the values, None is ranked last (first in descending order)"""
+    values = set(values)
+    values.discard(None)
+    if coll is not None and all(isinstance(v, str) for v in values):
+        ordered = sorted(values, key=coll.key)
+    else:
+        ordered = sorted(values)
+    ordered.append(None)
+    if desc:
+        ordered.reverse()
+    return dict(zip(ordered, range(len(ordered))))
+
+
+def _restore_book(cls, state, items):
+    """Recreate an AddressBook saved with pickle (or copied with 'copy' module)"""
+    book = cls.__new__(cls)
+    book.__dict__.update(state)
+    book.extend(items)
+    book.reset_changes()
+    return book
 
 
 class AddressBook(list):
-    """Class for creating and modifying the AddressBook"""
+    """Class for creating and modifying the AddressBook.
+
+    Every entry gets a unique integer 'uid' when it is added to the AddressBook. Uids never change and are
+    not reused, so (unlike 'personid') they tell apart people with the same name and surname.
+
+    Every change of the list of entries or of any entry's attribute increases the book's 'generation'.
+    Entries changed (added, modified or removed) in every generation are logged, so that checking for unsaved
+    changes takes constant time and caches or savers can ask what has changed since a given generation.
+    The log is kept in the order of generations and only as far back as it is needed: changes made before
+    the last save and before the generation of the oldest consumer (see 'watch') are forgotten, together
+    with the removed entries they hold.
+    """
+
+    # number of results of 'search_base' kept by 'query_cache' (0 turns the cache off)
+    query_cache_size = 128
+
+    # rate of false positives of the Bloom filter written with the AddressBook file (None: no filter is written)
+    bloom_error_rate = 0.01
+
+    # whether the record file used for opening the AddressBook lazily (see ab_lazy) is written with the
+    # AddressBook file; the lazy mode of the interactive menu turns it on, it isn't saved with the AddressBook
+    record_file = False
+
+    # smallest length of the change log that makes it trimmed
+    log_trim_size = 1024
+
+    # attributes used for tracking changes, they are not saved together with the AddressBook
+    _tracking = ('generation', '_saved_generation', '_saved_next_uid', '_log_start', '_log_generations',
+                 '_log_uids', '_trim_at', '_watchers', '_changed', '_removed', '_logged_at', '_by_uid',
+                 '_repeated', 'history', '_stats_cache', '_summary', '_tag_index', '_touched',
+                 '_members_changed', 'query_cache')
+
+    def __new__(cls, *args, **kwargs):
+        # change tracking is set up here rather than in __init__, because unpickling
+        # books saved by older versions fills the list without calling __init__
+        self = super().__new__(cls)
+        self.generation = 0             # increased with every change of the AddressBook
+        self._saved_generation = 0      # generation of the last save
+        self._log_start = 0             # generation the change log starts from
+        self._log_generations = []      # generations of the logged changes, in ascending order
+        self._log_uids = []             # uids of the entries changed in them
+        self._trim_at = cls.log_trim_size   # length of the log that makes it trimmed
+        self._watchers = weakref.WeakValueDictionary()  # id: consumer of the changes (see 'watch')
+        self._changed = {}              # uid: entry, for added and modified entries in the log
+        self._removed = {}              # uid: entry, for removed entries in the log
+        self._logged_at = {}            # uid: generation of the entry's last logged change
+        self._by_uid = {}               # uid: entry, for all the entries in the AddressBook
+        self._repeated = {}             # uid: number of additional places an entry is held at (e.g. while swapping)
+        self._next_uid = 1              # uid given to the next new entry, saved together with the AddressBook
+        self._saved_next_uid = 1        # '_next_uid' of the last save, older uids may be held by the file
+        self.version = 0                # increased with every save, saved together with the AddressBook
+        self._revisions = {}            # uid: version the entry was last saved in, saved with the AddressBook
+        self.history = History()        # changes that can be undone
+        self._stats_cache = None        # (key, statistics) computed by 'statistics'
+        self._summary = None            # Summary kept up to date by 'summary'
+        self._tag_index = None          # ab_tags.TagIndex used by 'select'
+        self._touched = {}              # attribute: generation it was last changed in (in any entry)
+        self._members_changed = 0       # generation an entry was last added or removed in
+        self.query_cache = QueryCache('search_base', cls.query_cache_size)    # results of 'search_base'
+        return self
 
     def __init__(self):
         super().__init__()
         self.filename = None    # Used when working with opened file
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for att in self._tracking:
+            state.pop(att, None)
+        state.pop('record_file', None)
+        return state
+
+    def __setstate__(self, state):
+        # used by books saved by older versions, the entries have already been added at this point
+        self.__dict__.update(state)
+        self.reset_changes()
+
+    def __reduce_ex__(self, protocol):
+        return _restore_book, (self.__class__, self.__getstate__(), list(self))
+
+    @property
+    def modified(self):
+        """True if the AddressBook has been changed since it was created, opened or saved"""
+        return self.generation != self._saved_generation
+
+    def mark_saved(self):
+        """Mark the current generation of the AddressBook as saved"""
+        self._saved_generation = self.generation
+        self._saved_next_uid = self._next_uid
+        self._trim_log()
+
+    def reset_changes(self):
+        """Forget all the logged changes (including the ones that could be undone) and mark the AddressBook
+        as saved"""
+        self._changed.clear()
+        self._removed.clear()
+        self._logged_at.clear()
+        self._log_generations.clear()
+        self._log_uids.clear()
+        self._trim_at = self.log_trim_size
+        self.history.clear()
+        self._log_start = self._saved_generation = self.generation
+        self._saved_next_uid = self._next_uid
+
+    def changes_since(self, generation):
+        """Return a tuple of two lists: entries added or modified and entries removed after the given generation.
+        The cost is proportional to the number of changes made after the generation, not to the size
+        of the AddressBook or of the log. If these changes are no longer logged, None is returned.
+
+        Attributes:
+            generation (int): Generation to compare the AddressBook with
+        """
+
+        if generation < self._log_start:
+            return None
+        start = bisect_right(self._log_generations, generation)
+        changed, removed = [], []
+        for uid in dict.fromkeys(islice(self._log_uids, start, None)):
+            p = self._removed.get(uid)
+            if p is not None:
+                removed.append(p)
+            else:
+                changed.append(self._changed[uid])
+        return changed, removed
+
+    def watch(self, consumer):
+        """Keep the changes made after the generation of the consumer logged for as long as the consumer
+        exists. The consumer (e.g. an AttributeIndex) has a 'generation' attribute: the generation it has
+        been brought up to date with, or None. Changes made before the generation of the oldest consumer
+        and before the last save are forgotten.
+
+        Attributes:
+            consumer (object): Object calling 'changes_since' with its generation
+        """
+        self._watchers[id(consumer)] = consumer
+
+    def _log(self, uids):
+        """Log changes of the entries with the uids in the current generation"""
+        gen, logged_at = self.generation, self._logged_at
+        for uid in uids:
+            logged_at[uid] = gen
+        self._log_uids.extend(uids)
+        self._log_generations.extend(repeat(gen, len(uids)))
+        if len(self._log_uids) > self._trim_at:
+            self._trim_log()
+
+    def _trim_log(self):
+        """Forget the changes no consumer needs, releasing the removed entries logged only by them"""
+
+        oldest = self._saved_generation
+        # consumers older than the log rebuild anyway, they don't hold it back
+        for consumer in self._watchers.values():
+            gen = consumer.generation
+            if gen is not None and self._log_start <= gen < oldest:
+                oldest = gen
+        end = bisect_right(self._log_generations, oldest)
+        if end:
+            changed, removed, logged_at = self._changed, self._removed, self._logged_at
+            for uid in islice(self._log_uids, end):
+                if logged_at.get(uid, oldest + 1) <= oldest:
+                    del logged_at[uid]
+                    changed.pop(uid, None)
+                    removed.pop(uid, None)
+            del self._log_generations[:end]
+            del self._log_uids[:end]
+            self._log_start = oldest
+        self._trim_at = max(2 * len(self._log_uids), self.log_trim_size)
+
+    def dirty_entries(self):
+        """Return entries added or modified since the AddressBook was last saved"""
+        return self.changes_since(self._saved_generation)[0]
+
+    def summary(self):
+        """Return the Merkle-style summary of the AddressBook (see ab_summary). It is computed on the first call
+        and then kept up to date, hashing only the entries changed in the meantime. The summary changes
+        together with the book, so a copy of it ('Summary.copy') has to be kept for comparing with it later:
+
+            before = book.summary().copy()
+            ...
+            changed_uids = book.summary().diff(before)
+        """
+        if self._summary is None:
+            self._summary = Summary()
+            self.watch(self._summary)
+        self._summary.refresh(self)
+        return self._summary
+
+    def get(self, uid, default=None):
+        """Return the entry with the given uid (or default if there is no such entry)"""
+        return self._by_uid.get(uid, default)
+
+    def _adopt(self, items):
+        """Give uids to the entries added to the AddressBook and start tracking their changes"""
+        self.generation += 1
+        self._members_changed = self.generation
+        changed, removed, by_uid = self._changed, self._removed, self._by_uid
+        uids = []
+        for p in items:
+            d = p.__dict__
+            uid = d.get('uid')
+            if uid is not None and by_uid.get(uid) is p:
+                self._repeated[uid] = self._repeated.get(uid, 0) + 1
+            # entries keep their uids when they get back to the AddressBook (e.g. on undo) or are moved
+            # from another AddressBook, unless the uid is already used here
+            elif uid is None or uid in by_uid or removed.get(uid, p) is not p:
+                uid = d['uid'] = self._next_uid
+                self._next_uid += 1
+            elif uid >= self._next_uid:
+                self._next_uid = uid + 1
+            d['_owner'] = self
+            by_uid[uid] = p
+            changed[uid] = p
+            uids.append(uid)
+            if removed:
+                removed.pop(uid, None)
+        self._log(uids)
+        self.history.record(('ins', list(items)))
+
+    def _release(self, positions, items):
+        """Stop tracking changes of the entries removed from the AddressBook
+
+        Attributes:
+            positions (list): Positions the entries have been removed from, in ascending order
+            items (list): Removed entries
+        """
+        self.generation += 1
+        self._members_changed = self.generation
+        changed, removed, by_uid, repeated = self._changed, self._removed, self._by_uid, self._repeated
+        for p in items:
+            uid = p.uid
+            # the entry is still held at another place of the AddressBook
+            if repeated and uid in repeated:
+                repeated[uid] -= 1
+                if not repeated[uid]:
+                    del repeated[uid]
+                changed[uid] = p
+                continue
+            if p.__dict__.get('_owner') is self:
+                p.__dict__['_owner'] = None
+            del by_uid[uid]
+            changed.pop(uid, None)
+            removed[uid] = p
+        self._log([p.uid for p in items])
+        self.history.record(('del', positions, items))
+
+    def _entry_changed(self, person, old):
+        """Called by a Person held by the AddressBook whenever any of its attributes is set.
+
+        Attributes:
+            person (Person): Modified entry
+            old (dict): Names of the changed attributes and their previous values
+        """
+        self.generation += 1
+        self._changed[person.uid] = person
+        self._log((person.uid,))
+        for key in old:
+            self._touched[key] = self.generation
+        self.history.record(('set', person, old))
+
+    def _revert(self, step):
+        """Reverse a step recorded in the History and return the step reversing it back"""
+
+        kind = step[0]
+        if kind == 'set':
+            _, person, old = step
+            new = {k: person.__dict__.get(k) for k in old}
+            person._assign(old)
+            return 'set', person, new
+        elif kind == 'del':
+            _, positions, items = step
+            self._insert_at(positions, items)
+            self._adopt(items)
+            return 'ins', items
+        elif kind == 'ins':
+            positions, items = self._remove_uids({p.uid for p in step[1]})
+            self._release(positions, items)
+            return 'del', positions, items
+        else:
+            return 'group', [self._revert(s) for s in reversed(step[1])]
+
+    def undo(self):
+        """Undo the last change made to the AddressBook. Return False if there is nothing to undo."""
+        return self.history.undo(self._revert)
+
+    def redo(self):
+        """Redo the last undone change. Return False if there is nothing to redo."""
+        return self.history.redo(self._revert)
+
     @staticmethod
     def check(obj):
         if not isinstance(obj, Person):
@@ -23,23 +404,150 @@ class AddressBook(list):
             return obj
 
     def append(self, obj):
-        return super().append(self.check(obj))
+        super().append(self.check(obj))
+        self._adopt((obj,))
 
     def insert(self, index, obj):
-        return super().insert(index, self.check(obj))
+        super().insert(index, self.check(obj))
+        self._adopt((obj,))
 
     def extend(self, iterable):
-        return super().extend([self.check(i) for i in iterable])
+        self.bulk_add(iterable)
+
+    def bulk_add(self, iterable):
+        """Add many entries at once. The entries are validated as a batch before any of them is added,
+        and the change log, caches and History are updated once for the whole batch.
+
+        Attributes:
+            iterable (iterable): Person objects to be added
+        """
+
+        items = list(iterable)
+        # checking types of the whole batch at once is much cheaper than checking every item separately
+        if not all(issubclass(t, Person) for t in set(map(type, items))):
+            for i in items:
+                self.check(i)
+        if items:
+            super().extend(items)
+            self._adopt(items)
+
+    def bulk_remove(self, items):
+        """Remove many entries at once and return the number of removed entries. Entries are matched by
+        identity (not by equal name and surname) and removed in a single pass over the AddressBook.
+        The change log, caches and History are updated once for the whole batch.
+
+        Attributes:
+            items (iterable): Person objects to be removed
+        """
+
+        by_uid = self._by_uid
+        positions, removed = self._remove_uids({p.uid for p in items if by_uid.get(p.uid) is p})
+        if removed:
+            self._release(positions, removed)
+        return len(removed)
+
+    def _renumber(self, person):
+        """Give the entry a new uid, e.g. when its uid has been taken by an entry saved by somebody else.
+        It is logged as removed and added again, so caches drop it under the old uid."""
+        uid = person.uid
+        positions, items = self._remove_uids({uid})
+        self._release(positions, items)
+        # the old uid no longer refers to the entry, so another entry can take it
+        del self._removed[uid]
+        person.__dict__['uid'] = None
+        self._insert_at(positions, items)
+        self._adopt(items)
+
+    def _remove_uids(self, uids):
+        """Remove entries with the given uids without tracking the change.
+        Return positions and the removed entries."""
+        positions = [i for i, p in enumerate(self) if p.uid in uids]
+        items = [self[i] for i in positions]
+        if items:
+            super().__setitem__(slice(None), [p for p in self if p.uid not in uids])
+        return positions, items
+
+    def _insert_at(self, positions, items):
+        """Insert entries at the given (ascending) positions in a single pass, without tracking the change"""
+        merged = []
+        rest = iter(self)
+        for pos, p in zip(positions, items):
+            merged.extend(islice(rest, pos - len(merged)))
+            merged.append(p)
+        merged.extend(rest)
+        super().__setitem__(slice(None), merged)
 
     def __add__(self, other):
-        return super().__add__(self.check(other))
+        # entries belong to one AddressBook at a time, so the new one gets copies of them
+        result = self.__class__()
+        result.bulk_add(ab_merge.copy_entry(p) for p in self)
+        result.bulk_add(ab_merge.copy_entry(self.check(p)) for p in other)
+        return result
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        # like '+', repetitions are made of copies of the entries, so that every entry has its own uid
+        copies = [ab_merge.copy_entry(p) for _ in range(n - 1) for p in self]
+        if n <= 0:
+            self.clear()
+        else:
+            self.bulk_add(copies)
+        return self
 
-    def __setitem__(self, index, obj):
+    def _positions(self, index):
+        """Return positions (in ascending order) and entries for an index or a slice"""
         if isinstance(index, slice):
-            return super().__setitem__(index, [self.check(o) for o in obj])
+            positions = sorted(range(len(self))[index])
         else:
-            return super().__setitem__(index, self.check(obj))
+            positions = [range(len(self))[index]]
+        return positions, [self[i] for i in positions]
 
+    def __setitem__(self, index, obj):
+        items = [self.check(o) for o in obj] if isinstance(index, slice) else [self.check(obj)]
+        positions, old = self._positions(index)
+        with self.history.group():
+            super().__setitem__(index, items if isinstance(index, slice) else obj)
+            self._release(positions, old)
+            self._adopt(items)
+
+    def __delitem__(self, index):
+        positions, old = self._positions(index)
+        super().__delitem__(index)
+        self._release(positions, old)
+
+    def remove(self, obj):
+        """Remove the entry. Like 'index' and 'in', it matches entries by identity, not by equal name and
+        surname, so another entry with the same personid is left in place."""
+        del self[self.index(obj)]
+
+    def index(self, obj, start=0, stop=sys.maxsize):
+        """Return the position of the entry (matched by identity) in the AddressBook"""
+        if obj in self:
+            start, stop, _ = slice(start, stop).indices(len(self))
+            for i, p in enumerate(islice(self, start, stop), start):
+                if p is obj:
+                    return i
+        raise ValueError('{0!r} is not in the AddressBook'.format(obj))
+
+    def __contains__(self, obj):
+        uid = getattr(obj, 'uid', None)
+        return uid is not None and self._by_uid.get(uid) is obj
+
+    def pop(self, index=-1):
+        positions, old = self._positions(index)
+        super().pop(index)
+        self._release(positions, old)
+        return old[0]
+
+    def clear(self):
+        old = self[:]
+        super().clear()
+        self._release(list(range(len(old))), old)
+
+    @metrics.timed('add_new')
     def add_new(self, name, surname, email, phone):
         """Add a new person to the AddressBook by creating a new Person instance.
         Before adding a new item the function checks if there is not anybody
@@ -56,14 +564,14 @@ class AddressBook(list):
 
         # with an empty list there's no need to check for duplicates
         if len(self) == 0:
-            super().append(Person(name, surname, email, phone))
+            self.append(Person(name, surname, email, phone))
             print('{0} {1} has been added to the base.'.format(name.title(), surname.title()))
         else:
             item = self.search_base(personid=c)
             try:
                 # no items with similar name and surname found
                 if item is None:
-                    super().append(Person(name, surname, email, phone))
+                    self.append(Person(name, surname, email, phone))
                     print('{0} {1} has been added to the base.'.format(name.title(), surname.title()))
                 # duplicates found
                 else:
@@ -73,7 +581,7 @@ class AddressBook(list):
                             '\nDo you want to add such a person anyway? y/n '.format(
                                 name.title(), surname.title())).lower()
                         if ask in ('y', 'yes'):
-                            super().append(Person(name, surname, email, phone))
+                            self.append(Person(name, surname, email, phone))
                             print('{0} {1} has been added to the base.'.format(name.title(), surname.title()))
                             break
                         elif ask in ('n', 'no'):
@@ -97,59 +605,112 @@ class AddressBook(list):
         else:
             print('The AddressBook is empty.')
 
-    def sorting(self, att, reverse=None):
-        """Sort the AddressBook by a person's key value
+    @metrics.timed('sorting')
+    def sorting(self, *atts, reverse=None, collation=None):
+        """Sort the AddressBook by one or more person's keys. Entries with a key equal to None are placed after
+        the others (before them in descending order). Sorting doesn't count as a change of the AddressBook.
 
         Attributes:
-            att (str): Person's key
+            *atts (str or (str, bool)): Person's keys, in order of importance. A key can be given together with
+                                        its own order, e.g. ('city', True) for descending order
+            reverse (bool): Sort in descending order (used for keys given without their own order)
+            collation (str): Compare strings in the alphabetical order of a language ('pl' or 'en') instead of
+                             comparing raw characters
         """
-        if reverse is None:
-            return self.sort(key=lambda x: (x.__getattribute__(att) is None, x.__getattribute__(att)))
-        return self.sort(key=lambda x: (x.__getattribute__(att) is None, x.__getattribute__(att)), reverse=True)
 
+        order = sort_order(self, *atts, reverse=reverse, collation=collation)
+        super().__setitem__(slice(None), list(map(self.__getitem__, order)))
+
+    @metrics.timed('search_base')
     def search_base(self, **kwargs):
         """Search through the AddressBook to find the item with the specified key value
         (or a list of items in case of multiple matching returns. Since the 'search_base' uses the 'search' function,
         which is based on binary search, the AddressBook's items are sorted by the keyword attribute given in **kwargs
-        before the search begins.
+        before the search begins. Results are kept in 'query_cache', so a repeated search returns the kept result
+        (without sorting the AddressBook again) until an entry is added or removed or the attribute is changed.
 
         Attributes:
             **kwargs (keyword=str): Key and value of the person being looked for
         """
 
         for (k, v) in kwargs.items():
-            capit = ('name', 'surname', 'city')
-            if k in capit:
-                v = v.title()
-            elif k == 'streetname':
-                v = street_parser(v, '')[0]
-            elif k == 'phone':
-                v = phone_parser(v)[0]
-            elif k == 'birthday':
-                y, m, d = date_parser(v)
-                v = dt.date(y, m, d)
-            elif k in ['year', 'month', 'day']:
-                v = int(v)
-            self.sorting(k)
-            # found items (None, a Person object or list of objects)
-            found = search(self, v, k)
-            return found
-
-    def show_all_results(self):
-        """Print out the details of all the people listed in the AddressBook."""
-
-        twrapper = tw.TextWrapper(width=80, initial_indent='\t', subsequent_indent='\t',
-                                  break_long_words=False)
-
-        ix = 1
-        for s in range(len(self)):
-            print(' <{0}>  '.format(ix))
-            for line in twrapper.wrap(str(self[s].get_details()).replace(',',
-                        ' | ').replace("'", '').replace('[', '').replace(']', '')):
-                print(line)
-            print()
-            ix += 1
+            v = search_value(k, v)
+            query = (k, v)
+            kept = self.query_cache.get(query, max(self._members_changed, self._touched.get(k, 0)))
+            if kept is not None:
+                found = kept[1]
+                scanned = 0
+            else:
+                self.sorting(k)
+                # found items (None, a Person object or list of objects)
+                found = search(self, v, k)
+                scanned = len(self)
+                self.query_cache.put(query, self.generation, found)
+            if metrics.enabled:
+                returned = 0 if found is None else 1 if isinstance(found, Person) else len(found)
+                metrics.items('search_base', scanned, returned)
+            # the kept list is not given away, as callers may change it
+            return found[:] if isinstance(found, list) else found
+
+    @metrics.timed('select')
+    def select(self, query):
+        """Return a list of entries matching a query combining tags and attribute values with AND, OR, NOT
+        and parentheses, e.g. 'customers AND city=Warsaw AND NOT unsubscribed' (see ab_tags).
+        Unlike 'search_base', it doesn't sort the AddressBook, entries are returned in the order they were added.
 
+        Attributes:
+            query (str): Query
+        """
+        found = self._tags().select(query)
+        if metrics.enabled:
+            metrics.items('select', len(self), len(found))
+        return found
+
+    def tag_counts(self):
+        """Return a dict of tags used in the AddressBook and numbers of entries having them"""
+        return self._tags().tags()
+
+    def _tags(self):
+        if self._tag_index is None:
+            self._tag_index = ab_tags.TagIndex(self)
+        return self._tag_index
+
+    def statistics(self, today=None):
+        """Return statistics of the whole AddressBook: age distribution, birth-month histogram,
+        average/median age per city and counts of missing fields (see 'ab_analytics.compute_stats').
+        The result is cached until the AddressBook or any of its entries changes.
+
+        Attributes:
+            today (datetime.date): Date the ages are calculated for (defaults to today's date)
+        """
+
+        if today is None:
+            today = dt.date.today()
+        key = (self.generation, today)
+        if self._stats_cache is None or self._stats_cache[0] != key:
+            if metrics.enabled:
+                metrics.miss('statistics')
+            self._stats_cache = (key, compute_stats(self, today))
+        elif metrics.enabled:
+            metrics.hit('statistics')
+        return self._stats_cache[1]
+
+    def show_all_results(self, paged=None):
+        """Print out the details of all the people listed in the AddressBook.
+        Formatted details of every person are cached until the person changes.
+
+        Attributes:
+            paged (bool): Whether to show the people page by page (by default only on a terminal)
+        """
+
+        if paged is None:
+            paged = sys.stdout.isatty()
+        if paged:
+            page(self)
+        else:
+            write_all(self)
+
+    @metrics.timed('removal')
     def removal(self, **kwargs):
         """Remove an item (with a key value specified by user) from the AddressBook.
         In order to remove the item, it checks if there is a person with such a key value in a list.
@@ -170,7 +731,7 @@ class AddressBook(list):
         try:
             # single item found
             if isinstance(found, Person):
-                self.remove(found)
+                self.bulk_remove([found])
             # multiple items found
             elif len(found) > 1:
                 raise Multiple(len(found))
@@ -188,20 +749,22 @@ class AddressBook(list):
                     if ask in ('n', 'no'):
                         break
                     elif ask == 'a':
-                        for j in found:
-                            self.remove(j)
+                        # removed in one pass, and undone in one step
+                        self.bulk_remove(found)
                         print("All requested elements have been removed.")
                         break
                     elif int(ask) in range(1, len(found) + 1):
-                        self.remove(found[int(ask) - 1])
+                        self.bulk_remove([found[int(ask) - 1]])
                         break
                     else:
                         raise ValueError
                 except ValueError:
                     print("{0} is not a proper input. Choose the person's number.".format(ask))
 
+    @metrics.timed('pickle_base')
     def pickle_base(self, filename=None):
-        """Save AddressBook as a pickle file.
+        """Save AddressBook as a pickle file. '.pkl' is added to the name unless it already ends with it
+        (so the file opened as 'contacts.pkl' is saved as 'contacts.pkl', not 'contacts.pkl.pkl').
 
         Attributes:
             filename (str) - File saving name
@@ -210,19 +773,133 @@ class AddressBook(list):
         if filename is None:
             # default filename containing saving time
             abook_name = 'abook' + time.strftime('%Y-%m-%d') + '.pkl'
+        elif filename.endswith('.pkl'):
+            abook_name = filename
         else:
-
             abook_name = filename + '.pkl'
 
-        abook_file = open(abook_name, 'wb')
-        pickle.dump(self, abook_file, 2)
-        abook_file.close()
-
+        self._save(abook_name)
         self.filename = abook_name
 
-    def pickle_changes(self):
-        """Save changes made to an opened file."""
+    @metrics.timed('pickle_changes')
+    def pickle_changes(self, resolve=None):
+        """Save changes made to an opened file.
+        If the file has been saved by somebody else since it was opened, their changes are merged first:
+        entries changed only there are updated here, entries changed only here are kept. Entries changed
+        (or removed) both here and there are conflicts, settled by the 'resolve' function. Without it,
+        SaveConflict is raised and nothing is changed or saved.
+
+        Attributes:
+            resolve (function): Function called with a pair of conflicting entries (the one here and the one
+                                in the file, None if removed), returning True to keep the one here
+        """
+
+        self._save(self.filename, merge=True, resolve=resolve)
+
+    def _save(self, path, merge=False, resolve=None):
+        """Save the AddressBook holding the lock of the file, merging changes saved there in the meantime"""
+
+        with storage.locked(path) as lock:
+            if merge and os.path.exists(path) and storage.saved_version(lock) != self.version:
+                other = storage.read_book(path)
+                if other.version != self.version:
+                    self.merge_saved(other, resolve)
+            old = self.version
+            self.version = new = old + 1
+            for p in self.dirty_entries():
+                self._revisions[p.uid] = new
+            try:
+                storage.write_book(self, path, lock)
+            except BaseException:
+                self.version = old
+                raise
+        self.mark_saved()
+
+    @metrics.timed('diff')
+    def diff(self, other):
+        """Compare the AddressBook with another one and return ab_merge.Diff (entries added, removed and changed
+        in the other book)"""
+        return ab_merge.diff(self, other)
+
+    @metrics.timed('merge')
+    def merge(self, other, prefer='mine', delete=False):
+        """Bring entries of another AddressBook into this one and return ab_merge.MergeReport.
+        The merge can be undone at once.
+
+        Attributes:
+            other (sequence): AddressBook or other Person objects merged into this one (they are copied)
+            prefer (str/function): 'mine', 'theirs', 'fill', 'both' or a function settling changed entries
+                                   (see ab_merge)
+            delete (bool): Whether entries missing in the other book are removed
+        """
+        return ab_merge.merge(self, other, prefer, delete)
+
+    def merge_saved(self, other, resolve=None):
+        """Bring in the changes saved in the AddressBook's file by somebody else (see 'pickle_changes').
+        Changes made here since the last save are kept, the merged AddressBook still has to be saved.
 
-        base_file = open(self.filename, 'wb')
-        pickle.dump(self, base_file, 2)
-        base_file.close()
+        Attributes:
+            other (AddressBook): AddressBook loaded from the file
+            resolve (function): Function settling conflicts (see 'pickle_changes')
+        """
+
+        base, known = self.version, self._saved_next_uid
+        changed, removed = self.changes_since(self._saved_generation)
+        mine = {p.uid for p in changed}
+        mine.update(p.uid for p in removed)
+        theirs = {uid for uid, version in other._revisions.items() if version > base}
+
+        def values(p):
+            return {k: v for k, v in p.__dict__.items() if not k.startswith('_') and k != 'uid'}
+
+        updates, additions, removals, conflicts, collisions = [], [], [], [], []
+        for uid, p in other._by_uid.items():
+            here = self._by_uid.get(uid)
+            if uid >= known:
+                # added there - the saved entry keeps its uid, an entry added here with the same uid gets a new one
+                if here is None:
+                    additions.append(p)
+                elif uid in mine:
+                    collisions.append(here)
+                    additions.append(p)
+            elif uid not in theirs:
+                continue
+            elif uid not in mine:
+                if here is not None:
+                    updates.append((here, p))
+            elif here is None or here.fingerprint != p.fingerprint:
+                conflicts.append((here if here is not None else self._removed.get(uid), here, p))
+        for uid, here in self._by_uid.items():
+            if uid < known and uid not in other._by_uid:
+                # removed there
+                if uid in mine:
+                    conflicts.append((here, here, None))
+                else:
+                    removals.append(here)
+
+        if conflicts and resolve is None:
+            raise SaveConflict([(here, there) for _, here, there in conflicts])
+        for entry, here, there in conflicts:
+            if resolve(here, there):
+                continue
+            if there is None:
+                removals.append(here)
+            elif here is None:
+                # the entry removed here comes back with its uid and the values saved there
+                entry._assign(values(there))
+                additions.append(entry)
+            else:
+                updates.append((here, there))
+
+        self._next_uid = max(self._next_uid, other._next_uid)
+        with self.history.group():
+            for here in collisions:
+                self._renumber(here)
+            for here, there in updates:
+                here._assign(values(there))
+            self.bulk_remove(removals)
+            self.bulk_add(additions)
+        self.version = max(self.version, other.version)
+        for uid, version in other._revisions.items():
+            if version > self._revisions.get(uid, 0):
+                self._revisions[uid] = version
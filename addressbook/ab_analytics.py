@@ -0,0 +1,187 @@
+"""This module contains functions used for computing statistics over the whole AddressBook.
+
+All the statistics are computed in one batched pass: birth dates and cities are first gathered into
+year/month/day/city columns and then processed column-wise. NumPy is used when it is available, otherwise
+the same computations are done with plain Python loops over the columns.
+"""
+
+import datetime as dt
+
+from addressbook.ab_helpers import LazyModule
+
+# imported only when statistics are computed, NumPy is optional
+statistics = LazyModule('statistics')
+np = LazyModule('numpy', optional=True)
+
+# optional attributes counted by the 'missing' part of statistics
+OPTIONAL_FIELDS = ('birthday', 'city', 'streetname', 'streetnumber')
+
+# width (in years) of a single bucket of the age distribution
+AGE_BUCKET = 10
+
+
+def collect_columns(people):
+    """Gather birth dates, cities and missing-field counts of the people into columns.
+
+    Attributes:
+        people (iterable): Person objects
+
+    Returns a tuple (years, months, days, cities, missing, count). Only people with a birthday set
+    are included in the year/month/day/city columns.
+    """
+
+    years, months, days, cities = [], [], [], []
+    missing = dict.fromkeys(OPTIONAL_FIELDS, 0)
+    count = 0
+
+    for p in people:
+        count += 1
+        for field in OPTIONAL_FIELDS:
+            if getattr(p, field) is None:
+                missing[field] += 1
+        if p.birthday is not None:
+            years.append(p.year)
+            months.append(p.month)
+            days.append(p.day)
+            cities.append(p.city)
+
+    return years, months, days, cities, missing, count
+
+
+def _bucket_label(start):
+    return '{0}-{1}'.format(start, start + AGE_BUCKET - 1)
+
+
+def _summary(count, mean, med, low, high):
+    if count:
+        mean, med = float(mean), float(med)
+    return {'count': count, 'mean': mean, 'median': med, 'min': low, 'max': high}
+
+
+def _stats_python(years, months, days, cities, today):
+    """Column-wise computations done with plain Python"""
+
+    ty, now = today.year, (today.month, today.day)
+    born = [(ty - y - ((m, d) > now), c) for y, m, d, c in zip(years, months, days, cities)]
+    # people whose birthday lies ahead of today's date are left out of the age statistics
+    born = [(a, c) for a, c in born if a >= 0]
+    ages = sorted(a for a, _ in born)
+
+    birth_months = [0] * 12
+    for m in months:
+        birth_months[m - 1] += 1
+
+    distribution = {}
+    for a in ages:
+        start = a // AGE_BUCKET * AGE_BUCKET
+        distribution[start] = distribution.get(start, 0) + 1
+
+    by_city = {}
+    for a, c in born:
+        if c is not None:
+            by_city.setdefault(c, []).append(a)
+
+    age = _summary(len(ages), sum(ages) / len(ages), statistics.median(ages), ages[0], ages[-1]) if ages else \
+        _summary(0, None, None, None, None)
+    cities = {c: _summary(len(v), sum(v) / len(v), statistics.median(v), min(v), max(v)) for c, v in by_city.items()}
+    return age, distribution, birth_months, cities
+
+
+def _stats_numpy(years, months, days, cities, today):
+    """Column-wise computations done with NumPy"""
+
+    y = np.asarray(years, dtype=np.int64)
+    m = np.asarray(months, dtype=np.int64)
+    d = np.asarray(days, dtype=np.int64)
+    all_ages = today.year - y - ((m > today.month) | ((m == today.month) & (d > today.day)))
+    born = all_ages >= 0
+    ages = all_ages[born]
+
+    birth_months = np.bincount(m - 1, minlength=12).tolist() if len(m) else [0] * 12
+
+    distribution = {}
+    if len(ages):
+        starts, counts = np.unique(ages // AGE_BUCKET * AGE_BUCKET, return_counts=True)
+        distribution = dict(zip(starts.tolist(), counts.tolist()))
+        age = _summary(int(len(ages)), ages.mean(), np.median(ages), int(ages.min()), int(ages.max()))
+    else:
+        age = _summary(0, None, None, None, None)
+
+    by_city = {}
+    known = [i for i, (c, b) in enumerate(zip(cities, born.tolist())) if b and c is not None]
+    if known:
+        city_col = np.asarray([cities[i] for i in known], dtype=object)
+        city_ages = all_ages[known]
+        names, codes = np.unique(city_col, return_inverse=True)
+        # sort by city, then by age, so that every city is a contiguous, ordered run of ages
+        order = np.lexsort((city_ages, codes))
+        sorted_ages = city_ages[order]
+        counts = np.bincount(codes, minlength=len(names))
+        sums = np.bincount(codes, weights=city_ages, minlength=len(names))
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        for name, c, s, lo, hi in zip(names.tolist(), counts.tolist(), sums.tolist(), starts.tolist(),
+                                      ends.tolist()):
+            run = sorted_ages[lo:hi]
+            mid = c // 2
+            med = run[mid] if c % 2 else (run[mid - 1] + run[mid]) / 2
+            by_city[name] = _summary(c, s / c, med, int(run[0]), int(run[-1]))
+
+    return age, distribution, birth_months, by_city
+
+
+def compute_stats(people, today=None, use_numpy=None):
+    """Compute statistics over the given people: age distribution, birth-month histogram,
+    average/median age per city and counts of missing fields.
+
+    Attributes:
+        people (iterable): Person objects
+        today (datetime.date): Date the ages are calculated for (defaults to today's date)
+        use_numpy (bool): Force (True) or forbid (False) using NumPy. By default NumPy is used if available
+    """
+
+    if today is None:
+        today = dt.date.today()
+    if use_numpy is None:
+        use_numpy = bool(np)
+    elif use_numpy and not np:
+        raise ImportError("NumPy is not installed.")
+
+    years, months, days, cities, missing, count = collect_columns(people)
+
+    if use_numpy:
+        age, distribution, birth_months, by_city = _stats_numpy(years, months, days, cities, today)
+    else:
+        age, distribution, birth_months, by_city = _stats_python(years, months, days, cities, today)
+
+    return {'count': count,
+            'today': today.isoformat(),
+            'age': age,
+            'age_distribution': {_bucket_label(k): distribution[k] for k in sorted(distribution)},
+            'birth_months': dict(zip(range(1, 13), birth_months)),
+            'age_by_city': {c: by_city[c] for c in sorted(by_city)},
+            'missing': missing}
+
+
+def format_stats(stats):
+    """Return human readable representation of statistics computed by 'compute_stats'"""
+
+    def num(v):
+        return '-' if v is None else '{0:.1f}'.format(v)
+
+    age = stats['age']
+    lines = ['People: {0}'.format(stats['count']),
+             'People with known age: {0}'.format(age['count']),
+             'Age: mean {0}, median {1}, min {2}, max {3}'.format(num(age['mean']), num(age['median']),
+                                                                  age['min'], age['max']),
+             '', 'Age distribution:']
+    lines.extend('\t{0:>7s}: {1}'.format(k, v) for k, v in stats['age_distribution'].items())
+    lines.extend(['', 'Birthdays by month:'])
+    lines.extend('\t{0:>7s}: {1}'.format(dt.date(2000, k, 1).strftime('%b'), v)
+                 for k, v in stats['birth_months'].items())
+    lines.extend(['', 'Age by city:'])
+    lines.extend('\t{0}: {1} people, mean {2}, median {3}'.format(c, s['count'], num(s['mean']), num(s['median']))
+                 for c, s in stats['age_by_city'].items())
+    lines.extend(['', 'Missing fields:'])
+    lines.extend('\t{0}: {1}'.format(k, v) for k, v in stats['missing'].items())
+    return '\n'.join(lines)
@@ -0,0 +1,179 @@
+"""This module contains Bloom filters of saved AddressBooks, used for checking whether a person is in a book
+without loading it.
+
+Every save writes a filter of personids, e-mail addresses and phone numbers of all the entries to a file
+kept next to the AddressBook file ('contacts.pkl.bloom'). A filter answers 'no' for certain and 'yes' with
+the false positive rate chosen when it was written (AddressBook.bloom_error_rate, 1% by default), so a
+negative lookup across many archived books doesn't unpickle any of them. The filter file is not read as
+a whole either: it is mapped into memory and only the few bytes holding the bits of the looked up values
+are read.
+
+The filter file records the size and modification time of the AddressBook file it was written for.
+A filter that doesn't match its AddressBook file (e.g. the file has been replaced by an older copy) is
+ignored, and the book is loaded instead.
+"""
+
+import math
+import os
+import struct
+
+from addressbook.ab_helpers import LazyModule
+from addressbook.ab_parsers import phone_parser
+
+# imported on first use
+hashlib = LazyModule('hashlib')
+mmap = LazyModule('mmap')
+tempfile = LazyModule('tempfile')
+
+# default rate of false positives
+ERROR_RATE = 0.01
+
+# magic, format version, number of bits, number of hash functions, number of values, mtime_ns and size
+# of the AddressBook file
+_HEADER = struct.Struct('<4sBQQQqQ')
+_MAGIC = b'ABBF'
+_VERSION = 1
+
+
+def filter_path(path):
+    """Return the path of the Bloom filter file of the AddressBook file"""
+    return path + '.bloom'
+
+
+def person_keys(person):
+    """Return values of the Person put into filters: personid, e-mail and phone (with and without the area code)"""
+    keys = ['id:' + person.personid, 'email:' + person.email.strip().lower(), 'phone:' + person.phone]
+    if person.phone_area:
+        keys.append('phone:' + person.phone_area + person.phone)
+    return keys
+
+
+def query_keys(name=None, surname=None, email=None, phone=None):
+    """Return values looked up in filters for a person with all the given details. Name and surname are
+    given together. The phone number is parsed like the numbers of the entries (see 'person_keys'), so it
+    can be written in any form accepted by Person, with or without the area code."""
+    keys = []
+    if name or surname:
+        if not (name and surname):
+            raise ValueError("Name and surname have to be given together")
+        keys.append('id:{0}_{1}'.format(surname.lower().title(), name.lower().title()))
+    if email:
+        keys.append('email:' + email.strip().lower())
+    if phone:
+        number, area, _ = phone_parser(phone)
+        keys.append('phone:' + area + number)
+    if not keys:
+        raise ValueError("Nothing to look for")
+    return keys
+
+
+def _positions(key, bits, hashes):
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class BloomFilter(object):
+    """Bloom filter of strings
+
+    Attributes:
+        capacity (int): Number of values the filter is sized for
+        error_rate (float): Rate of false positives with 'capacity' values in the filter
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.count = 0
+        self._data = bytearray((self.bits + 7) // 8)
+
+    def add(self, key):
+        data = self._data
+        for pos in _positions(key, self.bits, self.hashes):
+            data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return _contains(self._data, key, self.bits, self.hashes)
+
+    def write(self, f, mtime_ns=0, size=0):
+        f.write(_HEADER.pack(_MAGIC, _VERSION, self.bits, self.hashes, self.count, mtime_ns, size))
+        f.write(self._data)
+
+
+def _contains(data, key, bits, hashes, offset=0):
+    return all(data[offset + (pos >> 3)] & (1 << (pos & 7)) for pos in _positions(key, bits, hashes))
+
+
+def write_filter(book, path, error_rate=ERROR_RATE):
+    """Write the filter of the AddressBook saved in the file. Must be called after the book is saved, holding
+    the lock of the file (see ab_storage.write_book).
+
+    Attributes:
+        book (iterable): Person objects
+        path (str): AddressBook file
+        error_rate (float): Rate of false positives
+    """
+
+    keys = [k for p in book for k in person_keys(p)]
+    bloom = BloomFilter(len(keys), error_rate)
+    for key in keys:
+        bloom.add(key)
+    stat = os.stat(path)
+    target = filter_path(path)
+    fd, temp = tempfile.mkstemp(prefix='.' + os.path.basename(target), dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            bloom.write(f, stat.st_mtime_ns, stat.st_size)
+        os.chmod(temp, stat.st_mode & 0o777)
+        os.replace(temp, target)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+
+def might_contain(path, keys):
+    """Check the filter of the AddressBook file: return False if the book certainly holds nobody with all
+    the values (see 'query_keys'), True if it may hold such a person and None if there is no valid filter"""
+
+    try:
+        stat = os.stat(path)
+        with open(filter_path(path), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if len(data) < _HEADER.size:
+                    return None
+                magic, version, bits, hashes, _, mtime_ns, size = _HEADER.unpack_from(data)
+                if (magic, version, mtime_ns, size) != (_MAGIC, _VERSION, stat.st_mtime_ns, stat.st_size) or \
+                        len(data) < _HEADER.size + (bits + 7) // 8:
+                    return None
+                return all(_contains(data, key, bits, hashes, _HEADER.size) for key in keys)
+    except (OSError, ValueError):
+        return None
+
+
+def contains(book, keys):
+    """Return True if the AddressBook (or any iterable of Person objects) holds a person with all the values"""
+    keys = set(keys)
+    return any(keys.issubset(person_keys(p)) for p in book)
+
+
+def lookup(paths, keys, load):
+    """Look for a person with all the values (see 'query_keys') in AddressBook files. Return a dict of paths
+    and answers: 'no' (certainly not there), 'maybe' (the filter matches) or, for books that have been loaded
+    because they have no valid filter, 'yes' or 'no'.
+
+    Attributes:
+        paths (iterable): AddressBook files
+        keys (list): Values looked for
+        load (function): Function loading an AddressBook file
+    """
+    result = {}
+    for path in paths:
+        found = might_contain(path, keys)
+        if found is None:
+            found = 'yes' if contains(load(path), keys) else 'no'
+        result[path] = 'maybe' if found is True else 'no' if found is False else found
+    return result
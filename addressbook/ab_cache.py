@@ -0,0 +1,149 @@
+"""This module contains caches of the AddressBook: QueryCache, used for keeping results of repeated searches,
+and RecordCache, keeping entries of a lazily opened AddressBook (see ab_lazy).
+
+Results are kept under the normalized query (attribute and the value after 'search_value'), so 'warsaw'
+and 'Warsaw' share one result. A result stays valid until an entry is added to or removed from the
+AddressBook, or an attribute searched by is changed in any entry; changes of other attributes don't
+invalidate it. The AddressBook tells the cache when the attributes were last changed (see 'get').
+"""
+
+import sys
+from collections import OrderedDict
+
+from addressbook import ab_metrics as metrics
+
+
+class QueryCache(object):
+    """Bounded cache of search results, dropping the least recently used ones
+
+    Attributes:
+        name (str): Name the hits and misses are counted under by ab_metrics
+        maxsize (int): Maximum number of results kept (0 turns the cache off)
+        hits (int): Number of results found in the cache
+        misses (int): Number of results looked for but not found (or no longer valid)
+    """
+
+    def __init__(self, name, maxsize=128):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()   # query: (generation, result)
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, query, changed):
+        """Return a tuple (generation, result) kept for the query, or None if there is no valid result.
+        A kept result can be None itself (nothing found).
+
+        Attributes:
+            query (tuple): Normalized query (attribute, value)
+            changed (int): Generation of the AddressBook the searched attribute was last changed in
+        """
+        item = self._results.get(query)
+        if item is not None and item[0] >= changed:
+            self._results.move_to_end(query)
+            self.hits += 1
+            if metrics.enabled:
+                metrics.hit(self.name)
+            return item
+        if item is not None:
+            del self._results[query]
+        self.misses += 1
+        if metrics.enabled:
+            metrics.miss(self.name)
+        return None
+
+    def put(self, query, generation, result):
+        """Keep the result of the query computed at the given generation of the AddressBook"""
+        if not self.maxsize:
+            return
+        self._results[query] = (generation, result)
+        self._results.move_to_end(query)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+
+    def info(self):
+        """Return counters of the cache as a dictionary"""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else None,
+                'size': len(self._results), 'maxsize': self.maxsize}
+
+
+def entry_size(person):
+    """Return approximate memory (bytes) held by a Person: the object, its attributes and their values"""
+    d = person.__dict__
+    return sys.getsizeof(person) + sys.getsizeof(d) + sum(map(sys.getsizeof, d.values()))
+
+
+class RecordCache(object):
+    """Cache of entries materialized from a record file, dropping the least recently used ones when
+    the memory they hold exceeds the budget
+
+    Attributes:
+        name (str): Name the hits and misses are counted under by ab_metrics
+        budget (int): Maximum memory (bytes, see 'entry_size') held by the kept entries
+        size (int): Memory held by the kept entries
+        hits (int): Number of entries found in the cache
+        misses (int): Number of entries looked for but not found
+    """
+
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # position: (entry, size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, position):
+        return position in self._entries
+
+    def get(self, position):
+        """Return the entry kept for the position in the record file, or None"""
+        item = self._entries.get(position)
+        if item is not None:
+            self._entries.move_to_end(position)
+            self.hits += 1
+            if metrics.enabled:
+                metrics.hit(self.name)
+            return item[0]
+        self.misses += 1
+        if metrics.enabled:
+            metrics.miss(self.name)
+        return None
+
+    def peek(self, position):
+        """Return the entry kept for the position (or None) without counting it as used"""
+        item = self._entries.get(position)
+        return item[0] if item is not None else None
+
+    def put(self, position, person):
+        """Keep the entry, dropping the least recently used ones if the budget is exceeded"""
+        old = self._entries.pop(position, None)
+        if old is not None:
+            self.size -= old[1]
+        size = entry_size(person)
+        self._entries[position] = (person, size)
+        self.size += size
+        # the entry just put is kept even if it doesn't fit in the budget by itself
+        while self.size > self.budget and len(self._entries) > 1:
+            _, (_, dropped) = self._entries.popitem(last=False)
+            self.size -= dropped
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def info(self):
+        """Return counters of the cache as a dictionary"""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else None,
+                'entries': len(self._entries), 'size': self.size, 'budget': self.budget}
@@ -0,0 +1,351 @@
+"""This module contains the non-interactive command-line interface of AddressBook.
+
+Unlike MainApp, it doesn't ask any questions: every subcommand works directly on AddressBook files
+and prints its result as a single JSON document, which makes it suitable for scripts and cron jobs:
+
+    addressbook import contacts.pkl new_contacts.csv
+    addressbook search contacts.pkl surname batty
+    addressbook sort contacts.pkl surname name:desc
+    addressbook export contacts.pkl contacts.json
+
+Errors are printed to stderr (also as JSON) and reported with the exit code. With '--metrics FILE',
+counters and timings of the operations run by the command (see ab_metrics) are written to the file.
+With '--profile DIR', the command is profiled (see ab_profile).
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from addressbook.ab_collation import COLLATIONS, DEFAULT_COLLATION
+from addressbook.ab_export import *
+from addressbook import ab_metrics as metrics
+from addressbook.ab_bloom import contains, lookup, query_keys
+from addressbook.ab_merge import RULES, differences
+from addressbook.ab_profile import ENVIRON, from_environment, profiling
+
+# exit codes
+EXIT_OK = 0             # command succeeded
+EXIT_NOT_FOUND = 1      # search found nothing
+EXIT_USAGE = 2          # invalid command-line arguments (used by argparse)
+EXIT_ERROR = 3          # file couldn't be read or written
+EXIT_REJECTED = 4       # command succeeded, but some of the records were invalid and have been skipped
+
+# attributes that can be used for finding duplicates
+# what 'dedupe' compares: the whole content of the entries (see Person.fingerprint) or a single attribute
+DEDUPE_KEYS = ('content', 'personid', 'email', 'phone')
+
+
+def _rejected(source, rejected):
+    return [{'file': source, 'record': number, 'error': error} for number, error in rejected]
+
+
+def _open_or_create(path):
+    return load_book(path) if os.path.exists(path) else AddressBook()
+
+
+def cmd_import(args):
+    """Add people from CSV or JSON files to the AddressBook (created if it doesn't exist)"""
+
+    book = _open_or_create(args.book)
+    imported, rejected = 0, []
+    for source in args.sources:
+        people, bad = read_people(source, args.format, workers=args.workers)
+        book.bulk_add(people)
+        imported += len(people)
+        rejected.extend(_rejected(source, bad))
+    save_book(book, args.book)
+    result = {'imported': imported, 'rejected': rejected, 'count': len(book)}
+    return result, EXIT_REJECTED if rejected else EXIT_OK
+
+
+def cmd_export(args):
+    """Write people from the AddressBook to a CSV or JSON file"""
+
+    book = load_book(args.book)
+    write_people(book, args.target, args.format)
+    return {'exported': len(book), 'target': args.target}, EXIT_OK
+
+
+def cmd_search(args):
+    """Print people with the given value of the attribute"""
+
+    book = load_book(args.book)
+    found = book.search_base(**{args.attribute: args.value})
+    if found is None:
+        found = []
+    elif isinstance(found, Person):
+        found = [found]
+    records = []
+    for person in found:
+        record = person_record(person)
+        record['uid'] = person.uid
+        records.append(record)
+    return {'found': len(records), 'people': records}, EXIT_OK if records else EXIT_NOT_FOUND
+
+
+def cmd_select(args):
+    """Print people matching a query combining tags and attribute values"""
+
+    records = []
+    for person in load_book(args.book).select(args.query):
+        record = person_record(person)
+        record['uid'] = person.uid
+        record['tags'] = sorted(person.tags)
+        records.append(record)
+    return {'found': len(records), 'people': records}, EXIT_OK if records else EXIT_NOT_FOUND
+
+
+def cmd_tag(args):
+    """Add tags to (or remove them from) people matching a query and save the AddressBook"""
+
+    book = load_book(args.book)
+    tags = tag_parser(args.tags)
+    found = book.select(args.query)
+    for person in found:
+        if args.remove:
+            person.untag(*tags)
+        else:
+            person.tag(*tags)
+    save_book(book, args.book)
+    return {'tagged': len(found), 'tags': book.tag_counts()}, EXIT_OK
+
+
+def cmd_exists(args):
+    """Check whether a person is in AddressBook files, loading only the files their Bloom filters don't rule out
+    (and only with --verify)"""
+
+    keys = query_keys(args.name, args.surname, args.email, args.phone)
+    loaded = []
+
+    def load(path):
+        loaded.append(path)
+        return load_book(path)
+
+    books = lookup(args.books, keys, load)
+    if args.verify:
+        for path, answer in books.items():
+            if answer == 'maybe':
+                books[path] = 'yes' if contains(load(path), keys) else 'no'
+    found = [path for path, answer in books.items() if answer != 'no']
+    result = {'books': books, 'found': found, 'loaded': len(loaded)}
+    return result, EXIT_OK if found else EXIT_NOT_FOUND
+
+
+def cmd_sort(args):
+    """Sort the AddressBook and save it (to the same or another file)"""
+
+    keys = [sort_key(key) for key in args.keys]
+    book = load_book(args.book)
+    book.sorting(*keys, collation=args.collation)
+    save_book(book, args.output or args.book)
+    return {'sorted': len(book), 'keys': args.keys, 'target': book.filename}, EXIT_OK
+
+
+def cmd_stats(args):
+    """Print statistics of the AddressBook"""
+
+    book = load_book(args.book)
+    today = None
+    if args.today:
+        y, m, d = (int(x) for x in args.today.split('-'))
+        today = dt.date(y, m, d)
+    return book.statistics(today), EXIT_OK
+
+
+def cmd_dedupe(args):
+    """Remove people repeating the content of another entry (or the value of an attribute), keeping the first
+    of them"""
+
+    book = load_book(args.book)
+    key = 'fingerprint' if args.by == 'content' else args.by
+    seen, duplicates = set(), []
+    for person in book:
+        value = getattr(person, key)
+        if value in seen:
+            duplicates.append(person)
+        else:
+            seen.add(value)
+    book.bulk_remove(duplicates)
+    if not args.dry_run:
+        save_book(book, args.book)
+    result = {'removed': len(duplicates), 'count': len(book), 'saved': not args.dry_run,
+              'duplicates': [person_record(p) for p in duplicates]}
+    return result, EXIT_OK
+
+
+def cmd_diff(args):
+    """Print people added, removed and changed in the other AddressBook"""
+
+    d = load_book(args.book).diff(load_book(args.other))
+    result = d.summary()
+    if not args.summary:
+        result['added'] = [person_record(p) for p in d.added]
+        result['removed'] = [person_record(p) for p in d.removed]
+        result['changed'] = [{'mine': person_record(a), 'theirs': person_record(b), 'fields': differences(a, b)}
+                             for a, b in d.changed]
+    return result, EXIT_OK
+
+
+def cmd_merge(args):
+    """Merge the other AddressBook into the first one and save it (to the same or another file)"""
+
+    book = load_book(args.book)
+    report = book.merge(load_book(args.other), args.prefer, args.delete)
+    save_book(book, args.output or args.book)
+    result = report.summary()
+    result.update(count=len(book), target=book.filename)
+    return result, EXIT_OK
+
+
+def cmd_convert(args):
+    """Convert a file between pickle, CSV and JSON formats"""
+
+    source_fmt, target_fmt = file_format(args.source), file_format(args.target)
+    rejected = []
+    if source_fmt == 'pkl':
+        people = load_book(args.source)
+    else:
+        people, rejected = read_people(args.source, workers=args.workers)
+    if target_fmt == 'pkl':
+        if not isinstance(people, AddressBook):
+            book = AddressBook()
+            book.bulk_add(people)
+            people = book
+        save_book(people, args.target)
+    else:
+        write_people(people, args.target)
+    result = {'converted': len(people), 'rejected': _rejected(args.source, rejected), 'target': args.target}
+    return result, EXIT_REJECTED if rejected else EXIT_OK
+
+
+def build_parser():
+    """Return the parser of command-line arguments"""
+
+    parser = argparse.ArgumentParser(prog='addressbook', description='AddressBook 1.0 - batch operations on '
+                                     'AddressBook files. Every command prints its result as JSON.')
+    parser.add_argument('--metrics', metavar='FILE', help='write counters and timings of the operations as JSON')
+    parser.add_argument('--profile', metavar='DIR', default=from_environment(),
+                        help='write profiles and memory reports to the directory (default: ${0})'.format(ENVIRON))
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    p = commands.add_parser('import', help='add people from CSV or JSON files to an AddressBook')
+    p.add_argument('book', help='AddressBook file (.pkl), created if it does not exist')
+    p.add_argument('sources', nargs='+', help='CSV or JSON files')
+    p.add_argument('--format', choices=('csv', 'json'), help='format of the sources (default: by extension)')
+    p.add_argument('--workers', type=int, default=1, help='number of processes parsing the records')
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser('export', help='write people from an AddressBook to a CSV or JSON file')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('target', help='CSV or JSON file')
+    p.add_argument('--format', choices=('csv', 'json'), help='format of the target (default: by extension)')
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser('search', help='find people with the given value of an attribute')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('attribute', choices=SEARCH_KEYS)
+    p.add_argument('value')
+    p.set_defaults(func=cmd_search)
+
+    p = commands.add_parser('select', help='find people with a query combining tags and attribute values')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('query', help="e.g. 'customers AND city=Warsaw AND NOT unsubscribed'")
+    p.set_defaults(func=cmd_select)
+
+    p = commands.add_parser('tag', help='add tags to people matching a query')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('tags', help="comma-separated tags (e.g. 'customers, conference 2026')")
+    p.add_argument('query', help="people to be tagged (e.g. 'city=Warsaw')")
+    p.add_argument('--remove', action='store_true', help='remove the tags instead of adding them')
+    p.set_defaults(func=cmd_tag)
+
+    p = commands.add_parser('exists', help='check whether a person is in AddressBook files without loading them')
+    p.add_argument('books', nargs='+', metavar='book', help='AddressBook files (.pkl)')
+    p.add_argument('--name')
+    p.add_argument('--surname')
+    p.add_argument('--email')
+    p.add_argument('--phone')
+    p.add_argument('--verify', action='store_true', help="load the books the filters can't rule out, "
+                                                         "to give a certain answer")
+    p.set_defaults(func=cmd_exists)
+
+    p = commands.add_parser('sort', help='sort an AddressBook')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('keys', nargs='+', metavar='key', help="attribute, optionally followed by ':desc' "
+                                                          "(e.g. 'surname name city:desc')")
+    p.add_argument('--collation', choices=sorted(COLLATIONS), default=DEFAULT_COLLATION)
+    p.add_argument('--output', '-o', help='save the sorted AddressBook to another file')
+    p.set_defaults(func=cmd_sort)
+
+    p = commands.add_parser('stats', help='print statistics of an AddressBook')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('--today', help='date the ages are calculated for (YYYY-MM-DD)')
+    p.set_defaults(func=cmd_stats)
+
+    p = commands.add_parser('dedupe', help='remove entries repeating another entry')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('--by', choices=DEDUPE_KEYS, default='content',
+                   help='compare whole entries (default) or one attribute, e.g. personid (name and surname)')
+    p.add_argument('--dry-run', action='store_true', help="only report duplicates, don't save the AddressBook")
+    p.set_defaults(func=cmd_dedupe)
+
+    p = commands.add_parser('diff', help='compare two AddressBooks')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('other', help='AddressBook file (.pkl) compared with the first one')
+    p.add_argument('--summary', action='store_true', help='only print numbers of added, removed and changed people')
+    p.set_defaults(func=cmd_diff)
+
+    p = commands.add_parser('merge', help='merge an AddressBook into another one')
+    p.add_argument('book', help='AddressBook file (.pkl) the other one is merged into')
+    p.add_argument('other', help='AddressBook file (.pkl)')
+    p.add_argument('--prefer', choices=RULES, default='mine',
+                   help='values kept for people changed in the other AddressBook (default: mine)')
+    p.add_argument('--delete', action='store_true', help='remove people missing in the other AddressBook')
+    p.add_argument('--output', '-o', help='save the merged AddressBook to another file')
+    p.set_defaults(func=cmd_merge)
+
+    p = commands.add_parser('convert', help='convert between pickle, CSV and JSON files')
+    p.add_argument('source')
+    p.add_argument('target')
+    p.add_argument('--workers', type=int, default=1, help='number of processes parsing CSV or JSON records')
+    p.set_defaults(func=cmd_convert)
+
+    return parser
+
+
+def _report(ex):
+    """Print the error as JSON to stderr"""
+    error = str(ex) or ex.__class__.__name__
+    print(json.dumps({'error': error}, ensure_ascii=False), file=sys.stderr)
+
+
+def main(argv=None):
+    """Run the command given in argv (sys.argv by default) and return the exit code"""
+
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        metrics.enabled = True
+    # files that can't be read (including undecodable or malformed contents) are file errors,
+    # other invalid values (keys, dates, queries) come from the arguments
+    try:
+        try:
+            with profiling(args.profile):
+                result, code = args.func(args)
+        finally:
+            if args.metrics:
+                metrics.dump(args.metrics)
+    except (BaseError, OSError, EOFError, pickle.UnpicklingError, UnicodeError, json.JSONDecodeError) as ex:
+        _report(ex)
+        return EXIT_ERROR
+    except ValueError as ex:
+        _report(ex)
+        return EXIT_USAGE
+    print(json.dumps(result, ensure_ascii=False, default=str))
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""This module contains collations used by AddressBook for sorting entries in language-specific order"""
+
+import unicodedata
+
+from addressbook.ab_exceptions import *
+
+# collation used by the interface if no other is chosen
+DEFAULT_COLLATION = 'pl'
+
+
+class Collation(object):
+    """Language-specific order of strings.
+
+    A collation key of a string is a string that compares in the language's alphabetical order: letters of
+    the alphabet are replaced with consecutive private-use characters (regardless of case), other accented
+    letters are replaced with their base letters. Letter case and the original string only break ties.
+    Keys are computed once per value and kept in 'cache', which is shared by all the AddressBooks.
+    """
+
+    # the cache is cleared when it grows beyond this number of values
+    max_cache = 1 << 20
+
+    def __init__(self, name, alphabet, folds=None):
+        """
+        Attributes:
+            name (str): Name of the collation
+            alphabet (str): Lowercase letters in alphabetical order
+            folds (dict): Letters (outside the alphabet) replaced with other letters before comparing
+        """
+        self.name = name
+        self.table = {}
+        for i, letter in enumerate(alphabet):
+            self.table[ord(letter)] = self.table[ord(letter.upper())] = chr(0xE000 + i)
+        for letter, base in (folds or {}).items():
+            self.table[ord(letter)] = self.table[ord(letter.upper())] = self.table[ord(base)]
+        self.cache = {}
+
+    def __repr__(self):
+        return '<{0}: {1}>'.format(self.__class__.__name__, self.name)
+
+    def _compute(self, value):
+        primary = value.translate(self.table)
+        if not value.isascii():
+            # accents of letters from outside the alphabet are ignored
+            primary = ''.join(c for c in unicodedata.normalize('NFD', primary) if not unicodedata.combining(c))
+            primary = primary.translate(self.table)
+        return primary.lower() + '\0' + value
+
+    def key(self, value):
+        """Return the collation key of a string"""
+        try:
+            return self.cache[value]
+        except KeyError:
+            if len(self.cache) >= self.max_cache:
+                self.cache = {}
+            key = self.cache[value] = self._compute(value)
+            return key
+
+
+COLLATIONS = {'pl': Collation('pl', 'aąbcćdeęfghijklłmnńoópqrsśtuvwxyzźż'),
+              'en': Collation('en', 'abcdefghijklmnopqrstuvwxyz', {'ł': 'l'})}
+
+
+def get_collation(name):
+    """Return collation with the given name ('pl' or 'en')"""
+    try:
+        return COLLATIONS[name.lower()]
+    except KeyError:
+        raise WrongInput("Unknown collation '{0}'. Available collations: {1}".format(
+            name, ', '.join(sorted(COLLATIONS))))
@@ -0,0 +1,401 @@
+"""This module contains the AddressBook daemon: a long-running process that loads an AddressBook once,
+keeps it (and its search indexes) in memory and serves requests over a local Unix domain socket.
+
+Protocol: every message (request or response) is a JSON object encoded in UTF-8, preceded by its length
+as a 4-byte big-endian unsigned integer. A connection can carry any number of requests, each followed by
+its response; a connection idle for IDLE_TIMEOUT seconds is closed by the server. Requests name
+the operation with 'op':
+
+    {"op": "search", "attribute": "surname", "value": "batty"}
+    {"op": "get", "uid": 12}
+    {"op": "add", "person": {"name": "roy", "surname": "batty", "email": "...", "phone": "..."}}
+    {"op": "edit", "uid": 12, "changes": {"city": "Los Angeles"}}
+    {"op": "remove", "uid": 12}
+    {"op": "sort", "keys": ["surname", "name", "city:desc"], "collation": "pl"}
+    {"op": "export", "target": "contacts.csv"}
+    {"op": "save"}
+    {"op": "ping"}
+    {"op": "shutdown"}
+
+Responses have "ok": true and the results, or "ok": false and an "error" message.
+
+Usage:
+    python -m addressbook.ab_daemon serve contacts.pkl [--socket contacts.sock]
+    python -m addressbook.ab_daemon request contacts.sock '{"op": "search", "attribute": "name", "value": "roy"}'
+"""
+
+import argparse
+import copy
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+from addressbook.ab_collation import DEFAULT_COLLATION
+from addressbook.ab_export import *
+from addressbook.ab_index import AttributeIndex
+
+# length of a message, sent before the message itself
+HEADER = struct.Struct('>I')
+
+# maximum length of a single message (bytes)
+MAX_MESSAGE = 64 * 1024 * 1024
+
+# seconds a connection may wait for the next request before the server closes it
+IDLE_TIMEOUT = 60
+
+# attributes that can be changed by 'edit' requests
+EDITABLE = ('name', 'surname', 'email', 'phone', 'birthday', 'city', 'streetname', 'streetnumber', 'street')
+
+
+def encode_message(obj):
+    """Return the object encoded as JSON and preceded by its length"""
+    data = json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+
+def decode_length(header):
+    """Return the length of a message from its header, checking the limit"""
+    length, = HEADER.unpack(header)
+    if length > MAX_MESSAGE:
+        raise WrongInput("Message too long: {0} bytes".format(length))
+    return length
+
+
+def read_message(stream):
+    """Read one message from a binary file-like object. Return None if the stream has ended."""
+
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise EOFError("Connection closed in the middle of a message")
+    length = decode_length(header)
+    data = stream.read(length)
+    if len(data) < length:
+        raise EOFError("Connection closed in the middle of a message")
+    return json.loads(data.decode('utf-8'))
+
+
+class BookService(object):
+    """Operations on an AddressBook kept in memory, carried out for requests of the clients.
+
+    Searches use AttributeIndex objects, created on the first search by an attribute and kept up to
+    date with the changes of the AddressBook, so repeated queries don't sort or scan the AddressBook.
+    """
+
+    # operations that don't change the AddressBook
+    READ_OPS = ('ping', 'get', 'search', 'export')
+    # operations that change the AddressBook or its file
+    WRITE_OPS = ('add', 'edit', 'remove', 'sort', 'save', 'shutdown')
+
+    def __init__(self, path):
+        """
+        Attributes:
+            path (str): AddressBook file (.pkl), created on the first save if it doesn't exist
+        """
+        self.path = path
+        if os.path.exists(path):
+            self.book = load_book(path)
+        else:
+            self.book = AddressBook()
+            self.book.filename = path
+        self.indexes = {}           # attribute: AttributeIndex
+        self.stopped = False        # set by 'shutdown' request
+
+    def handle(self, request):
+        """Carry out the request and return the response"""
+
+        try:
+            op = request.get('op') if isinstance(request, dict) else None
+            if op not in self.READ_OPS + self.WRITE_OPS:
+                raise WrongInput("Unknown operation: {0!r}".format(op))
+            result = getattr(self, 'op_' + op)(request)
+        except (BaseError, ValueError, TypeError, KeyError, AttributeError, OSError) as ex:
+            return {'ok': False, 'error': str(ex) or ex.__class__.__name__}
+        result['ok'] = True
+        return result
+
+    def index(self, attribute):
+        """Return the index of the AddressBook by the attribute"""
+        if attribute not in SEARCH_KEYS:
+            raise WrongInput("Entries cannot be searched by {0!r}".format(attribute))
+        if attribute not in self.indexes:
+            self.indexes[attribute] = AttributeIndex(self.book, attribute)
+        return self.indexes[attribute]
+
+    def entry(self, uid):
+        """Return the entry with the given uid, raise ItemNotFound if there is no such entry"""
+        person = self.book.get(uid)
+        if person is None:
+            raise ItemNotFound('Entry {0}'.format(uid))
+        return person
+
+    @staticmethod
+    def record(person):
+        record = person_record(person)
+        record['uid'] = person.uid
+        return record
+
+    def op_ping(self, request):
+        return {'count': len(self.book), 'generation': self.book.generation, 'modified': self.book.modified}
+
+    def op_get(self, request):
+        return {'person': self.record(self.entry(request['uid']))}
+
+    def op_search(self, request):
+        attribute = request['attribute']
+        found = self.index(attribute).lookup(search_value(attribute, request['value']))
+        return {'found': len(found), 'people': [self.record(p) for p in found]}
+
+    def op_add(self, request):
+        person = record_person(request['person'])
+        self.book.append(person)
+        return {'uid': person.uid}
+
+    def op_edit(self, request):
+        person = self.entry(request['uid'])
+        changes = request['changes']
+        for key in changes:
+            if key not in EDITABLE:
+                raise WrongInput("Attribute {0!r} cannot be changed".format(key))
+        # all the values are checked on a copy first, so that an invalid value doesn't leave the entry
+        # changed only partly
+        trial = copy.copy(person)
+        for key, value in changes.items():
+            setattr(trial, key, value)
+        with self.book.history.group():
+            for key, value in changes.items():
+                setattr(person, key, value)
+        return {'person': self.record(person)}
+
+    def op_remove(self, request):
+        self.book.bulk_remove([self.entry(request['uid'])])
+        return {'count': len(self.book)}
+
+    def op_sort(self, request):
+        keys = [sort_key(key) for key in request['keys']]
+        self.book.sorting(*keys, collation=request.get('collation', DEFAULT_COLLATION))
+        return {'sorted': len(self.book)}
+
+    def op_export(self, request):
+        write_people(self.book, request['target'])
+        return {'exported': len(self.book), 'target': request['target']}
+
+    def op_save(self, request):
+        self.book.pickle_changes()
+        return {'saved': self.book.filename}
+
+    def op_shutdown(self, request):
+        saved = self.book.modified
+        if saved:
+            self.book.pickle_changes()
+        self.stopped = True
+        return {'saved': saved}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        # reads time out, so a client that neither sends requests nor closes the connection is dropped
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def handle(self):
+        server = self.server
+        while not server.service.stopped:
+            try:
+                request = read_message(self.rfile)
+            except (EOFError, ValueError) as ex:
+                self.wfile.write(encode_message({'ok': False, 'error': str(ex)}))
+                return
+            except OSError:
+                # idle for too long or reset by the client
+                return
+            if request is None:
+                return
+            with server.lock:
+                response = server.service.handle(request)
+            self.wfile.write(encode_message(response))
+            self.wfile.flush()
+
+
+class BookServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix domain socket server answering requests with a BookService. Every connection is served by its own
+    thread, so a slow or idle client doesn't hold up the others; requests are carried out one at a time."""
+
+    # threads of connections don't keep the process running after the server is closed
+    daemon_threads = True
+
+    # seconds 'serve' waits for a connection before checking whether the service has been shut down
+    timeout = 0.5
+
+    def __init__(self, service, socket_path, idle_timeout=IDLE_TIMEOUT):
+        """
+        Attributes:
+            service (BookService): Service carrying out the requests
+            socket_path (str): Path of the socket
+            idle_timeout (float): Seconds a connection may wait for the next request before it is closed
+        """
+        self.service = service
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()    # held while the service carries out a request
+        remove_stale_socket(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+
+    def serve(self):
+        """Serve clients until the service gets a 'shutdown' request"""
+        while not self.service.stopped:
+            self.handle_request()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def remove_stale_socket(socket_path):
+    """Remove the socket file left by a server that is no longer running. Raise OSError if a server is
+    still listening on the socket."""
+
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(socket_path)
+            return
+    raise OSError("A server is already listening on {0}".format(socket_path))
+
+
+def default_socket(path):
+    """Return the default socket path for the AddressBook file"""
+    return os.path.splitext(path)[0] + '.sock'
+
+
+class BookClient(object):
+    """Thin client of the AddressBook daemon. Requests are sent over a single connection,
+    opened with the first request and opened again if the server has closed it while it was idle.
+
+    Attributes:
+        socket_path (str): Path of the daemon's socket
+        timeout (float): Timeout of socket operations (seconds)
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._stream.close()
+            self._sock.close()
+            self._sock = self._stream = None
+
+    def request(self, op, **params):
+        """Send a request and return the response. Raise RequestFailed if the request has failed."""
+
+        params['op'] = op
+        message = encode_message(params)
+        # a connection used before may have been closed by the server, which then hasn't read the request
+        reused = self._sock is not None
+        response = self._send(message)
+        if response is None and reused:
+            response = self._send(message)
+        if response is None:
+            raise RequestFailed("The server has closed the connection")
+        if not response.pop('ok'):
+            raise RequestFailed(response['error'])
+        return response
+
+    def _send(self, message):
+        """Send the message and return the response, None if the connection has been closed"""
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(self.timeout)
+            self._sock.connect(self.socket_path)
+            self._stream = self._sock.makefile('rb')
+        try:
+            self._sock.sendall(message)
+            response = read_message(self._stream)
+        except (BrokenPipeError, ConnectionResetError):
+            response = None
+        if response is None:
+            self.close()
+        return response
+
+    def search(self, attribute, value):
+        """Return records of the people with the given value of the attribute"""
+        return self.request('search', attribute=attribute, value=value)['people']
+
+    def get(self, uid):
+        return self.request('get', uid=uid)['person']
+
+    def add(self, record):
+        """Add a person described by a record (see ab_export.FIELDS) and return its uid"""
+        return self.request('add', person=record)['uid']
+
+    def edit(self, uid, **changes):
+        return self.request('edit', uid=uid, changes=changes)['person']
+
+    def remove(self, uid):
+        self.request('remove', uid=uid)
+
+    def save(self):
+        self.request('save')
+
+    def shutdown(self):
+        self.request('shutdown')
+        self.close()
+
+
+def main(argv=None):
+    """Run the daemon or send it a single request, return the exit code"""
+
+    parser = argparse.ArgumentParser(prog='python -m addressbook.ab_daemon',
+                                     description='AddressBook daemon serving requests over a Unix socket')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    p = commands.add_parser('serve', help='load an AddressBook and serve requests until shut down')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('--socket', help='socket path (default: the file name with .sock extension)')
+    p = commands.add_parser('request', help='send a single request and print the response')
+    p.add_argument('socket', help='socket path')
+    p.add_argument('request', help='request as a JSON object')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = BookServer(BookService(args.book), args.socket or default_socket(args.book))
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    request = json.loads(args.request)
+    with BookClient(args.socket) as client:
+        try:
+            response = client.request(request.pop('op', None), **request)
+        except RequestFailed as ex:
+            print(json.dumps({'error': str(ex)}, ensure_ascii=False), file=sys.stderr)
+            return 1
+    print(json.dumps(response, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -53,6 +53,38 @@ class FormatError(BaseError):
         return "Invalid file format. Be sure to choose a file with the '.pkl' extension."
 
 
+class RequestFailed(BaseError):
+    """Exception raised by a client if the AddressBook server couldn't carry out its request
+
+    Attributes:
+        message (str): Error reported by the server
+    """
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class SaveConflict(BaseError):
+    """Exception raised if entries of the AddressBook being saved have also been changed in its file
+    by somebody else
+
+    Attributes:
+        conflicts (list): (entry in the AddressBook, entry in the file) pairs, None for a removed entry
+    """
+
+    def __init__(self, conflicts):
+        Exception.__init__(self)
+        self.conflicts = conflicts
+
+    def __str__(self):
+        return "{0} entries have been changed both here and in the file by somebody else.".format(
+            len(self.conflicts))
+
+
 class WrongInput(ValueError):
     """Exception raised for errors in input.
     """
@@ -0,0 +1,255 @@
+"""This module contains functions used for reading and writing AddressBook files in pickle, CSV and JSON format"""
+
+import json
+import os
+from collections import deque
+
+from addressbook.ab_abook import *
+from addressbook.ab_abook import _restore_book
+from addressbook import ab_metrics as metrics
+
+# imported on first use
+csv = LazyModule('csv')
+futures = LazyModule('concurrent.futures')
+pickle = LazyModule('pickle')
+
+# attributes of a Person written to and read from CSV and JSON files, in order
+FIELDS = ('name', 'surname', 'email', 'phone', 'birthday', 'city', 'streetname', 'streetnumber')
+
+# file formats recognized by the extension of the file name
+FORMATS = ('pkl', 'csv', 'json')
+
+# number of records parsed at once by 'read_people'
+CHUNK_SIZE = 5000
+
+
+def file_format(path, fmt=None):
+    """Return format of the file ('pkl', 'csv' or 'json'), given explicitly or recognized by the extension
+
+    Attributes:
+        path (str): File name
+        fmt (str): Format of the file, if it doesn't follow from the extension
+    """
+    fmt = (fmt or os.path.splitext(path)[1][1:]).lower()
+    if fmt not in FORMATS:
+        raise WrongInput("Unknown format of '{0}'. Available formats: {1}".format(path, ', '.join(FORMATS)))
+    return fmt
+
+
+def person_record(person):
+    """Return a dict of person's attributes (FIELDS) as strings, with None for attributes that haven't been set.
+    The values can be read back by 'record_person'."""
+
+    record = {}
+    for key in FIELDS:
+        value = getattr(person, key)
+        if key == 'phone':
+            value = (person.phone_area or '') + value
+        elif key == 'birthday' and value is not None:
+            value = value.strftime('%d-%m-%Y')
+        elif value is not None:
+            value = str(value)
+        record[key] = value
+    return record
+
+
+def record_person(record):
+    """Create a Person from a dict of attributes. Raise WrongInput if any of the values is invalid.
+
+    Attributes:
+        record (dict): Attribute names (FIELDS) and values; missing and empty optional values are skipped
+    """
+
+    if not record.get('name') or not record.get('surname'):
+        raise WrongInput("Name and surname are obligatory")
+    try:
+        person = Person(record['name'], record['surname'], record.get('email'), record.get('phone'))
+        # street name and number are set together, so that neither of them is parsed without the other
+        if record.get('streetname') and record.get('streetnumber'):
+            person.street = '{0} {1}'.format(record['streetname'], record['streetnumber'])
+        for key in ('birthday', 'city'):
+            if record.get(key):
+                setattr(person, key, record[key])
+    except (AttributeError, TypeError) as ex:
+        raise WrongInput("Invalid record: {0}".format(ex))
+    return person
+
+
+def read_records(path, fmt=None):
+    """Generate (number, record) pairs read from a CSV or JSON file. Records are numbered from 1.
+
+    Attributes:
+        path (str): File name
+        fmt (str): 'csv' or 'json' (by default recognized by the extension)
+    """
+
+    fmt = file_format(path, fmt)
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            records = csv.DictReader(f)
+        elif fmt == 'json':
+            records = json.load(f)
+            if not isinstance(records, list):
+                raise WrongInput("'{0}' doesn't contain a list of records".format(path))
+        else:
+            raise WrongInput("Records can be read only from CSV and JSON files")
+        yield from enumerate(records, 1)
+
+
+@metrics.timed('parse_chunk')
+def parse_chunk(chunk):
+    """Parse and validate a chunk of records. Used by 'read_people', also in worker processes.
+    The parsers are timed here, once for the whole chunk (counters of worker processes are not collected).
+
+    Attributes:
+        chunk (tuple): (number of the first record, [tuple of record's values in FIELDS order, ...])
+
+    Returns a tuple of two lists: values of valid people (see 'Person.to_tuple') and (number, error message)
+    pairs for the invalid records.
+    """
+
+    start, rows = chunk
+    people, rejected = [], []
+    for number, row in enumerate(rows, start):
+        try:
+            people.append(record_person(dict(zip(FIELDS, row))).to_tuple())
+        except WrongInput as ex:
+            rejected.append((number, str(ex)))
+    if metrics.enabled:
+        metrics.items('parse_chunk', len(rows), len(people))
+    return people, rejected
+
+
+def _chunks(records, size):
+    """Group (number, record) pairs into chunks of rows for 'parse_chunk'"""
+    rows, start = [], 1
+    for number, record in records:
+        if not rows:
+            start = number
+        rows.append(tuple([record.get(k) for k in FIELDS]))
+        if len(rows) == size:
+            yield start, rows
+            rows = []
+    if rows:
+        yield start, rows
+
+
+def _parse_parallel(chunks, workers):
+    """Parse chunks in a pool of processes, yielding results in the order of the chunks.
+    Only a few chunks per worker are in progress at a time, so the input is never read into memory whole."""
+
+    with futures.ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(parse_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_people(path, fmt=None, workers=1, chunk_size=CHUNK_SIZE):
+    """Read people from a CSV or JSON file. Return a tuple of two lists: people created from valid records
+    and (number, error message) pairs for the invalid ones.
+
+    Records are parsed and validated in chunks. With more than one worker, chunks are parsed in parallel
+    by a pool of processes, which send back the people as tuples of values (not Person objects).
+    People are returned in the order of the records anyway.
+
+    Attributes:
+        path (str): File name
+        fmt (str): 'csv' or 'json' (by default recognized by the extension)
+        workers (int): Number of processes parsing the records
+        chunk_size (int): Number of records parsed at once
+    """
+
+    chunks = _chunks(read_records(path, fmt), chunk_size)
+    results = _parse_parallel(chunks, workers) if workers > 1 else map(parse_chunk, chunks)
+    from_tuple = Person.from_tuple
+    people, rejected = [], []
+    for values, bad in results:
+        people.extend(map(from_tuple, values))
+        rejected.extend(bad)
+    return people, rejected
+
+
+class _StreamedBook(object):
+    """Stands in for an AddressBook of the people while it is pickled, so that the people are pickled one by
+    one as they come and the AddressBook never has to be built. Unpickled, it is an ordinary AddressBook."""
+
+    def __init__(self, people):
+        self.people = people
+
+    def __reduce_ex__(self, protocol):
+        # the people are appended to an empty AddressBook, then the state is set, which resets the changes
+        return _restore_book, (AddressBook, {}, []), {'filename': None, 'version': 1}, iter(self.people)
+
+
+def _pickle_people(people, f):
+    pickler = pickle.Pickler(f, 2)
+
+    def entries():
+        # the pickler remembers every object it has written; it is made to forget them every chunk,
+        # as people are never referred to again once they are written
+        for number, person in enumerate(people, 1):
+            yield person
+            if number % CHUNK_SIZE == 0:
+                pickler.clear_memo()
+
+    pickler.dump(_StreamedBook(entries()))
+
+
+def write_people(people, path, fmt=None):
+    """Write people to a CSV, JSON or pickle file. The people are written as they come, so they can be
+    generated on the fly without being held in memory. A pickle file holds a new AddressBook of the people.
+
+    Attributes:
+        people (iterable): Person objects
+        path (str): File name
+        fmt (str): 'csv', 'json' or 'pkl' (by default recognized by the extension)
+    """
+
+    fmt = file_format(path, fmt)
+    if fmt == 'pkl':
+        with open(path, 'wb') as f:
+            _pickle_people(people, f)
+        return
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            writer.writerows(person_record(p) for p in people)
+        else:
+            f.write('[')
+            for number, p in enumerate(people):
+                f.write(',\n ' if number else '\n ')
+                json.dump(person_record(p), f, ensure_ascii=False)
+            f.write('\n]\n')
+
+
+@metrics.timed('load')
+def load_book(path):
+    """Load an AddressBook from a pickle file"""
+
+    if file_format(path) != 'pkl':
+        raise FormatError
+    if os.path.getsize(path) == 0:
+        raise EmptyFile
+    with open(path, 'rb') as f:
+        book = pickle.load(f)
+    if not isinstance(book, AddressBook):
+        raise FormatError
+    book.filename = path
+    return book
+
+
+def save_book(book, path):
+    """Save an AddressBook to a pickle file. Saving to the file the AddressBook has been loaded from merges
+    changes saved there by somebody else in the meantime (raising SaveConflict if they can't be merged)."""
+
+    if file_format(path) != 'pkl':
+        raise FormatError
+    if book.filename == path:
+        book.pickle_changes()
+    else:
+        book.pickle_base(path)
@@ -0,0 +1,214 @@
+"""This module contains a generator of synthetic AddressBook entries for benchmarks and load tests.
+
+Entries look like real ones: surnames and cities follow a Zipf distribution (a few are very common, most
+are rare), phone numbers, streets and birthdays are written in the various formats users type in, and all
+of them go through the same parsers as entries typed in by hand. The same seed always gives the same
+entries. Entries are generated one by one, so millions of them can be written to a file without being
+held in memory:
+
+    python -m addressbook.ab_generator contacts.pkl --count 1000000 --seed 7 --duplicates 0.02 --missing 0.1
+"""
+
+import argparse
+import random
+import sys
+from collections import deque
+from itertools import accumulate
+
+from addressbook.ab_export import *
+
+NAMES = {
+    'PL': ['Anna', 'Maria', 'Katarzyna', 'Małgorzata', 'Agnieszka', 'Barbara', 'Ewa', 'Krystyna', 'Elżbieta',
+           'Zofia', 'Łucja', 'Żaneta', 'Piotr', 'Krzysztof', 'Andrzej', 'Tomasz', 'Paweł', 'Jan', 'Michał',
+           'Marcin', 'Stanisław', 'Jakub', 'Łukasz', 'Grzegorz', 'Józef', 'Ścibor', 'Cezary', 'Ignacy'],
+    'US': ['Mary', 'Patricia', 'Jennifer', 'Linda', 'Elizabeth', 'Barbara', 'Susan', 'Jessica', 'Sarah',
+           'Karen', 'Nancy', 'Lisa', 'James', 'Robert', 'John', 'Michael', 'David', 'William', 'Richard',
+           'Joseph', 'Thomas', 'Charles', 'Christopher', 'Daniel', 'Matthew', 'Anthony', 'Mark', 'Donald'],
+}
+
+# in the order of popularity
+SURNAMES = {
+    'PL': ['Nowak', 'Kowalski', 'Wiśniewski', 'Wójcik', 'Kowalczyk', 'Kamiński', 'Lewandowski', 'Zieliński',
+           'Szymański', 'Woźniak', 'Dąbrowski', 'Kozłowski', 'Jankowski', 'Mazur', 'Wojciechowski',
+           'Kwiatkowski', 'Krawczyk', 'Kaczmarek', 'Piotrowski', 'Grabowski', 'Zając', 'Pawłowski', 'Michalski',
+           'Król', 'Wieczorek', 'Jabłoński', 'Wróbel', 'Nowakowski', 'Majewski', 'Olszewski', 'Stępień',
+           'Malinowski', 'Jaworski', 'Adamczyk', 'Dudek', 'Nowicki', 'Pawlak', 'Górski', 'Witkowski', 'Walczak',
+           'Sikora', 'Baran', 'Rutkowski', 'Michalak', 'Szewczyk', 'Ostrowski', 'Tomaszewski', 'Pietrzak',
+           'Zalewski', 'Wróblewski', 'Łukasik', 'Żak', 'Śliwa', 'Ćwik'],
+    'US': ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+           'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore',
+           'Jackson', 'Martin', 'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez',
+           'Lewis', 'Robinson', 'Walker', 'Young', 'Allen', 'King', 'Wright', 'Scott', 'Torres', 'Nguyen',
+           'Hill', 'Flores', 'Green', 'Adams', 'Nelson', 'Baker', 'Hall', 'Rivera', 'Campbell', 'Mitchell'],
+}
+
+# in the order of population
+CITIES = {
+    'PL': ['Warszawa', 'Kraków', 'Wrocław', 'Łódź', 'Poznań', 'Gdańsk', 'Szczecin', 'Bydgoszcz', 'Lublin',
+           'Białystok', 'Katowice', 'Gdynia', 'Częstochowa', 'Radom', 'Rzeszów', 'Toruń', 'Sosnowiec',
+           'Kielce', 'Gliwice', 'Olsztyn', 'Zabrze', 'Bielsko-Biała', 'Bytom', 'Zielona Góra', 'Rybnik',
+           'Ruda Śląska', 'Opole', 'Tychy', 'Gorzów Wielkopolski', 'Elbląg', 'Płock', 'Wałbrzych', 'Żory'],
+    'US': ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix', 'Philadelphia', 'San Antonio',
+           'San Diego', 'Dallas', 'Jacksonville', 'Austin', 'Fort Worth', 'San Jose', 'Columbus', 'Charlotte',
+           'Indianapolis', 'San Francisco', 'Seattle', 'Denver', 'Oklahoma City', 'Nashville', 'Washington',
+           'El Paso', 'Las Vegas', 'Boston', 'Detroit', 'Portland', 'Louisville', 'Memphis', 'Baltimore'],
+}
+
+STREETS = {
+    'PL': ['Polna', 'Leśna', 'Słoneczna', 'Krótka', 'Szkolna', 'Ogrodowa', 'Lipowa', 'Łąkowa', 'Brzozowa',
+           'Kwiatowa', 'Kościelna', 'Sosnowa', 'Zielona', 'Parkowa', 'Akacjowa', 'Piotrkowska', 'Długa',
+           'Marszałkowska', 'Floriańska', 'Świętojańska', 'Aleje Jerozolimskie', 'Aleje Ujazdowskie'],
+    'US': ['Main Street', 'Oak Street', 'Pine Street', 'Maple Avenue', 'Cedar Street', 'Elm Street',
+           'Washington Street', 'Lake Street', 'Hill Road', 'Park Avenue', 'Sunset Boulevard', 'Broadway',
+           'Mulholland Drive', 'Madison Square', 'Church Road', 'Wallaby Way'],
+}
+
+DOMAINS = ['gmail.com', 'wp.pl', 'onet.pl', 'interia.pl', 'o2.pl', 'yahoo.com', 'outlook.com', 'example.com']
+
+# first two digits of Polish mobile numbers, and area codes of landlines
+GSM_PREFIXES = ['50', '51', '53', '57', '60', '66', '69', '72', '73', '78', '79', '88']
+AREA_CODES = {'PL': ['22', '12', '71', '42', '61', '58', '91', '52', '81', '85', '32'],
+              'US': ['212', '213', '312', '713', '602', '215', '210', '619', '214', '904', '512', '415']}
+
+# letters left out when names are written in e-mail addresses
+ASCII_LETTERS = str.maketrans('ąćęłńóśźżĄĆĘŁŃÓŚŹŻ', 'acelnoszzACELNOSZZ')
+
+
+def zipf_weights(n, s=1.1):
+    """Return cumulative weights of n items ranked by popularity, following Zipf's law with exponent s"""
+    return list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+class Generator(object):
+    """Generator of random, valid AddressBook entries
+
+    Attributes:
+        seed (int): Seed of the random numbers; the same seed gives the same entries
+        mode ('PL'/'US'): Style of names, places and phone numbers
+        duplicates (float): Fraction of entries repeating the name, surname and e-mail address of an entry
+                            generated shortly before (with another phone number and address)
+        missing (float): Probability that each of the optional fields (birthday, city, street) is left out
+        zipf (float): Exponent of the Zipf distribution of surnames and cities (higher is more skewed)
+    """
+
+    # number of the latest entries duplicates are chosen from
+    RECENT = 1000
+
+    def __init__(self, seed=0, mode='PL', duplicates=0.0, missing=0.0, zipf=1.1):
+        if mode not in NAMES:
+            raise WrongInput("Unknown mode: {0!r}. Available modes: {1}".format(mode, ', '.join(NAMES)))
+        if not (0 <= duplicates <= 1 and 0 <= missing <= 1):
+            raise WrongInput("Rates of duplicates and missing fields must be between 0 and 1")
+        self.seed = seed
+        self.mode = mode
+        self.duplicates = duplicates
+        self.missing = missing
+        self.zipf = zipf
+
+    def records(self, count=None):
+        """Generate records of entries (dicts of FIELDS, see 'ab_export.record_person') with the values written
+        as a user would type them in. Without the count, records are generated endlessly."""
+
+        rnd = random.Random(self.seed)
+        mode = self.mode
+        names, streets = NAMES[mode], STREETS[mode]
+        surnames, cities = SURNAMES[mode], CITIES[mode]
+        surname_weights = zipf_weights(len(surnames), self.zipf)
+        city_weights = zipf_weights(len(cities), self.zipf)
+        recent = deque(maxlen=self.RECENT)
+
+        number = 0
+        while count is None or number < count:
+            number += 1
+            if recent and rnd.random() < self.duplicates:
+                record = dict(rnd.choice(recent), phone=self._phone(rnd))
+            else:
+                name = rnd.choice(names)
+                surname = rnd.choices(surnames, cum_weights=surname_weights)[0]
+                login = '{0}.{1}{2}'.format(name, surname, number).lower().translate(ASCII_LETTERS)
+                record = {'name': name.lower(), 'surname': surname.lower(),
+                          'email': '{0}@{1}'.format(login, rnd.choice(DOMAINS)), 'phone': self._phone(rnd)}
+                recent.append(record)
+            record['birthday'] = self._optional(rnd, self._birthday)
+            record['city'] = self._optional(rnd, lambda rnd: rnd.choices(cities, cum_weights=city_weights)[0])
+            street = self._optional(rnd, lambda rnd: (rnd.choice(streets), str(rnd.randint(1, 250))))
+            record['streetname'], record['streetnumber'] = street or (None, None)
+            yield record
+
+    def people(self, count=None):
+        """Generate Person objects made of the records, going through the parsers"""
+
+        for record in self.records(count):
+            person = Person(record['name'], record['surname'], record['email'], record['phone'], self.mode)
+            if record['streetname']:
+                person.street = '{0} {1}'.format(record['streetname'], record['streetnumber'])
+            for key in ('birthday', 'city'):
+                if record[key]:
+                    setattr(person, key, record[key])
+            yield person
+
+    def book(self, count):
+        """Return an AddressBook of 'count' generated entries"""
+        book = AddressBook()
+        book.bulk_add(self.people(count))
+        return book
+
+    def write(self, path, count, fmt=None):
+        """Write 'count' generated entries to a pickle, CSV or JSON file, one by one"""
+        write_people(self.people(count), path, fmt)
+
+    def _optional(self, rnd, make):
+        return None if rnd.random() < self.missing else make(rnd)
+
+    def _phone(self, rnd):
+        if self.mode == 'US':
+            # the US pattern requires an extension after the 10-digit number
+            return rnd.choice(['({0}) {1}-{2} ext. {3}', '{0}-{1}-{2}-{3}', '{0}.{1}.{2}.{3}']).format(
+                rnd.choice(AREA_CODES['US']), self._local(rnd, 3), self._local(rnd, 4), rnd.randint(1, 999))
+        if rnd.random() < 0.7:
+            digits = rnd.choice(GSM_PREFIXES) + '{0:07d}'.format(rnd.randrange(10 ** 7))
+            return rnd.choice(['{0}{1}{2}', '{0}-{1}-{2}', '{0} {1} {2}']).format(
+                digits[:3], digits[3:6], digits[6:])
+        digits = self._local(rnd, 7)
+        return rnd.choice(['({0}) {1} {2} {3}', '{0} {1}-{2}-{3}', '{0}{1}{2}{3}']).format(
+            rnd.choice(AREA_CODES['PL']), digits[:3], digits[3:5], digits[5:])
+
+    @staticmethod
+    def _local(rnd, length):
+        # Person keeps the digits of a number without the area code, and parses them again as a Polish
+        # number, so they must not start like a mobile number
+        while True:
+            digits = str(rnd.randrange(2 * 10 ** (length - 1), 10 ** length))
+            if digits[:2] not in GSM_PREFIXES:
+                return digits
+
+    @staticmethod
+    def _birthday(rnd):
+        day, month, year = rnd.randint(1, 28), rnd.randint(1, 12), rnd.randint(1930, 2010)
+        return rnd.choice(['{0}-{1}-{2}', '{0:02d}/{1:02d}/{2}', '{0}.{1}.{2}']).format(day, month, year)
+
+
+def main(argv=None):
+    """Write generated entries to a file, return the exit code"""
+
+    parser = argparse.ArgumentParser(prog='python -m addressbook.ab_generator',
+                                     description='Generate random, valid AddressBook entries')
+    parser.add_argument('target', help='file to write (.pkl, .csv or .json)')
+    parser.add_argument('--count', type=int, default=10000, help='number of entries')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=sorted(NAMES), default='PL', help='style of the entries')
+    parser.add_argument('--duplicates', type=float, default=0.0, help='fraction of duplicated entries')
+    parser.add_argument('--missing', type=float, default=0.0, help='probability of a missing optional field')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the Zipf distribution')
+    args = parser.parse_args(argv)
+
+    try:
+        Generator(args.seed, args.mode, args.duplicates, args.missing, args.zipf).write(args.target, args.count)
+    except (BaseError, OSError) as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,6 @@
 """This module provides helper functions"""
 
+import gc
 import os
 import sys
 from contextlib import contextmanager
@@ -77,6 +78,21 @@ def suppress_stdout():
             sys.stdout = old_stdout
 
 
+@contextmanager
+def gc_paused():
+    """Turn off the cyclic garbage collector for the 'with' block. Creating millions of small objects
+    (e.g. while comparing huge AddressBooks) otherwise triggers collections walking all the entries
+    again and again."""
+    if not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
 @contextmanager
 def exc_catcher():
     """Function for dealing with exceptions that can be raised while working with AddressBook"""
@@ -99,3 +115,46 @@ def keyboard_catcher():
     except KeyboardInterrupt:
         print("\n>> Shutdown requested on keyboard... exiting")
         sys.exit()
+
+
+class LazyModule(object):
+    """Module imported when any of its attributes is used for the first time. Rarely used modules
+    (and optional dependencies) are assigned to module-level names this way, so that importing
+    AddressBook modules stays fast.
+
+    Attributes:
+        name (str): Name of the module
+        optional (bool): If True, a missing module doesn't raise ImportError. Such a LazyModule is
+                         false in boolean context (which also imports the module)
+    """
+
+    def __init__(self, name, optional=False):
+        self._name = name
+        self._optional = optional
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                __import__(self._name)
+            except ImportError:
+                if not self._optional:
+                    raise
+                self._module = False
+            else:
+                self._module = sys.modules[self._name]
+        return self._module
+
+    def __getattr__(self, attr):
+        # called only for attributes of the module, attributes of the LazyModule are found normally
+        module = self._load()
+        if module is False:
+            raise ImportError("No module named '{0}'".format(self._name))
+        return getattr(module, attr)
+
+    def __bool__(self):
+        return self._load() is not False
+
+    def __repr__(self):
+        state = {None: 'not imported', False: 'not installed'}.get(self._module, 'imported')
+        return '<{0}: {1} ({2})>'.format(self.__class__.__name__, self._name, state)
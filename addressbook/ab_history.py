@@ -0,0 +1,96 @@
+"""This module contains History class used for undoing and redoing changes made to the AddressBook"""
+
+from collections import deque
+from contextlib import contextmanager
+
+
+class History(object):
+    """Undo and redo stacks of changes made to the AddressBook.
+
+    Instead of copies of the AddressBook, every step holds only what is needed to reverse the change,
+    so the memory used by the History is proportional to the changes, not to the size of the AddressBook:
+        ('set', person, old_values) - attributes of the person have been set, old_values maps their names
+                                      to the previous values
+        ('del', [position, ...], [person, ...]) - entries have been removed from the given positions
+        ('ins', [person, ...]) - entries have been added
+        ('group', [step, ...]) - several steps undone and redone together
+    """
+
+    def __init__(self, limit=100):
+        """
+        Attributes:
+            limit (int): Maximum number of steps that can be undone
+        """
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = []
+        self._group = None      # steps collected inside 'group' block
+        self._paused = 0        # recording is paused while steps are being undone or redone
+
+    def record(self, step):
+        """Add a new step to the History. Recording a new step makes redoing undone steps impossible."""
+        if self._paused:
+            return
+        if self._group is not None:
+            self._group.append(step)
+        else:
+            self.undo_stack.append(step)
+            self.redo_stack.clear()
+
+    def clear(self):
+        """Forget all the recorded steps"""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    @contextmanager
+    def group(self):
+        """Record all the steps made inside the 'with' block as a single step"""
+
+        # nested groups are merged with the outermost one
+        if self._group is not None:
+            yield
+            return
+
+        self._group = []
+        try:
+            yield
+        finally:
+            steps, self._group = self._group, None
+            if len(steps) == 1:
+                self.record(steps[0])
+            elif steps:
+                self.record(('group', steps))
+
+    @contextmanager
+    def paused(self):
+        """Don't record steps made inside the 'with' block"""
+        self._paused += 1
+        try:
+            yield
+        finally:
+            self._paused -= 1
+
+    def undo(self, revert):
+        """Undo the last step. Return False if there is nothing to undo.
+
+        Attributes:
+            revert (function): Function reversing the given step and returning the step reversing it back
+        """
+        if not self.undo_stack:
+            return False
+        step = self.undo_stack.pop()
+        with self.paused():
+            self.redo_stack.append(revert(step))
+        return True
+
+    def redo(self, revert):
+        """Redo the last undone step. Return False if there is nothing to redo.
+
+        Attributes:
+            revert (function): Function reversing the given step and returning the step reversing it back
+        """
+        if not self.redo_stack:
+            return False
+        step = self.redo_stack.pop()
+        with self.paused():
+            self.undo_stack.append(revert(step))
+        return True
@@ -0,0 +1,76 @@
+"""This module contains AttributeIndex class used for finding entries of the AddressBook without sorting it"""
+
+
+class AttributeIndex(object):
+    """Hash index of the AddressBook's entries by the value of one attribute.
+
+    The index is refreshed before every lookup, but only if the AddressBook has changed since the last
+    refresh: entries logged as changed or removed after the indexed generation are moved between buckets,
+    so the cost of a refresh is proportional to the logged changes, not to the size of the AddressBook.
+    The index is built from scratch only if the changes are no longer logged (e.g. after opening a file).
+    """
+
+    def __init__(self, book, attribute):
+        """
+        Attributes:
+            book (AddressBook): Indexed AddressBook
+            attribute (str): Name of the indexed attribute
+        """
+        self.book = book
+        self.attribute = attribute
+        self.generation = None      # generation of the AddressBook the index reflects
+        self._buckets = {}          # value: {uid: entry}
+        self._values = {}           # uid: indexed value of the entry
+        book.watch(self)
+
+    def __len__(self):
+        self.refresh()
+        return len(self._values)
+
+    def rebuild(self):
+        """Index all the entries of the AddressBook from scratch"""
+        self._buckets.clear()
+        self._values.clear()
+        for p in self.book:
+            self._add(p)
+        self.generation = self.book.generation
+
+    def refresh(self):
+        """Bring the index up to date with the AddressBook"""
+
+        book = self.book
+        if self.generation == book.generation:
+            return
+        changes = book.changes_since(self.generation) if self.generation is not None else None
+        if changes is None:
+            self.rebuild()
+            return
+        changed, removed = changes
+        for p in removed:
+            self._discard(p.uid)
+        for p in changed:
+            self._discard(p.uid)
+            if book.get(p.uid) is p:
+                self._add(p)
+        self.generation = book.generation
+
+    def lookup(self, value):
+        """Return a list of entries with the given value of the attribute"""
+        self.refresh()
+        bucket = self._buckets.get(value)
+        return list(bucket.values()) if bucket else []
+
+    def _add(self, person):
+        value = getattr(person, self.attribute)
+        self._values[person.uid] = value
+        self._buckets.setdefault(value, {})[person.uid] = person
+
+    def _discard(self, uid):
+        try:
+            value = self._values.pop(uid)
+        except KeyError:
+            return
+        bucket = self._buckets[value]
+        del bucket[uid]
+        if not bucket:
+            del self._buckets[value]
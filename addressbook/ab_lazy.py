@@ -0,0 +1,347 @@
+"""This module contains lazy opening of AddressBook files, used for working with big books without loading
+all their entries.
+
+A save writes a record file next to the AddressBook file ('contacts.pkl.records') if the AddressBook's
+'record_file' is set, which the lazy mode of the interactive menu does. It holds the entries pickled
+in blocks of BLOCK entries, followed by a compact index: uids and personids of the entries and offsets
+of the blocks. A lazily opened book (LazyBook) maps the record file into memory and uses the index
+in place, so opening takes about the same time whatever the size of the book. Entries are read from
+their blocks when they are first needed and kept in a RecordCache, which drops the least recently used
+ones when they hold more memory than its budget.
+
+A LazyBook can be shown, paged through and searched. It can't be changed: for anything else the whole
+AddressBook is loaded ('LazyBook.load'), reusing the entries read so far. Like a Bloom filter (see ab_bloom),
+the record file records the size and modification time of the AddressBook file it was written for, and
+a record file that doesn't match its AddressBook file is ignored ('open_book' loads the whole book then).
+
+Lazy opening is turned on in the interactive menu by the environment variable ADDRESSBOOK_LAZY, set to
+the budget of the record cache in MiB. A book without a record file is loaded whole the first time, and
+gets its record file when it is saved.
+"""
+
+import os
+import struct
+from array import array
+from itertools import accumulate
+
+from addressbook import ab_metrics as metrics
+from addressbook.ab_abook import SEARCH_KEYS, AddressBook, Person, _restore_book, search_value
+from addressbook.ab_cache import RecordCache
+from addressbook.ab_export import load_book
+from addressbook.ab_helpers import LazyModule, gc_paused
+
+# imported on first use
+mmap = LazyModule('mmap')
+pickle = LazyModule('pickle')
+tempfile = LazyModule('tempfile')
+
+# environment variable turning lazy opening on, set to the budget of the record cache in MiB
+ENVIRON = 'ADDRESSBOOK_LAZY'
+
+# default budget of the record cache (bytes)
+BUDGET = 32 * 1024 * 1024
+
+# number of entries pickled together, the smallest part of the record file read at once
+BLOCK = 64
+
+# magic, format version, number of entries, number of blocks, offset of the index, mtime_ns and size of
+# the AddressBook file
+_HEADER = struct.Struct('<4sBQQQqQ')
+_MAGIC = b'ABRF'
+_VERSION = 1
+
+
+def records_path(path):
+    """Return the path of the record file of the AddressBook file"""
+    return path + '.records'
+
+
+def from_environment():
+    """Return the budget of the record cache (bytes) given in the environment, None if lazy opening is off.
+    A value that isn't a number turns lazy opening on with the default budget."""
+    value = os.environ.get(ENVIRON)
+    if not value:
+        return None
+    try:
+        return max(int(float(value) * 1024 * 1024), 1)
+    except ValueError:
+        return BUDGET
+
+
+def _record(person):
+    return person.uid, person.to_tuple(), tuple(person.tags)
+
+
+def _entry(record):
+    """Create a Person from a record of the record file"""
+    uid, values, tags = record
+    person = Person.from_tuple(values)
+    person.__dict__['uid'] = uid
+    if tags:
+        person.tags = tags
+    return person
+
+
+def write_records(book, path):
+    """Write the record file of the AddressBook saved in the file. Must be called after the book is saved,
+    holding the lock of the file (see ab_storage.write_book).
+
+    The file holds the header, the blocks of entries, and the index aligned to 8 bytes: uids of the entries,
+    offsets of the blocks, positions of the entries ordered by uid and by personid, offsets of the personids,
+    the personids (UTF-8) and finally the class and the state of the AddressBook.
+
+    Attributes:
+        book (AddressBook): Saved AddressBook
+        path (str): AddressBook file
+    """
+
+    people = list(book)
+    count = len(people)
+    with gc_paused():
+        blocks = [pickle.dumps([_record(p) for p in people[start:start + BLOCK]], pickle.HIGHEST_PROTOCOL)
+                  for start in range(0, count, BLOCK)]
+        offsets = array('Q', accumulate(map(len, blocks), initial=_HEADER.size))
+        uids = array('Q', [p.uid for p in people])
+        personids = [p.personid for p in people]
+        by_uid = array('Q', sorted(range(count), key=uids.__getitem__))
+        by_personid = array('Q', sorted(range(count), key=personids.__getitem__))
+        names = [s.encode() for s in personids]
+        name_offsets = array('Q', accumulate(map(len, names), initial=0))
+        state = pickle.dumps((book.__class__, book.__getstate__()), pickle.HIGHEST_PROTOCOL)
+
+    index = offsets[-1] + -offsets[-1] % 8
+    stat = os.stat(path)
+    target = records_path(path)
+    fd, temp = tempfile.mkstemp(prefix='.' + os.path.basename(target), dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, count, len(blocks), index, stat.st_mtime_ns, stat.st_size))
+            f.writelines(blocks)
+            f.write(bytes(index - offsets[-1]))
+            for part in (uids, offsets, by_uid, by_personid, name_offsets):
+                f.write(part)
+            f.writelines(names)
+            f.write(state)
+        os.chmod(temp, stat.st_mode & 0o777)
+        os.replace(temp, target)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+
+class LazyBook(object):
+    """Read-only view of a saved AddressBook, reading entries from its record file when they are needed.
+    Raises ValueError if the AddressBook file has no valid record file.
+
+    Attributes:
+        filename (str): AddressBook file
+        cache (RecordCache): Entries read from the record file
+    """
+
+    # a LazyBook is never changed, changes are made to the AddressBook returned by 'load'
+    modified = False
+
+    def __init__(self, path, budget=BUDGET):
+        """
+        Attributes:
+            path (str): AddressBook file
+            budget (int): Maximum memory (bytes) held by the entries kept in the cache
+        """
+        self.filename = path
+        self.cache = RecordCache('records', budget)
+        stat = os.stat(path)
+        with open(records_path(path), 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_index(stat)
+        except BaseException:
+            self.close()
+            raise
+
+    def _read_index(self, stat):
+        data = self._data
+        if len(data) < _HEADER.size:
+            raise ValueError("The record file is damaged")
+        magic, version, count, blocks, index, mtime_ns, size = _HEADER.unpack_from(data)
+        if (magic, version) != (_MAGIC, _VERSION):
+            raise ValueError("Unknown format of the record file")
+        if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+            raise ValueError("The record file doesn't match the AddressBook file")
+        if len(data) < index + 8 * (4 * count + blocks + 2):
+            raise ValueError("The record file is damaged")
+
+        # arrays of the index are used in place, without copying them
+        view = memoryview(data)
+        self._views = []
+        for length in (count, blocks + 1, count, count, count + 1):
+            self._views.append(view[index:index + 8 * length].cast('Q'))
+            index += 8 * length
+        view.release()
+        self._count = count
+        self._uids, self._offsets, self._by_uid, self._by_personid, self._name_offsets = self._views
+        self._names = index
+        self._state = index + self._name_offsets[count]
+
+    def close(self):
+        """Close the record file. The LazyBook can't be used afterwards."""
+        for view in getattr(self, '_views', ()):
+            view.release()
+        self._views = []
+        self._data.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('LazyBook index out of range')
+        person = self.cache.get(index)
+        if person is None:
+            person = self._read(index)
+        return person
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def _block(self, number):
+        """Return records of a block"""
+        return pickle.loads(self._data[self._offsets[number]:self._offsets[number + 1]])
+
+    def _read(self, index):
+        """Read the block of the entry at the position, keep its entries in the cache and return the entry"""
+        cache, start = self.cache, index - index % BLOCK
+        records = self._block(index // BLOCK)
+        for i, record in enumerate(records, start):
+            if i != index and i not in cache:
+                cache.put(i, _entry(record))
+        # the entry looked for is put last, so it isn't dropped first
+        person = _entry(records[index - start])
+        cache.put(index, person)
+        return person
+
+    def entries(self, positions):
+        """Return the entries at the positions (given in ascending order), reading every needed block once"""
+        cache, found, records, number = self.cache, [], None, None
+        for i in positions:
+            person = cache.get(i)
+            if person is None:
+                if i // BLOCK != number:
+                    number = i // BLOCK
+                    records = self._block(number)
+                person = _entry(records[i % BLOCK])
+                cache.put(i, person)
+            found.append(person)
+        return found
+
+    def uid(self, index):
+        """Return the uid of the entry at the position"""
+        return self._uids[index]
+
+    def personid(self, index):
+        """Return the personid of the entry at the position, read from the index"""
+        base, offsets = self._names, self._name_offsets
+        return self._data[base + offsets[index]:base + offsets[index + 1]].decode()
+
+    def get(self, uid, default=None):
+        """Return the entry with the given uid (or default if there is no such entry)"""
+        order, uids = self._by_uid, self._uids
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if uids[order[mid]] < uid:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and uids[order[lo]] == uid:
+            return self[order[lo]]
+        return default
+
+    def find(self, personid):
+        """Return positions of the entries with the personid, in ascending order"""
+        order, key = self._by_personid, self.personid
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(order[mid]) < personid:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self._count and key(order[lo]) == personid:
+            found.append(order[lo])
+            lo += 1
+        return found
+
+    def scan(self, key, value):
+        """Return positions of the entries with the attribute equal to the value, in ascending order.
+        All the blocks are read, but only the entries found are created."""
+        column = Person.ATTRIBUTES.index(key)
+        found = []
+        with gc_paused():
+            for number in range(len(self._offsets) - 1):
+                for i, (_, values, _) in enumerate(self._block(number), number * BLOCK):
+                    if values[column] == value:
+                        found.append(i)
+        return found
+
+    @metrics.timed('search_base')
+    def search_base(self, **kwargs):
+        """Search for the entries with the specified key value, like AddressBook.search_base does (returning
+        None, a Person object or a list of them). Entries are found by personid in the index; searching by
+        other attributes reads all the blocks of the record file.
+
+        Attributes:
+            **kwargs (keyword=str): Key and value of the person being looked for
+        """
+
+        for (k, v) in kwargs.items():
+            if k not in SEARCH_KEYS:
+                raise AttributeError("'Person' object has no attribute '{0}'".format(k))
+            v = search_value(k, v)
+            positions = self.find(v) if k == 'personid' else self.scan(k, v)
+            if metrics.enabled:
+                metrics.items('search_base', 0 if k == 'personid' else self._count, len(positions))
+            if not positions:
+                return None
+            found = self.entries(positions)
+            return found[0] if len(found) == 1 else found
+
+    # they work on any sequence of entries
+    how_many = AddressBook.how_many
+    show_all_results = AddressBook.show_all_results
+
+    @metrics.timed('load')
+    def load(self):
+        """Return the whole AddressBook. Entries kept in the cache are used as they are (so the entries shown
+        or found so far belong to the AddressBook), the rest is read from the record file."""
+
+        people, peek = [], self.cache.peek
+        with gc_paused():
+            for number in range(len(self._offsets) - 1):
+                for i, record in enumerate(self._block(number), number * BLOCK):
+                    person = peek(i)
+                    people.append(person if person is not None else _entry(record))
+            cls, state = pickle.loads(self._data[self._state:])
+            book = _restore_book(cls, state, people)
+        book.filename = self.filename
+        return book
+
+
+def open_book(path, budget=BUDGET):
+    """Open the AddressBook file lazily (return a LazyBook) if it has a valid record file, otherwise load
+    the whole AddressBook
+
+    Attributes:
+        path (str): AddressBook file
+        budget (int): Maximum memory (bytes) held by the entries of a LazyBook kept in the cache
+    """
+    try:
+        return LazyBook(path, budget)
+    except (OSError, ValueError):
+        return load_book(path)
@@ -0,0 +1,190 @@
+"""This module contains comparing and merging of two AddressBooks, e.g. books kept by different people.
+
+Every entry is reduced to its content (see Person.content): a tuple of the values of CONTENT attributes,
+normalized so that spelling differences the parsers don't remove (the case of e-mail addresses) don't
+count. Contents are hashed in dictionaries, so comparing books of n and m entries takes O(n + m) time:
+
+    - entries with the same content in both books are unchanged (duplicates are matched one to one),
+    - the rest is matched by MATCH_KEY (personid): entries found in both books are changed,
+      entries found only in the other book are added and entries found only in this book are removed.
+
+How a merge treats changed entries is chosen with 'prefer':
+
+    'mine'      keep the values of this book
+    'theirs'    take the values of the other book
+    'fill'      keep the values of this book, but fill in attributes missing here (e.g. a birthday)
+    'both'      keep the entry and add the other one too
+    function    called with (mine, theirs) for every changed entry; True keeps mine, False takes theirs
+"""
+
+from addressbook.ab_helpers import gc_paused
+from addressbook.ab_person import Person
+
+# attributes compared by 'diff'
+CONTENT = Person.CONTENT
+
+# attribute entries with different contents are matched by
+MATCH_KEY = 'personid'
+
+# conflict rules for changed entries (besides a function)
+RULES = ('mine', 'theirs', 'fill', 'both')
+
+# attributes filled in together by the 'fill' rule, the first of each group decides if it is missing
+FILL_GROUPS = (('birthday', 'year', 'month', 'day'), ('city',), ('streetname', 'streetnumber'))
+
+# normalized content of an entry (a hashable tuple)
+content = Person.content
+
+
+def differences(mine, theirs):
+    """Return names of CONTENT attributes with different values in two entries"""
+    a, b = content(mine), content(theirs)
+    return [k for k, x, y in zip(CONTENT, a, b) if x != y]
+
+
+class Diff(object):
+    """Differences between two AddressBooks (or any sequences of Person objects)
+
+    Attributes:
+        added (list): Entries found only in the other book
+        removed (list): Entries found only in this book
+        changed (list): (mine, theirs) pairs of entries with the same personid and different contents
+        unchanged (int): Number of entries found in both books
+    """
+
+    def __init__(self, added, removed, changed, unchanged):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.unchanged = unchanged
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self):
+        return {'added': len(self.added), 'removed': len(self.removed), 'changed': len(self.changed),
+                'unchanged': self.unchanged}
+
+
+def diff(mine, theirs):
+    """Compare two sequences of Person objects and return a Diff. Entries are listed in the order
+    of the sequences they come from."""
+
+    with gc_paused():
+        return _diff(mine, theirs)
+
+
+def _diff(mine, theirs):
+    by_content = {}
+    for p in mine:
+        by_content.setdefault(content(p), []).append(p)
+
+    unchanged, others = 0, []
+    for p in theirs:
+        same = by_content.get(content(p))
+        if same:
+            same.pop()
+            unchanged += 1
+        else:
+            others.append(p)
+
+    # entries left unmatched here, by the key, in the order of the book
+    left = {id(p) for same in by_content.values() for p in same}
+    by_key = {}
+    for p in mine:
+        if id(p) in left:
+            by_key.setdefault(getattr(p, MATCH_KEY), []).append(p)
+    for same in by_key.values():
+        same.reverse()
+
+    added, changed = [], []
+    for p in others:
+        same = by_key.get(getattr(p, MATCH_KEY))
+        if same:
+            changed.append((same.pop(), p))
+        else:
+            added.append(p)
+    matched = {id(here) for here, _ in changed}
+    removed = [p for p in mine if id(p) in left and id(p) not in matched]
+    return Diff(added, removed, changed, unchanged)
+
+
+class MergeReport(Diff):
+    """Diff of the merged AddressBooks together with what the merge did
+
+    Attributes:
+        kept (int): Changed entries left as they were
+        replaced (int): Changed entries given the values of the other book
+        filled (int): Changed entries with missing attributes filled in
+        duplicated (int): Changed entries added from the other book next to the ones kept
+        deleted (int): Removed entries deleted from the book
+    """
+
+    def __init__(self, d):
+        Diff.__init__(self, d.added, d.removed, d.changed, d.unchanged)
+        self.kept = self.replaced = self.filled = self.duplicated = self.deleted = 0
+
+    def summary(self):
+        result = Diff.summary(self)
+        result.update(kept=self.kept, replaced=self.replaced, filled=self.filled, duplicated=self.duplicated,
+                      deleted=self.deleted)
+        return result
+
+
+def copy_entry(person):
+    """Return a copy of the Person (with its tags) that can be added to another AddressBook"""
+    copy = person.__class__.from_tuple(person.to_tuple())
+    if person.tags:
+        copy.__dict__['tags'] = person.tags
+    return copy
+
+
+def _values(person, groups=None):
+    """Return values of the Person's attributes to be assigned to another entry. With 'groups' (sequences
+    of attribute names), only the attributes of these groups are returned."""
+    d = person.__dict__
+    if groups is None:
+        return {k: d.get(k) for k in Person.ATTRIBUTES}
+    return {k: d.get(k) for group in groups for k in group}
+
+
+def merge(book, other, prefer='mine', delete=False):
+    """Bring entries of the other AddressBook into the book and return a MergeReport. The merge is
+    a single step of the book's History, so it can be undone at once.
+
+    Attributes:
+        book (AddressBook): AddressBook changed by the merge
+        other (sequence): Person objects merged into the book (they are copied, not moved)
+        prefer (str/function): Rule for changed entries (see the module's description)
+        delete (bool): Whether entries missing in the other book are deleted
+    """
+
+    if not callable(prefer) and prefer not in RULES:
+        raise ValueError("Unknown merge rule: {0!r} (expected one of {1})".format(prefer, ', '.join(RULES)))
+    report = MergeReport(diff(book, other))
+
+    with gc_paused(), book.history.group():
+        additions = [copy_entry(p) for p in report.added]
+        for here, there in report.changed:
+            rule = prefer
+            if callable(rule):
+                rule = 'mine' if rule(here, there) else 'theirs'
+            if rule == 'mine':
+                report.kept += 1
+            elif rule == 'theirs':
+                here._assign(_values(there))
+                report.replaced += 1
+            elif rule == 'both':
+                additions.append(copy_entry(there))
+                report.duplicated += 1
+            else:
+                groups = [g for g in FILL_GROUPS if getattr(here, g[0]) is None and getattr(there, g[0]) is not None]
+                if groups:
+                    here._assign(_values(there, groups))
+                    report.filled += 1
+                else:
+                    report.kept += 1
+        if delete:
+            report.deleted = book.bulk_remove(report.removed)
+        book.bulk_add(additions)
+    return report
@@ -0,0 +1,193 @@
+"""This module contains lightweight instrumentation of AddressBook operations.
+
+Operations (AddressBook methods, saving and loading) count their calls and measure the time
+they take; searches also count the entries they scan and return, and caches count their hits and misses.
+The counters live in this module, so they cover everything done by the process. They are shown by
+MainApp ('Operation Stats') and written as JSON by 'addressbook --metrics FILE ...'.
+
+The counters are off by default. They are turned on by setting 'enabled' to True, by the environment
+variable ADDRESSBOOK_METRICS=1 or by 'addressbook --metrics FILE'; while they are off, instrumented functions
+only check the flag. The parsers run for every field of every entry, so they are timed in batches rather than
+one by one: imported records are parsed in chunks ('parse_chunk', scanning the records and returning the valid
+ones), and parsing a single new entry is part of 'add_new'.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# whether operations are counted and timed
+enabled = os.environ.get('ADDRESSBOOK_METRICS', '0') not in ('', '0')
+
+# ab_profile.Profiler running the operations while the profiling mode is on
+profiler = None
+
+
+class OperationStats(object):
+    """Counters of one operation
+
+    Attributes:
+        calls (int): Number of calls
+        total (float): Cumulative time of the calls (seconds)
+        max (float): Time of the longest call (seconds)
+        scanned (int): Number of entries scanned (by searches)
+        returned (int): Number of entries returned (by searches)
+    """
+
+    __slots__ = ('calls', 'total', 'max', 'scanned', 'returned')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.scanned = 0
+        self.returned = 0
+
+    def as_dict(self):
+        return {'calls': self.calls, 'total_ms': self.total * 1000, 'max_ms': self.max * 1000,
+                'mean_ms': self.total * 1000 / self.calls if self.calls else None,
+                'scanned': self.scanned, 'returned': self.returned}
+
+
+class CacheStats(object):
+    """Counters of one cache
+
+    Attributes:
+        hits (int): Number of values found in the cache
+        misses (int): Number of values computed because they weren't in the cache
+    """
+
+    __slots__ = ('hits', 'misses')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+
+operations = {}     # name: OperationStats
+caches = {}         # name: CacheStats
+
+
+def operation(name):
+    """Return the counters of the operation, creating them on the first use"""
+    stats = operations.get(name)
+    if stats is None:
+        stats = operations[name] = OperationStats()
+    return stats
+
+
+def cache(name):
+    """Return the counters of the cache, creating them on the first use"""
+    stats = caches.get(name)
+    if stats is None:
+        stats = caches[name] = CacheStats()
+    return stats
+
+
+def record(name, elapsed):
+    """Count a call of the operation that took 'elapsed' seconds"""
+    stats = operation(name)
+    stats.calls += 1
+    stats.total += elapsed
+    if elapsed > stats.max:
+        stats.max = elapsed
+
+
+def timed(name):
+    """Decorator counting and timing calls of the function as the operation 'name'"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                if profiler is not None:
+                    return profiler.run(name, func, args, kwargs)
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def measured(name):
+    """Count and time the 'with' block as a call of the operation 'name'"""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def items(name, scanned, returned):
+    """Count entries scanned and returned by the operation. Should be called only if 'enabled'."""
+    stats = operation(name)
+    stats.scanned += scanned
+    stats.returned += returned
+
+
+def hit(name):
+    """Count a hit of the cache. Should be called only if 'enabled'."""
+    cache(name).hits += 1
+
+
+def miss(name):
+    """Count a miss of the cache. Should be called only if 'enabled'."""
+    cache(name).misses += 1
+
+
+def reset():
+    """Set all the counters to zero"""
+    operations.clear()
+    caches.clear()
+
+
+def snapshot():
+    """Return all the counters as a dictionary that can be written as JSON"""
+    return {'enabled': enabled,
+            'operations': {k: v.as_dict() for k, v in sorted(operations.items())},
+            'caches': {k: v.as_dict() for k, v in sorted(caches.items())}}
+
+
+def dump(path):
+    """Write all the counters as JSON to the file"""
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def format_metrics():
+    """Return human readable representation of the counters"""
+
+    if not enabled:
+        return 'Operation counters are turned off (set ADDRESSBOOK_METRICS=1 to turn them on).'
+    if not operations and not caches:
+        return 'No operations have been counted yet.'
+    lines = ['{0:<16} {1:>8} {2:>12} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+        'Operation', 'calls', 'total ms', 'mean ms', 'max ms', 'scanned', 'returned')]
+    for name, s in sorted(operations.items()):
+        lines.append('{0:<16} {1:>8} {2:>12.2f} {3:>10.3f} {4:>10.3f} {5:>10} {6:>10}'.format(
+            name, s.calls, s.total * 1000, s.total * 1000 / s.calls if s.calls else 0, s.max * 1000,
+            s.scanned or '-', s.returned or '-'))
+    if caches:
+        lines.extend(['', '{0:<16} {1:>8} {2:>8} {3:>10}'.format('Cache', 'hits', 'misses', 'hit rate')])
+        for name, c in sorted(caches.items()):
+            rate = '-' if c.hit_rate is None else '{0:.1%}'.format(c.hit_rate)
+            lines.append('{0:<16} {1:>8} {2:>8} {3:>10}'.format(name, c.hits, c.misses, rate))
+    return '\n'.join(lines)
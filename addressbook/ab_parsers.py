@@ -150,3 +150,21 @@ def email_valid(email_string):
         raise WrongInput('Invalid email address. Example of a valid address: johndoe@example.com.')
     else:
         return email_string
+
+
+def tag_name(name):
+    """Return the name of a tag in the form it is stored in (lower case, single spaces)"""
+    if not isinstance(name, str):
+        raise WrongInput("Invalid tag: {0!r}".format(name))
+    name = ' '.join(name.lower().split())
+    if not name or any(c in name for c in '()",='):
+        raise WrongInput("Invalid tag: '{0}'. Tags cannot be blank or contain any of: ( ) \" , =".format(name))
+    return name
+
+
+def tag_parser(tags):
+    """Parse tags given as a string of comma-separated names (e.g. 'family, conference 2026') or as a sequence
+    of names. Return a frozenset of tag names."""
+    if isinstance(tags, str):
+        tags = [t for t in tags.split(',') if t.strip()]
+    return frozenset(tag_name(t) for t in tags)
@@ -1,13 +1,35 @@
 """This module contains Person class used for creating and modifying entries in the addressbook"""
 
 import datetime as dt
+from operator import attrgetter
 
+from addressbook import ab_metrics as metrics
+from addressbook.ab_helpers import LazyModule
 from addressbook.ab_parsers import *
 
+hashlib = LazyModule('hashlib')
+
 
 class Person(object):
     """Class for creating and modifying entries in the addressbook"""
 
+    # Unique number of the entry, given by the AddressBook the Person is added to. Unlike 'personid',
+    # it identifies the entry when it is stored, removed, indexed or exported. It cannot be set directly.
+    uid = None
+
+    # Tags of the entry (a frozenset of names, see ab_tags). Set as a string of comma-separated names or
+    # a sequence of names, e.g. person.tags = 'family, conference 2026'.
+    tags = frozenset()
+
+    # attributes set by __init__, in the order used by 'to_tuple' and 'from_tuple'
+    ATTRIBUTES = ('name', 'surname', 'email', 'phone', 'phone_area', 'phone_num', 'personid', 'birthday', 'year',
+                  'month', 'day', 'city', 'streetname', 'streetnumber')
+
+    # attributes making the content of the entry, compared by 'content' (the rest of ATTRIBUTES is derived
+    # from them); e-mail is the last one, as it is normalized
+    CONTENT = ('name', 'surname', 'phone_area', 'phone', 'birthday', 'city', 'streetname', 'streetnumber', 'email')
+    _content = attrgetter(*CONTENT[:-1])
+
     def __init__(self, name, surname, email, phone, mode='PL'):
         """
         Attributes:
@@ -55,18 +77,35 @@ class Person(object):
     def __lt__(self, other):
         return self.personid < other.personid
 
+    def __getstate__(self):
+        # the AddressBook holding the Person and cached values are not saved together with it
+        state = self.__dict__.copy()
+        state.pop('_owner', None)
+        state.pop('_cache', None)
+        return state
+
     def __setattr__(self, key, value):
-        if isinstance(value, str) and key != 'email':
+        if key == 'uid':
+            raise AttributeError("'uid' is given by the AddressBook and cannot be changed")
+
+        if isinstance(value, str) and key not in ('email', 'tags'):
             value = value.title()
 
         if key == 'email':
-            value = email_valid(value)
+            values = {key: email_valid(value)}
+
+        elif key in ('name', 'surname') and 'personid' in self.__dict__:
+            # keep personid up to date when the person is renamed
+            values = {key: value}
+            names = {'name': self.name, 'surname': self.surname, key: value}
+            values['personid'] = str(names['surname'] + "_" + names['name'])
+
+        elif key == 'tags':
+            values = {key: _shared(tag_parser(value))}
 
         elif key == 'phone':
             a, b, c = phone_parser(value)
-            return (super().__setattr__(key, a),
-                    super().__setattr__('phone_area', b),
-                    super().__setattr__('phone_num', c))
+            values = {key: a, 'phone_area': b, 'phone_num': c}
 
         elif key == 'street':
             # specifying both street name and number is obligatory in this case
@@ -76,39 +115,108 @@ class Person(object):
                 raise WrongInput("You have not chosen a street number.")
 
             a, b = street_parser(value)
-            return (super().__setattr__('streetname', a),
-                    super().__setattr__('streetnumber', b))
+            values = {'streetname': a, 'streetnumber': b}
 
         elif key == 'streetname' and value is not None:
             a, b = street_parser(value, self.streetnumber or ' ')
-            return (super().__setattr__(key, a),
-                    super().__setattr__('streetnumber', b))
+            values = {key: a, 'streetnumber': b}
 
         elif key == 'streetnumber' and value is not None:
             a, b = street_parser(self.streetname or ' ', value)
-            return (super().__setattr__(key, b),
-                    super().__setattr__('streetname', a))
+            values = {key: b, 'streetname': a}
 
         elif key == 'birthday' and value is not None:
             y, m, d = date_parser(value)
             try:
                 birthday = dt.date(y, m, d)
-                return (super().__setattr__(key, birthday),
-                        super().__setattr__('year', birthday.year),
-                        super().__setattr__('month', birthday.month),
-                        super().__setattr__('day', birthday.day))
             except ValueError as ex:
                 raise WrongInput(ex.__str__())
+            values = {key: birthday, 'year': birthday.year, 'month': birthday.month, 'day': birthday.day}
+
+        else:
+            values = {key: value}
+
+        self._assign(values)
+
+    @classmethod
+    def from_tuple(cls, values):
+        """Create a Person from already parsed and validated values of ATTRIBUTES (see 'to_tuple')"""
+        person = cls.__new__(cls)
+        person.__dict__.update(zip(cls.ATTRIBUTES, values))
+        return person
+
+    def to_tuple(self):
+        """Return values of the Person's ATTRIBUTES. Tuples are much smaller and faster to pickle than
+        Person objects, e.g. when they are sent between processes."""
+        d = self.__dict__
+        return tuple([d.get(k) for k in self.ATTRIBUTES])
+
+    def tag(self, *names):
+        """Add tags to the Person"""
+        self.tags = self.tags.union(names)
+
+    def untag(self, *names):
+        """Remove tags from the Person"""
+        self.tags = self.tags.difference(tag_parser(names))
+
+    def content(self):
+        """Return values of the Person's CONTENT attributes as a tuple. Differences the parsers don't remove
+        (the case of e-mail addresses) are normalized, so entries with equal contents are the same person."""
+        return self._content(self) + (self.email.strip().lower(),)
+
+    @property
+    def fingerprint(self):
+        """Hash of the Person's content (128-bit integer), the same in every process and every session.
+        It is computed once and kept until any attribute of the Person changes."""
+        return self.cached('fingerprint', _fingerprint)
 
-        return super().__setattr__(key, value)
+    def _assign(self, values):
+        """Set already parsed attribute values and let the AddressBook holding the Person know about the change.
+
+        Attributes:
+            values (dict): Names of attributes and their new values
+        """
+
+        self.__dict__.pop('_cache', None)
+        owner = self.__dict__.get('_owner')
+        if owner is None:
+            self.__dict__.update(values)
+        else:
+            old = {k: self.__dict__.get(k) for k in values}
+            self.__dict__.update(values)
+            owner._entry_changed(self, old)
+
+    def cached(self, name, compute):
+        """Return a value computed from the Person's attributes. The value is computed once and kept until
+        any attribute of the Person changes.
+
+        Attributes:
+            name (str): Name the value is cached under
+            compute (function): Function computing the value from the Person
+        """
+        cache = self.__dict__.get('_cache')
+        if cache is None:
+            cache = self.__dict__['_cache'] = {}
+        try:
+            value = cache[name]
+        except KeyError:
+            if metrics.enabled:
+                metrics.miss(name)
+            value = cache[name] = compute(self)
+            return value
+        if metrics.enabled:
+            metrics.hit(name)
+        return value
 
     def get_details(self):
         """Get list of attributes' names and values from the Person dictionary"""
         keys = ['surname', 'name', 'email', 'phone', 'birthday', 'city', 'streetname', 'streetnumber']
         names = (k.capitalize() for k in keys)
         vals = (self.__getattribute__(k) for k in keys)
-        details = ('{}: {}'.format(a, b) for a, b in zip(names, vals) if b is not None)
-        return list(details)
+        details = ['{}: {}'.format(a, b) for a, b in zip(names, vals) if b is not None]
+        if self.tags:
+            details.append('Tags: {}'.format(', '.join(sorted(self.tags))))
+        return details
 
     def get_age(self):
         """Function for calculating age from date of birth
@@ -123,3 +231,29 @@ class Person(object):
         if result < 0:
             raise ValueError("Judging by the date of birth, this person has not been born yet.")
         return result
+
+
+# equal sets of tags shared by many people, which keeps them small in memory and in pickle files
+_tag_sets = {}
+
+
+def _shared(tags):
+    return _tag_sets.setdefault(tags, tags)
+
+
+def _field(value):
+    """Return the canonical text of a value of the content: it depends only on the value, not on its class
+    or repr (e.g. a date subclass gives the same text as a date)"""
+    if value is None:
+        return ''
+    if isinstance(value, dt.date):
+        value = value.isoformat()
+    return '=' + str(value)
+
+
+def _fingerprint(person):
+    text = '\x1f'.join(map(_field, person.content()))
+    if person.tags:
+        text += '\x1d' + '\x1e'.join(sorted(person.tags))
+    digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    return int.from_bytes(digest, 'big')
@@ -0,0 +1,190 @@
+"""This module contains the opt-in profiling mode of AddressBook, used for finding where time and memory go.
+
+The mode is turned on by the environment variable ADDRESSBOOK_PROFILE (set to a directory) or by
+'addressbook --profile DIR ...'. While it is on, the whole session runs under cProfile and tracemalloc,
+and every operation counted by ab_metrics (e.g. search_base, sorting, saving) gets its own profile.
+When the session ends, the directory holds:
+
+    0001-search_base.prof, ...     profiles of single operations (in the order they were run)
+    session.prof                   profile of the whole session
+    operations.txt                 time, memory growth and peak memory of every profiled operation
+    memory.txt                     memory held by people, index structures and caches at the end of the
+                                   session, and the largest allocations still held, by line of code
+
+Profiles can be read with 'python -m pstats FILE'. When the mode is off, cProfile and tracemalloc are not
+even imported, and the only cost is the check done by ab_metrics in every counted operation.
+"""
+
+import gc
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from addressbook import ab_metrics as metrics
+from addressbook.ab_abook import AddressBook, Person
+from addressbook.ab_helpers import LazyModule
+from addressbook.ab_index import AttributeIndex
+
+cProfile = LazyModule('cProfile')
+pstats = LazyModule('pstats')
+tracemalloc = LazyModule('tracemalloc')
+
+# environment variable naming the directory profiles are written to
+ENVIRON = 'ADDRESSBOOK_PROFILE'
+
+# operations that get their own profiles (the parsers are called too often for that)
+OPERATIONS = ('add_new', 'search_base', 'sorting', 'removal', 'pickle_base', 'pickle_changes', 'load')
+
+
+class Profiler(object):
+    """Profiles of a session and of the operations run in it
+
+    Attributes:
+        directory (str): Directory the reports are written to, created if it doesn't exist
+        top (int): Number of allocations listed in 'memory.txt'
+    """
+
+    def __init__(self, directory, top=25):
+        self.directory = directory
+        self.top = top
+        self.count = 0              # number of profiled operations
+        self._session = None
+        self._files = []
+        self._rows = []             # (file, name, seconds, memory growth, peak memory)
+        self._running = False       # True while an operation is being profiled
+
+    def start(self):
+        """Start profiling the session. Counting operations is turned on, as operations are found through it."""
+        os.makedirs(self.directory, exist_ok=True)
+        metrics.enabled = True
+        metrics.profiler = self
+        tracemalloc.start()
+        self._session = cProfile.Profile()
+        self._session.enable()
+
+    def run(self, name, func, args, kwargs):
+        """Call the function (an operation of ab_metrics) with its own profile. Operations called by another
+        profiled operation (e.g. sorting done by search_base) are part of its profile."""
+
+        if self._running or name not in OPERATIONS:
+            return func(*args, **kwargs)
+        # only one profile can be active at a time, so the session's profile is paused
+        self._session.disable()
+        self._running = True
+        self.count += 1
+        path = os.path.join(self.directory, '{0:04d}-{1}.prof'.format(self.count, name))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            profile.dump_stats(path)
+            self._files.append(path)
+            self._rows.append((os.path.basename(path), name, elapsed, current - memory, peak - memory))
+            self._running = False
+            self._session.enable()
+
+    def stop(self):
+        """Stop profiling and write the reports"""
+
+        self._session.disable()
+        metrics.profiler = None
+        try:
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        session = os.path.join(self.directory, 'session.prof')
+        self._session.dump_stats(session)
+        # the session's profile doesn't include the time of the operations, which is added from their profiles
+        stats = pstats.Stats(session)
+        for path in self._files:
+            stats.add(path)
+        stats.dump_stats(session)
+
+        with open(os.path.join(self.directory, 'operations.txt'), 'w') as f:
+            f.write('{0:<28} {1:<16} {2:>12} {3:>14} {4:>14}\n'.format(
+                'profile', 'operation', 'time ms', 'memory KiB', 'peak KiB'))
+            for path, name, elapsed, grown, peak in self._rows:
+                f.write('{0:<28} {1:<16} {2:>12.3f} {3:>14.1f} {4:>14.1f}\n'.format(
+                    path, name, elapsed * 1000, grown / 1024, peak / 1024))
+
+        with open(os.path.join(self.directory, 'memory.txt'), 'w') as f:
+            f.write(memory_report(snapshot, footprint(), self.top))
+
+
+def footprint():
+    """Return approximate memory (bytes) held by people, index structures and caches of all the AddressBooks
+    in the process, as a dictionary. Every object is counted once, with its own size (sys.getsizeof), so
+    e.g. a city name shared by many people is counted once, for the first of them."""
+
+    seen = set()
+
+    def size(*objects):
+        total = 0
+        for obj in objects:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                total += sys.getsizeof(obj)
+        return total
+
+    totals = {'people': 0, 'indexes': 0, 'caches': 0}
+    for obj in gc.get_objects():
+        if isinstance(obj, Person):
+            d = obj.__dict__
+            totals['people'] += size(obj, d, *map(d.get, Person.ATTRIBUTES))
+            cache = d.get('_cache')
+            if cache:
+                totals['caches'] += size(cache, *cache.values())
+        elif isinstance(obj, AddressBook):
+            # uids and the change log
+            totals['indexes'] += size(obj._by_uid, obj._changed, obj._removed, obj._logged_at, obj._repeated,
+                                      obj._log_generations, obj._log_uids)
+            if obj._stats_cache is not None:
+                totals['caches'] += size(obj._stats_cache, *obj._stats_cache)
+            if obj._summary is not None:
+                totals['indexes'] += size(obj._summary._entries, *obj._summary._levels)
+            if obj._tag_index is not None:
+                totals['indexes'] += size(obj._tag_index._all, obj._tag_index._tags,
+                                          *obj._tag_index._bitmaps.values())
+        elif isinstance(obj, AttributeIndex):
+            totals['indexes'] += size(obj._buckets, obj._values, *obj._buckets.values())
+    return totals
+
+
+def memory_report(snapshot, totals, top=25):
+    """Return a report of the memory held by kind of objects (see 'footprint') and by line of code
+    (from a tracemalloc snapshot)"""
+
+    lines = ['Memory held at the end of the session:', '']
+    lines.extend('\t{0:<10} {1:>12.1f} KiB'.format(k, v / 1024) for k, v in totals.items())
+    lines.extend(['', 'Largest allocations by line:', ''])
+    for stat in snapshot.statistics('lineno')[:top]:
+        frame = stat.traceback[-1]
+        lines.append('\t{0:>12.1f} KiB {1:>10} blocks  {2}:{3}'.format(stat.size / 1024, stat.count,
+                                                                     frame.filename, frame.lineno))
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def profiling(directory):
+    """Profile the 'with' block, writing the reports to the directory. Does nothing if directory is None."""
+    if not directory:
+        yield None
+        return
+    profiler = Profiler(directory)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+
+def from_environment():
+    """Return the directory for profiles given in the environment (None if profiling is off)"""
+    return os.environ.get(ENVIRON) or None
@@ -0,0 +1,105 @@
+"""This module contains functions used for printing out the entries of the AddressBook.
+
+Formatted details of every person are cached until the person changes. Output is written in chunks
+instead of line by line, and on a terminal it is shown page by page, rendering only the visible entries.
+"""
+
+import sys
+
+from addressbook.ab_helpers import LazyModule
+
+# imported on first use
+shutil = LazyModule('shutil')
+tw = LazyModule('textwrap')
+
+# number of entries written at once when the output is not paged
+CHUNK = 500
+
+_wrapper = None
+
+
+def _format(person):
+    global _wrapper
+    if _wrapper is None:
+        _wrapper = tw.TextWrapper(width=80, initial_indent='\t', subsequent_indent='\t', break_long_words=False)
+    return '\n'.join(_wrapper.wrap(' |  '.join(person.get_details())))
+
+
+def person_block(person):
+    """Return person's details wrapped to 80 characters (cached until any of person's attributes changes)"""
+    return person.cached('block', _format)
+
+
+def render(people, start=1):
+    """Generate formatted blocks of consecutive people, each headed with its number
+
+    Attributes:
+        people (iterable): Person objects
+        start (int): Number of the first person
+    """
+    for ix, person in enumerate(people, start):
+        yield ' <{0}>  \n{1}\n\n'.format(ix, person_block(person))
+
+
+def write_all(people, out=None, chunk=CHUNK):
+    """Write formatted details of all the people, 'chunk' people at once
+
+    Attributes:
+        people (iterable): Person objects
+        out (file): Output stream (sys.stdout by default)
+        chunk (int): Number of people written at once
+    """
+    out = out or sys.stdout
+    buffer = []
+    for block in render(people):
+        buffer.append(block)
+        if len(buffer) >= chunk:
+            out.write(''.join(buffer))
+            buffer.clear()
+    out.write(''.join(buffer))
+    out.flush()
+
+
+def page(people, out=None, height=None, ask=input):
+    """Show formatted details of the people page by page, like 'less' does. Only the people that fit on
+    the current page are rendered. Pressing Enter shows next page, 'b' - previous page, 'q' - quits.
+
+    Attributes:
+        people (sequence): Person objects
+        out (file): Output stream (sys.stdout by default)
+        height (int): Number of lines of a page (by default adjusted to the terminal size)
+        ask (function): Function used for asking user what to do next
+    """
+
+    out = out or sys.stdout
+    if height is None:
+        height = shutil.get_terminal_size((80, 24)).lines - 1
+    height = max(height, 1)
+
+    starts = [0]        # positions of the first people of shown pages
+    while True:
+        first = pos = starts[-1]
+        lines = []
+        # always show at least one person, even if its details don't fit on the page
+        while pos < len(people):
+            block = ' <{0}>  \n{1}\n'.format(pos + 1, person_block(people[pos])).split('\n')
+            if lines and len(lines) + len(block) > height:
+                break
+            lines.extend(block)
+            pos += 1
+        out.write('\n'.join(lines) + '\n')
+        out.flush()
+
+        if pos >= len(people) and first == 0:
+            return
+        answer = ask(">> -- {0}-{1} of {2} -- Enter: next page, 'b': previous page, 'q': quit ".format(
+            first + 1, pos, len(people))).lower()
+        if answer == 'q':
+            return
+        elif answer == 'b':
+            if len(starts) > 1:
+                starts.pop()
+        elif pos < len(people):
+            starts.append(pos)
+        else:
+            return
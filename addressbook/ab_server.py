@@ -0,0 +1,204 @@
+"""This module contains the asyncio server of AddressBook, serving many clients at once.
+
+It speaks the same length-prefixed JSON protocol and carries out the same requests as the daemon
+(see ab_daemon), but every client is served by its own task. Requests that only read the AddressBook
+run concurrently; requests that change it wait for a ReadWriteLock and run one at a time. Sorting,
+exporting and saving, which can take long on big AddressBooks, run in a thread pool so that the event
+loop keeps serving other clients meanwhile.
+
+Usage:
+    python -m addressbook.ab_server serve contacts.pkl [--socket contacts.sock] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from addressbook.ab_daemon import *
+
+
+class ReadWriteLock(object):
+    """Readers-writer lock for asyncio tasks. Any number of readers can hold the lock at once, a writer
+    holds it alone. Readers coming after a waiting writer wait for it, so a stream of reads cannot starve
+    writes."""
+
+    def __init__(self):
+        self.readers = 0                # number of readers holding the lock
+        self.writing = False            # True while a writer holds the lock
+        self._waiting_writers = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def read(self):
+        """Hold the lock for reading inside the 'async with' block"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self.writing and not self._waiting_writers)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.readers -= 1
+                if not self.readers:
+                    self._condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        """Hold the lock for writing inside the 'async with' block"""
+        async with self._condition:
+            self._waiting_writers += 1
+            try:
+                await self._condition.wait_for(lambda: not self.writing and not self.readers)
+            finally:
+                self._waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.writing = False
+                self._condition.notify_all()
+
+
+class AsyncBookServer(object):
+    """asyncio server answering requests of many clients with a BookService"""
+
+    # operations run in the thread pool
+    OFFLOADED = ('sort', 'export', 'save')
+
+    def __init__(self, service, socket_path, workers=4):
+        """
+        Attributes:
+            service (BookService): Service carrying out the requests
+            socket_path (str): Path of the socket
+            workers (int): Number of threads running sorts, exports and saves
+        """
+        self.service = service
+        self.socket_path = socket_path
+        self.lock = ReadWriteLock()
+        self.executor = ThreadPoolExecutor(workers)
+        self._clients = set()
+        self._done = None
+
+    async def handle(self, request):
+        """Carry out the request, holding the lock as the operation needs, and return the response"""
+
+        op = request.get('op') if isinstance(request, dict) else None
+        lock = self.lock.read() if op in self.service.READ_OPS else self.lock.write()
+        async with lock:
+            if op in self.OFFLOADED:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, self.service.handle, request)
+            return self.service.handle(request)
+
+    async def _serve_client(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            while not self.service.stopped:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    data = await reader.readexactly(decode_length(header))
+                    request = json.loads(data.decode('utf-8'))
+                except (ValueError, asyncio.IncompleteReadError) as ex:
+                    writer.write(encode_message({'ok': False, 'error': str(ex)}))
+                    break
+                writer.write(encode_message(await self.handle(request)))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+            if self.service.stopped:
+                self._done.set()
+
+    async def serve(self):
+        """Serve clients until the service gets a 'shutdown' request"""
+
+        self._done = asyncio.Event()
+        remove_stale_socket(self.socket_path)
+        server = await asyncio.start_unix_server(self._serve_client, path=self.socket_path)
+        try:
+            await self._done.wait()
+        finally:
+            server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await server.wait_closed()
+            self.executor.shutdown()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class AsyncBookClient(object):
+    """asyncio client of the AddressBook server, sending requests over a single connection
+
+    Attributes:
+        socket_path (str): Path of the server's socket
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._reader = self._writer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._reader = self._writer = None
+
+    async def request(self, op, **params):
+        """Send a request and return the response. Raise RequestFailed if the request has failed."""
+
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+        params['op'] = op
+        self._writer.write(encode_message(params))
+        await self._writer.drain()
+        try:
+            header = await self._reader.readexactly(HEADER.size)
+            data = await self._reader.readexactly(decode_length(header))
+        except asyncio.IncompleteReadError:
+            raise RequestFailed("The server has closed the connection")
+        response = json.loads(data.decode('utf-8'))
+        if not response.pop('ok'):
+            raise RequestFailed(response['error'])
+        return response
+
+
+def main(argv=None):
+    """Run the server, return the exit code"""
+
+    parser = argparse.ArgumentParser(prog='python -m addressbook.ab_server',
+                                     description='AddressBook server serving many clients over a Unix socket')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    p = commands.add_parser('serve', help='load an AddressBook and serve requests until shut down')
+    p.add_argument('book', help='AddressBook file (.pkl)')
+    p.add_argument('--socket', help='socket path (default: the file name with .sock extension)')
+    p.add_argument('--workers', type=int, default=4, help='threads running sorts, exports and saves')
+    args = parser.parse_args(argv)
+
+    server = AsyncBookServer(BookService(args.book), args.socket or default_socket(args.book), args.workers)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""This module contains functions used for saving AddressBook files shared by several users.
+
+Writers hold an exclusive advisory lock (fcntl.flock) of a lock file kept next to the AddressBook file
+('contacts.pkl.lock'), so saves never interleave. The lock file also holds the version number of the last
+save, which lets a writer check cheaply whether the file has been saved by somebody else since it was opened.
+
+Readers don't lock anything: a new version is written to a temporary file, which then replaces the
+AddressBook file at once, so a reader sees either the previous or the new version, never a part of a save.
+After the AddressBook file, its Bloom filter ('contacts.pkl.bloom', see ab_bloom) is written, and its record
+file ('contacts.pkl.records', see ab_lazy) if the AddressBook's 'record_file' is set.
+"""
+
+import os
+from contextlib import contextmanager
+
+from addressbook.ab_helpers import LazyModule
+
+# imported on first use; without fcntl (on Windows) saves are not locked
+bloom = LazyModule('addressbook.ab_bloom')
+fcntl = LazyModule('fcntl', optional=True)
+lazy = LazyModule('addressbook.ab_lazy')
+pickle = LazyModule('pickle')
+tempfile = LazyModule('tempfile')
+
+
+def lock_path(path):
+    """Return the path of the lock file of the AddressBook file"""
+    return path + '.lock'
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock of the AddressBook file inside the 'with' block. Yields the open lock file."""
+
+    with open(lock_path(path), 'a+') as lock:
+        if fcntl:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield lock
+        finally:
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def saved_version(lock):
+    """Return the version number recorded in the open lock file (None if there is none)"""
+    lock.seek(0)
+    try:
+        return int(lock.read().strip())
+    except ValueError:
+        return None
+
+
+def read_book(path):
+    """Load the AddressBook saved in the file"""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def write_book(book, path, lock):
+    """Save the AddressBook to the file, replacing the file at once. Must be called holding the lock.
+
+    Attributes:
+        book (AddressBook): AddressBook to be saved
+        path (str): AddressBook file
+        lock (file): Open lock file, given by 'locked'
+    """
+
+    # the version is recorded first: if the save is interrupted, the lock file shows a newer version than
+    # the file, so the next writer compares the versions in the files instead of trusting the lock file
+    lock.seek(0)
+    lock.truncate()
+    lock.write(str(book.version))
+    lock.flush()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(prefix='.' + os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(book, f, 2)
+            f.flush()
+            os.fsync(f.fileno())
+        # temporary files are created readable only by the owner
+        os.chmod(temp, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+    # these files only save loading the book, outdated ones are recognized and ignored
+    if book.bloom_error_rate:
+        try:
+            bloom.write_filter(book, path, book.bloom_error_rate)
+        except OSError:
+            pass
+    if book.record_file:
+        try:
+            lazy.write_records(book, path)
+        except OSError:
+            pass
@@ -0,0 +1,134 @@
+"""This module contains Merkle-style summaries of AddressBooks, used for finding changed entries quickly.
+
+A summary holds a hash of every entry, made of its uid and its content fingerprint (Person.fingerprint).
+Entries are grouped by uid: 2 ** LEAF_BITS consecutive uids make a leaf, 2 ** FANOUT_BITS leaves make
+a group of the next level and so on, and every group has a digest combining the hashes of all its entries.
+Two summaries (e.g. of a book and of its earlier copy, or of two copies of a book kept by sync peers) are
+compared from the top: only groups with different digests are looked into, so finding the changed entries
+takes time proportional to their number rather than to the size of the book.
+
+Digests are combined with XOR, so a change of one entry updates its groups without touching the rest.
+The summary of an AddressBook ('AddressBook.summary') is kept up to date from its change log.
+"""
+
+from addressbook.ab_helpers import gc_paused
+
+# number of levels of groups (the first one are leaves)
+LEVELS = 5
+
+# uids in a leaf and groups in a group of the next level (as powers of two)
+LEAF_BITS = 5
+FANOUT_BITS = 4
+
+# odd 128-bit constant spreading uids over the whole range of entry hashes
+_MIX = 0x9e3779b97f4a7c15f39cc0605cedc835
+_MASK = (1 << 128) - 1
+
+
+def entry_hash(uid, fingerprint):
+    """Return the hash of an entry, different for equal contents of entries with different uids"""
+    return fingerprint ^ (uid * _MIX & _MASK)
+
+
+class Summary(object):
+    """Merkle-style summary of an AddressBook
+
+    Attributes:
+        generation (int): Generation of the AddressBook the summary is up to date with
+        root (int): Digest of all the entries, equal roots mean (almost certainly) equal books
+    """
+
+    def __init__(self):
+        self.generation = None
+        self.root = 0
+        self._entries = {}                              # uid: entry hash
+        self._levels = [{} for _ in range(LEVELS)]      # group: digest, for every level
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __eq__(self, other):
+        if isinstance(other, Summary):
+            return self.root == other.root and self._entries == other._entries
+
+    def copy(self):
+        """Return a copy of the summary, e.g. to be compared with the summary of the book after some changes"""
+        result = Summary()
+        result.generation, result.root = self.generation, self.root
+        result._entries = self._entries.copy()
+        result._levels = [level.copy() for level in self._levels]
+        return result
+
+    def set(self, uid, h):
+        """Set the hash of an entry (None for an entry removed from the book)"""
+
+        old = self._entries.get(uid, 0)
+        if h is None:
+            self._entries.pop(uid, None)
+            h = 0
+        else:
+            self._entries[uid] = h
+        delta = old ^ h
+        if not delta:
+            return
+        self.root ^= delta
+        group = uid >> LEAF_BITS
+        for level in self._levels:
+            digest = level.get(group, 0) ^ delta
+            if digest:
+                level[group] = digest
+            else:
+                del level[group]
+            group >>= FANOUT_BITS
+
+    def build(self, book):
+        """Compute the summary of all the entries of the AddressBook"""
+
+        self.__init__()
+        with gc_paused():
+            entries = self._entries = {p.uid: entry_hash(p.uid, p.fingerprint) for p in book}
+            # digests are computed level by level, every level is much smaller than the previous one
+            groups, shift = entries, LEAF_BITS
+            for level in self._levels:
+                digests = {}
+                for g, h in groups.items():
+                    g >>= shift
+                    digests[g] = digests.get(g, 0) ^ h
+                level.update((g, h) for g, h in digests.items() if h)
+                groups, shift = level, FANOUT_BITS
+            for h in groups.values():
+                self.root ^= h
+        self.generation = book.generation
+
+    def refresh(self, book):
+        """Bring the summary up to date with the AddressBook it has been built for. Only the entries changed
+        since the summary's generation are hashed again, unless the book doesn't log them any more."""
+
+        if self.generation == book.generation:
+            return
+        changes = None if self.generation is None else book.changes_since(self.generation)
+        if changes is None:
+            self.build(book)
+            return
+        changed, removed = changes
+        for p in removed:
+            if book.get(p.uid) is None:
+                self.set(p.uid, None)
+        for p in changed:
+            if book.get(p.uid) is p:
+                self.set(p.uid, entry_hash(p.uid, p.fingerprint))
+        self.generation = book.generation
+
+    def diff(self, other):
+        """Return the set of uids of entries added, removed or changed between the summaries"""
+
+        groups = self._levels[-1].keys() | other._levels[-1].keys()
+        for k in reversed(range(LEVELS)):
+            mine, theirs = self._levels[k], other._levels[k]
+            groups = [g for g in groups if mine.get(g, 0) != theirs.get(g, 0)]
+            if k:
+                groups = [(g << FANOUT_BITS) + i for g in groups for i in range(1 << FANOUT_BITS)]
+
+        mine, theirs = self._entries, other._entries
+        return {uid for leaf in groups for uid in range(leaf << LEAF_BITS, (leaf + 1) << LEAF_BITS)
+                if mine.get(uid) != theirs.get(uid)}
@@ -0,0 +1,240 @@
+"""This module contains tags of the AddressBook's entries and queries combining them with attribute values.
+
+Every entry can have any number of tags (e.g. 'family', 'customers', 'conference 2026'), see Person.tags.
+TagIndex keeps a bitmap of uids for every tag, so a query like
+
+    customers AND city=Warsaw AND NOT unsubscribed
+
+is answered with a few bitwise operations on integers. Query terms are tags (quoted if they contain spaces
+or are operator words, e.g. "conference 2026") and attribute values written as 'attribute=value'
+(SEARCH_KEYS, e.g. city="Los Angeles"), combined with AND, OR, NOT and parentheses.
+
+Bitmaps are kept in bytearrays (setting a bit of a Python int would copy the whole int) and turned into
+ints only for evaluating queries.
+"""
+
+import re
+import sys
+from array import array
+
+from addressbook.ab_abook import SEARCH_KEYS, search_value
+from addressbook.ab_exceptions import WrongInput
+from addressbook.ab_index import AttributeIndex
+from addressbook.ab_parsers import tag_name
+
+# operators of queries, in the order of increasing priority
+OPERATORS = ('OR', 'AND', 'NOT')
+
+_token = re.compile(r'\s*(\(|\)|(?:[^\s()"=]+=)?"[^"]*"|[^\s()"]+)')
+
+
+def set_bit(bits, uid):
+    """Set the bit of the uid in a bitmap (bytearray), extending it if needed"""
+    i = uid >> 3
+    if i >= len(bits):
+        bits.extend(bytes(i + 1 - len(bits)))
+    bits[i] |= 1 << (uid & 7)
+
+
+def clear_bit(bits, uid):
+    i = uid >> 3
+    if i < len(bits):
+        bits[i] &= ~(1 << (uid & 7))
+
+
+def to_int(bits):
+    return int.from_bytes(bits, 'little')
+
+
+def from_uids(uids):
+    """Return the bitmap of the uids as an int"""
+    bits = bytearray()
+    for uid in uids:
+        set_bit(bits, uid)
+    return to_int(bits)
+
+
+def members(bitmap):
+    """Generate uids of a bitmap (int) in ascending order"""
+    words = array('Q', bitmap.to_bytes((bitmap.bit_length() + 63) // 64 * 8, 'little'))
+    # the bytes are little-endian, the array reads them in the byte order of the machine
+    if sys.byteorder != 'little':
+        words.byteswap()
+    for i, word in enumerate(words):
+        base = i * 64
+        while word:
+            low = word & -word
+            yield base + low.bit_length() - 1
+            word ^= low
+
+
+class TagIndex(object):
+    """Bitmaps of uids of the AddressBook's entries: one for every tag and one of all the entries.
+
+    Like AttributeIndex, the index is refreshed before every query with the entries logged as changed
+    since the indexed generation. Attribute terms of queries use AttributeIndex objects, created on the
+    first query by an attribute and kept with the TagIndex.
+    """
+
+    def __init__(self, book):
+        """
+        Attributes:
+            book (AddressBook): Indexed AddressBook
+        """
+        self.book = book
+        self.generation = None      # generation of the AddressBook the index reflects
+        book.watch(self)
+        self._bitmaps = {}          # tag: bytearray
+        self._counts = {}           # tag: number of entries with the tag
+        self._all = bytearray()     # bitmap of all the entries
+        self._tags = {}             # uid: tags of the entry
+        self.attributes = {}        # attribute: AttributeIndex
+
+    def rebuild(self):
+        """Index all the entries of the AddressBook from scratch"""
+        self._bitmaps.clear()
+        self._counts.clear()
+        self._tags.clear()
+        self._all = bytearray()
+        for p in self.book:
+            self._add(p)
+        self.generation = self.book.generation
+
+    def refresh(self):
+        """Bring the index up to date with the AddressBook"""
+
+        book = self.book
+        if self.generation == book.generation:
+            return
+        changes = book.changes_since(self.generation) if self.generation is not None else None
+        if changes is None:
+            self.rebuild()
+            return
+        changed, removed = changes
+        for p in removed:
+            self._discard(p.uid)
+        for p in changed:
+            self._discard(p.uid)
+            if book.get(p.uid) is p:
+                self._add(p)
+        self.generation = book.generation
+
+    def tags(self):
+        """Return a dict of tags and numbers of entries having them"""
+        self.refresh()
+        return dict(self._counts)
+
+    def bitmap(self, tag):
+        """Return the bitmap (int) of entries with the tag"""
+        self.refresh()
+        bits = self._bitmaps.get(tag_name(tag))
+        return to_int(bits) if bits else 0
+
+    def select(self, query):
+        """Return a list of entries matching the query (see the module's description), in the order of uids"""
+        self.refresh()
+        get = self.book.get
+        return [get(uid) for uid in members(self.evaluate(parse_query(query)))]
+
+    def evaluate(self, node):
+        """Return the bitmap (int) of entries matching a parsed query"""
+
+        op = node[0]
+        if op == 'tag':
+            bits = self._bitmaps.get(node[1])
+            return to_int(bits) if bits else 0
+        elif op == 'attr':
+            index = self.attributes.get(node[1])
+            if index is None:
+                index = self.attributes[node[1]] = AttributeIndex(self.book, node[1])
+            return from_uids(p.uid for p in index.lookup(node[2]))
+        elif op == 'NOT':
+            return to_int(self._all) & ~self.evaluate(node[1])
+        elif op == 'AND':
+            result = self.evaluate(node[1])
+            for n in node[2:]:
+                if not result:
+                    break
+                result &= self.evaluate(n)
+            return result
+        else:
+            result = 0
+            for n in node[1:]:
+                result |= self.evaluate(n)
+            return result
+
+    def _add(self, person):
+        uid = person.uid
+        set_bit(self._all, uid)
+        tags = person.tags
+        if tags:
+            self._tags[uid] = tags
+            for tag in tags:
+                bits = self._bitmaps.get(tag)
+                if bits is None:
+                    bits = self._bitmaps[tag] = bytearray()
+                    self._counts[tag] = 0
+                set_bit(bits, uid)
+                self._counts[tag] += 1
+
+    def _discard(self, uid):
+        clear_bit(self._all, uid)
+        for tag in self._tags.pop(uid, ()):
+            clear_bit(self._bitmaps[tag], uid)
+            self._counts[tag] -= 1
+            if not self._counts[tag]:
+                del self._bitmaps[tag], self._counts[tag]
+
+
+def parse_query(query):
+    """Parse a query into a tree of tuples: ('tag', name), ('attr', attribute, value), ('NOT', node),
+    ('AND', node, node, ...) and ('OR', node, node, ...). Raise WrongInput if the query is invalid."""
+
+    tokens = []
+    pos, query = 0, query.strip()
+    while pos < len(query):
+        match = _token.match(query, pos)
+        if match is None:
+            raise WrongInput("Invalid query: unexpected '{0}'".format(query[pos:].strip()))
+        tokens.append(match.group(1))
+        pos = match.end()
+    if not tokens:
+        raise WrongInput("The query is empty")
+
+    def peek():
+        return tokens[0].upper() if tokens else None
+
+    def expression(level):
+        if level == len(OPERATORS) - 1:
+            return factor()
+        op = OPERATORS[level]
+        nodes = [expression(level + 1)]
+        while peek() == op:
+            tokens.pop(0)
+            nodes.append(expression(level + 1))
+        return nodes[0] if len(nodes) == 1 else (op,) + tuple(nodes)
+
+    def factor():
+        if not tokens:
+            raise WrongInput("Invalid query: unexpected end")
+        token = tokens.pop(0)
+        if token.upper() == 'NOT':
+            return 'NOT', factor()
+        if token == '(':
+            node = expression(0)
+            if not tokens or tokens.pop(0) != ')':
+                raise WrongInput("Invalid query: missing ')'")
+            return node
+        if token == ')' or token.upper() in OPERATORS:
+            raise WrongInput("Invalid query: unexpected '{0}'".format(token))
+        key, eq, value = token.partition('=')
+        if not eq:
+            return 'tag', tag_name(token.strip('"'))
+        if key not in SEARCH_KEYS:
+            raise WrongInput("Invalid query: unknown attribute '{0}'".format(key))
+        return 'attr', key, search_value(key, value.strip('"'))
+
+    node = expression(0)
+    if tokens:
+        raise WrongInput("Invalid query: unexpected '{0}'".format(tokens[0]))
+    return node
@@ -0,0 +1,162 @@
+"""This module contains ThreadSafeBook class used for sharing an AddressBook between threads.
+
+Readers never touch the AddressBook itself: they work on a Snapshot, an immutable copy of the entries
+taken after the last write. A new Snapshot is published by replacing a single attribute, so a reader gets
+either the previous or the new one, never a book changed or sorted only partly, and readers take no locks
+at all. Writers take turns: the changes are made to the AddressBook inside 'ThreadSafeBook.write' blocks,
+and the Snapshot is published when the block ends.
+
+    shared = ThreadSafeBook(book)
+    found = shared.search_base(city='Warszawa')     # any number of threads
+    with shared.write() as book:                    # one thread at a time
+        book.get(12).city = 'Kraków'
+        book.sorting('surname')
+"""
+
+import threading
+from contextlib import contextmanager
+from operator import attrgetter
+
+from addressbook.ab_abook import *
+
+
+class FrozenPerson(Person):
+    """Copy of an entry held by a Snapshot. It cannot be changed."""
+
+    def _assign(self, values):
+        raise AttributeError("Entries of a snapshot cannot be changed")
+
+
+def freeze(person):
+    """Return an unchangeable copy of the entry, keeping its uid"""
+    frozen = FrozenPerson.from_tuple(person.to_tuple())
+    frozen.__dict__['uid'] = person.uid
+    if person.tags:
+        frozen.__dict__['tags'] = person.tags
+    return frozen
+
+
+class Snapshot(object):
+    """Immutable view of the AddressBook's entries at one generation.
+
+    Attributes:
+        entries (tuple): Frozen copies of the entries, in the order of the AddressBook
+        generation (int): Generation of the AddressBook the Snapshot was taken at
+    """
+
+    def __init__(self, entries, generation):
+        self.entries = entries
+        self.generation = generation
+        self._by_uid = {p.uid: p for p in entries}
+        self._indexes = {}      # attribute: {value: [entries]}, built on the first search by the attribute
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def get(self, uid, default=None):
+        """Return the entry with the given uid (or default if there is no such entry)"""
+        return self._by_uid.get(uid, default)
+
+    def _index(self, attribute):
+        # Threads searching by a new attribute at the same time may both build the index. They build
+        # the same one, so whichever is stored last doesn't matter.
+        index = self._indexes.get(attribute)
+        if index is None:
+            index = {}
+            for p in self.entries:
+                index.setdefault(getattr(p, attribute), []).append(p)
+            self._indexes[attribute] = index
+        return index
+
+    def search_base(self, **kwargs):
+        """Find entries like 'AddressBook.search_base', but without sorting anything. Return None, a single
+        entry or a list of entries (in the order of the AddressBook).
+
+        Attributes:
+            **kwargs (keyword=str): Key and value of the person being looked for
+        """
+
+        for k, v in kwargs.items():
+            if k not in SEARCH_KEYS:
+                raise WrongInput("Entries cannot be searched by {0!r}".format(k))
+            found = self._index(k).get(search_value(k, v))
+            if not found:
+                return None
+            return found[0] if len(found) == 1 else list(found)
+
+    def sorted(self, *atts, reverse=None, collation=None):
+        """Return a list of the entries sorted like by 'AddressBook.sorting'. The Snapshot is not changed."""
+        order = sort_order(self.entries, *atts, reverse=reverse, collation=collation)
+        return list(map(self.entries.__getitem__, order))
+
+
+class ThreadSafeBook(object):
+    """AddressBook shared between threads: many readers and writers taking turns.
+
+    Attributes:
+        book (AddressBook): Shared AddressBook. It should be changed only inside 'write' blocks.
+    """
+
+    def __init__(self, book=None):
+        self.book = book if book is not None else AddressBook()
+        self._write_lock = threading.Lock()
+        self._frozen = {}           # uid: frozen copy of the entry, shared by consecutive snapshots
+        self._snapshot = None
+        self.book.watch(self)
+        self._publish()
+
+    @property
+    def generation(self):
+        """Generation of the AddressBook the latest Snapshot reflects (see 'AddressBook.watch')"""
+        return self._snapshot.generation if self._snapshot is not None else None
+
+    def snapshot(self):
+        """Return the latest published Snapshot"""
+        return self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def get(self, uid, default=None):
+        return self._snapshot.get(uid, default)
+
+    def search_base(self, **kwargs):
+        return self._snapshot.search_base(**kwargs)
+
+    def sorted(self, *atts, reverse=None, collation=None):
+        return self._snapshot.sorted(*atts, reverse=reverse, collation=collation)
+
+    @contextmanager
+    def write(self):
+        """Change the AddressBook inside the 'with' block, which yields it. Writers wait for each other;
+        readers keep using the previous Snapshot until the block ends and the new one is published."""
+
+        with self._write_lock:
+            try:
+                yield self.book
+            finally:
+                self._publish()
+
+    def _publish(self):
+        # only the entries changed since the previous snapshot are copied again
+        book = self.book
+        previous = self._snapshot
+        changes = book.changes_since(previous.generation) if previous is not None else None
+        if changes is None:
+            self._frozen = {p.uid: freeze(p) for p in book}
+        else:
+            changed, removed = changes
+            for p in removed:
+                self._frozen.pop(p.uid, None)
+            for p in changed:
+                if book.get(p.uid) is p:
+                    self._frozen[p.uid] = freeze(p)
+        # sorting doesn't change the generation, so the order is always taken anew
+        self._snapshot = Snapshot(tuple(map(self._frozen.__getitem__, map(attrgetter('uid'), book))),
+                                  book.generation)
@@ -11,23 +11,48 @@ Options include adding, modifying and removing entries, as well as sorting and s
 
 """
 
-import glob
 import shutil
+from functools import partial
 from time import localtime, strftime
 
 from addressbook.ab_abook import *
+from addressbook import ab_metrics as metrics
+from addressbook.ab_analytics import format_stats
+from addressbook.ab_collation import DEFAULT_COLLATION
+from addressbook import ab_lazy
+from addressbook.ab_profile import from_environment, profiling
+
+glob = LazyModule('glob')
 
 
 class MainApp(object):
-    """Class for creating and navigating through program interface."""
+    """Class for creating and navigating through program interface.
+
+    Every menu is a state: a method that interacts with the user and returns the next state (a method
+    to be called without arguments, e.g. 'self.action_next' or 'partial(self.action_person, result)'),
+    or None when the program should be closed. States are called one after another by 'run', so moving
+    between menus doesn't make the stack grow, no matter how long the session is.
+
+    In the lazy mode, AddressBooks with a record file are opened as ab_lazy.LazyBook: only their index is read,
+    and entries are read when they are shown or found. The whole AddressBook is loaded when it is changed,
+    sorted, saved or queried in any other way (see 'full_book').
+    """
 
-    def __init__(self):
+    # AddressBook Options loading the whole AddressBook if it has been opened lazily
+    FULL_BOOK_EVENTS = ('3', '4', '5', '6', '7', '10', '11', '12', '14')
+
+    def __init__(self, lazy=None):
+        """
+        Attributes:
+            lazy (int): Budget (bytes) of the cache of entries of AddressBooks opened lazily, None turns
+                        the lazy mode off
+        """
 
         self.term_w = shutil.get_terminal_size((80, 20))[0]  # terminal size
 
         self.abook = AddressBook()  # AddressBook (base of contacts) to work with
         self.book_opened = False  # True when working with opened file
-        self.before_abook = self.abook  # used for indicating if user has made any changes
+        self.lazy = lazy  # budget of the cache of entries in the lazy mode
 
         # names of attributes that can be set for every object in AddressBook combined with
         # corresponding prompts for input
@@ -48,7 +73,13 @@ class MainApp(object):
                     \n
                     '''.center(self.term_w)
 
-        self.action_start()  # go to Main Menu
+    def run(self, state=None):
+        """Call states one after another, starting with the given one (Main Menu by default),
+        until one of them returns None"""
+
+        state = state or self.action_start
+        while state is not None:
+            state = state()
 
     def intro(self, mode):
         """Print introduction for corresponding menus"""
@@ -81,7 +112,7 @@ class MainApp(object):
             # create new AddressBook
             if ask_for_action == '1':
                 print(">> New AddressBook created.")
-                self.action_next()
+                return self.action_next
 
             # open AddressBook
             elif ask_for_action == '2':
@@ -105,15 +136,15 @@ class MainApp(object):
                             book_to_open = self.action_open(ask_for_fname)
                             if self.book_opened is True:
                                 self.abook = book_to_open
-                                self.action_next()
+                                return self.action_next
                         except EmptyFile as ex:
                             print(ex)
                         except FormatError as ex:
                             print(ex)
-                        self.action_start()
+                        return self.action_start
 
             elif ask_for_action == '3':
-                self.action_exit()
+                return self.action_exit
             else:
                 print(">> '{}' is not a proper input. Try again.".format(ask_for_action))
 
@@ -126,6 +157,11 @@ class MainApp(object):
         Delete Entry - go to menu removing existing contacts
         Save - save changes made to opened file
         Save As - save file after choosing its name and saving location
+        Statistics - show age and birthday statistics of the whole AddressBook
+        Undo - undo the last change (adding, modifying or removing entries)
+        Redo - redo the last undone change
+        Operation Stats - show how many times the operations have been run and how long they have taken
+        Find by Tags - find entries with a query combining tags and attribute values
          """
 
         self.intro('next')
@@ -136,30 +172,33 @@ class MainApp(object):
         while True:
             s = '''\n
                 1 - Show All Results\t\t2 - Search\t\t3 - Sort\n
-                4 - Add New Entry\t\t5 - Delete Entry\n
+                4 - Add New Entry\t\t5 - Delete Entry\t\t10 - Statistics\n
+                11 - Undo\t12 - Redo\t13 - Operation Stats\t14 - Find by Tags\n
                 6 - Save\t7 - Save As\t8 - Back to Main Menu\t\t9 - Exit
                 \n
                 '''.center(self.term_w)
             print(s)
             event = input(">> {}".format(" What do you want to do? Choose the number: "))
+            if event in self.FULL_BOOK_EVENTS:
+                self.full_book()
 
             if event == '1':
                 self.abook.show_all_results()
-                self.action_next()
+                return self.action_next
             elif event == '2':
-                self.action_search()
+                return self.action_search
             elif event == '3':
-                self.action_sort()
+                return self.action_sort
             elif event == '4':
-                self.action_add()
+                return self.action_add
             elif event == '5':
-                self.action_remove()
+                return self.action_remove
             elif event == '6':
                 if self.abook.filename is None:
                     print(">> This option is available only for already existing AddressBooks.\n"
                           ">> In order to save a newly-created AddressBook choose '7'.")
                 else:
-                    self.abook.pickle_changes()
+                    self.abook.pickle_changes(resolve=self.resolve_conflict)
                     print(">> The AddressBook has been saved.")
             elif event == '7':
                 name = input(">> Enter filename/filepath \n"
@@ -169,9 +208,27 @@ class MainApp(object):
                 self.abook.pickle_base(filename=name)
                 print(">> The AddressBook has been saved.")
             elif event == '8':
-                self.action_start()
+                return self.action_start
             elif event == '9':
-                self.action_exit()
+                return self.action_exit
+            elif event == '10':
+                print()
+                print(format_stats(self.abook.statistics()))
+            elif event == '11':
+                if self.abook.undo():
+                    print(">> The last change has been undone.")
+                else:
+                    print(">> There is nothing to undo.")
+            elif event == '12':
+                if self.abook.redo():
+                    print(">> The last undone change has been redone.")
+                else:
+                    print(">> There is nothing to redo.")
+            elif event == '13':
+                print()
+                print(metrics.format_metrics())
+            elif event == '14':
+                return self.action_select
             else:
                 print(">> '{}' is not a proper input. Try again.".format(event))
 
@@ -183,7 +240,7 @@ class MainApp(object):
         # if AddressBook is empty, print a message and go back to AddressBook options
         if len(self.abook) == 0:
             print("\n>> You cannot search through an empty base.")
-            self.action_next()
+            return self.action_next
 
         while True:
 
@@ -201,7 +258,7 @@ class MainApp(object):
                             result = self.abook.search_base(**to_find)
                             if result is None:
                                 print(">> No items found.")
-                                self.action_next()
+                                return self.action_next
                             elif isinstance(result, Person):
                                 print(">> 1 item found.")
                                 print(tw.fill(str(result.get_details()), width=80))
@@ -212,16 +269,44 @@ class MainApp(object):
                                     print(str(i + 1) + ': \n')
                                     print(tw.fill(str(j.get_details()), width=80), sep=' | ')
                                     print()
-                            self.action_person(result)
+                            return partial(self.action_person, result)
             elif event == '12':
-                self.action_next()
+                return self.action_next
             elif event == '13':
-                self.action_start()
+                return self.action_start
             elif event == '14':
-                self.action_exit()
+                return self.action_exit
             else:
                 print(">> '{}' is not a proper input. Try again.".format(event))
 
+    def action_select(self):
+        """Finding entries with a query combining tags and attribute values"""
+
+        self.intro('search')
+
+        counts = self.abook.tag_counts()
+        if counts:
+            print("\n>> Tags: {}".format(', '.join('{0} ({1})'.format(*t) for t in sorted(counts.items()))))
+        else:
+            print("\n>> No entries have been tagged yet.")
+        print(">> Combine tags and attributes with AND, OR, NOT and parentheses, "
+              "e.g. customers AND city=Warsaw AND NOT unsubscribed")
+        while True:
+            query = input(">> Query (press Enter to go back): ")
+            if not query.strip():
+                return self.action_next
+            with exc_catcher():
+                result = self.abook.select(query)
+                if not result:
+                    print(">> No items found.")
+                    continue
+                print(">> {} items found.".format(len(result)))
+                for i, j in enumerate(result):
+                    print(str(i + 1) + ': \n')
+                    print(tw.fill(str(j.get_details()), width=80), sep=' | ')
+                    print()
+                return partial(self.action_person, result[0] if len(result) == 1 else result)
+
     def action_sort(self):
         """Sorting options"""
 
@@ -230,32 +315,35 @@ class MainApp(object):
         # if AddressBook is empty, print a message and go back to AddressBook options
         if len(self.abook) == 0:
             print("\n>> You cannot sort an empty base.")
-            self.action_next()
+            return self.action_next
 
         while True:
             print(self.events_string)
-            event = input(">> {}".format("Choose sorting criteria: "))
+            event = input(">> {}".format("Choose sorting criteria "
+                                         "(e.g. '2 1 9' sorts by surname, then name, then city): "))
+            criteria = event.split()
 
             # user chooses sorting criteria and specifies the values he/she wants to find,
             # each category is connected with a number ranging from 1 to 11
-            if event in [str(n) for n in range(1, 12)]:
-                for key in self.events[event].keys():
-                    order = "ascending"
-                    is_reversed = input(">> Press 'd' to sort in descending order\n"
-                                        "   Press any other key to sort in ascending (default) order: ").lower()
-                    if is_reversed == 'd':
-                        self.abook.sorting(key, reverse=True)
-                        order = "descending"
-                    else:
-                        self.abook.sorting(key)
-                    print(">> The base has been sorted by '{0}' attribute in {1} order.".format(key, order))
-                    self.action_next()
+            if criteria and all(c in [str(n) for n in range(1, 12)] for c in criteria):
+                keys = []
+                for c in criteria:
+                    for key in self.events[c].keys():
+                        is_reversed = input(">> Press 'd' to sort by '{0}' in descending order\n"
+                                            "   Press any other key to sort in ascending (default) order: "
+                                            .format(key)).lower()
+                        keys.append((key, is_reversed == 'd'))
+                self.abook.sorting(*keys, collation=DEFAULT_COLLATION)
+                print(">> The base has been sorted by {0}.".format(
+                    ", ".join("'{0}' attribute in {1} order".format(key, "descending" if desc else "ascending")
+                              for key, desc in keys)))
+                return self.action_next
             elif event == '12':
-                self.action_next()
+                return self.action_next
             elif event == '13':
-                self.action_start()
+                return self.action_start
             elif event == '14':
-                self.action_exit()
+                return self.action_exit
             else:
                 print(">> '{}' is not a proper input. Try again.".format(event))
 
@@ -267,7 +355,7 @@ class MainApp(object):
         # if AddressBook is empty, print a message and go back to AddressBook options
         if len(self.abook) == 0:
             print("\n>> There are no items to remove.")
-            self.action_next()
+            return self.action_next
 
         print(">> You need to choose attribute and value of the item you want to remove.")
 
@@ -286,13 +374,13 @@ class MainApp(object):
                     with exc_catcher():
                         self.abook.removal(**to_find)
                         print(">> The item has been successfully removed.")
-                        self.action_next()
+                        return self.action_next
             elif event == '12':
-                self.action_next()
+                return self.action_next
             elif event == '13':
-                self.action_start()
+                return self.action_start
             elif event == '14':
-                self.action_exit()
+                return self.action_exit
             else:
                 print(">> '{}' is not a proper input. Try again.".format(event))
 
@@ -321,12 +409,12 @@ class MainApp(object):
 
         # if no new entry has been added, go back to AddressBook options
         if len(self.abook) == before_len:
-            self.action_next()
+            return self.action_next
 
         # if new entry has been successfully added, user decides whether to proceed to entry edition options
         # or go back to AddressBook options
         else:
-            self.action_person(self.abook[-1])
+            return partial(self.action_person, self.abook[-1])
 
     def action_person(self, entry):
         """After adding a new entry or getting search results, user is asked if he/she wants to modify or remove
@@ -339,9 +427,15 @@ class MainApp(object):
         person_event = input(">> Do you want to modify/remove this entry (one of entries above)?\n"
                              ">> Press 'y' to continue, any other key to go back: ").lower()
         if person_event in ['y', 'yes']:
+            if isinstance(self.abook, ab_lazy.LazyBook):
+                # entries found in a LazyBook are modified in the whole AddressBook
+                self.full_book()
+                if isinstance(entry, Person):
+                    entry = self.abook.get(entry.uid)
+                else:
+                    entry = [self.abook.get(p.uid) for p in entry]
             if isinstance(entry, Person):
-                item = entry
-                self.action_person_edit(item)
+                return partial(self.action_person_edit, entry)
             else:
                 for i, j in enumerate(entry):
                     ix = i + 1
@@ -354,16 +448,15 @@ class MainApp(object):
                                 ).lower()
                     try:
                         if ask in ('n', 'no'):
-                            self.action_next()
+                            return self.action_next
                         elif int(ask) in range(1, len(entry) + 1):
-                            item = entry[int(ask) - 1]
-                            self.action_person_edit(item)
+                            return partial(self.action_person_edit, entry[int(ask) - 1])
                         else:
                             raise ValueError
                     except ValueError:
                         print(">> {0} is not a proper input. Choose the person's number.".format(ask))
         else:
-            self.action_next()
+            return self.action_next
 
     def action_person_edit(self, item):
         """Single Entry Options allow to change/set entry's attributes"""
@@ -374,7 +467,7 @@ class MainApp(object):
             s = '''\n
                 1 - Name\t2 - Surname\t3 - Email\t4 - Phone\t5 - Birthday\n
                 6 - City\t7 - Street Name\t\t8 - Street Number\t9 - Street\n
-                10 - Get Age\n
+                10 - Get Age\t14 - Tags\n
                 11 - Back to AddressBook\t12 - Back to Main Menu\t\t13 - Exit\n
                 \n
                 '''.center(self.term_w)
@@ -390,24 +483,31 @@ class MainApp(object):
                         with exc_catcher():
                             setattr(item, key, inp)
                             print(">> The item has been successfully modified.")
-                            self.action_person_edit(item)
+                            return partial(self.action_person_edit, item)
             elif event == '10':
                 try:
                     print(">> {0.name} {0.surname} is {1} years old.".format(item, item.get_age()))
                 except ValueError as ex:
                     print(">> {}".format(ex))
-                self.action_person_edit(item)
+                return partial(self.action_person_edit, item)
+            elif event == '14':
+                print(">> Tags: {}".format(', '.join(sorted(item.tags)) or 'none'))
+                inp = input(">> New tags, separated by commas (press Enter to remove all tags): ")
+                with exc_catcher():
+                    item.tags = inp
+                    print(">> The item has been successfully modified.")
+                return partial(self.action_person_edit, item)
             elif event == '11':
-                self.action_next()
+                return self.action_next
             elif event == '12':
-                self.action_start()
+                return self.action_start
             elif event == '13':
-                self.action_exit()
+                return self.action_exit
             else:
                 print(">> '{}' is not a proper input. Try again.".format(event))
 
     def action_open(self, fname):
-        """Opening existing AddressBook"""
+        """Opening existing AddressBook. Return None if no AddressBook has been opened or created."""
 
         try:
             # raise exception if extension of the file chosen by user is not .pkl
@@ -416,10 +516,14 @@ class MainApp(object):
             # raise exception for empty files
             if os.path.getsize(fname) == 0:
                 raise EmptyFile
-            pkl_file = open(fname, 'rb')
-            abook = pickle.load(pkl_file)
-            abook.filename = fname
-            pkl_file.close()
+            if self.lazy:
+                abook = ab_lazy.open_book(fname, self.lazy)
+            else:
+                pkl_file = open(fname, 'rb')
+                with metrics.measured('load'):
+                    abook = pickle.load(pkl_file)
+                abook.filename = fname
+                pkl_file.close()
             self.book_opened = True  # indicates that a file has been opened
             return abook
         # if file is not found, ask if user wants to create new AddressBook
@@ -434,7 +538,20 @@ class MainApp(object):
                     return abook
                 else:
                     print(">> No AddressBook created.")
-                    self.action_start()
+                    return None
+
+    def full_book(self):
+        """Return the AddressBook worked with, loading the whole AddressBook if it has been opened lazily.
+        In the lazy mode the AddressBook is saved together with its record file, so it can be opened lazily
+        next time."""
+
+        if isinstance(self.abook, ab_lazy.LazyBook):
+            print(">> Loading all the entries...")
+            opened, self.abook = self.abook, self.abook.load()
+            opened.close()
+        if self.lazy:
+            self.abook.record_file = True
+        return self.abook
 
     def action_save(self):
         """Saving options"""
@@ -445,14 +562,14 @@ class MainApp(object):
             1 - Save\t\t2 - Save As\t\t3 - Exit
             \n
             '''.center(self.term_w)
-        print(s)
-        event = input(">> {}".format(" What do you want to do? Choose the number: "))
-
         while True:
+            print(s)
+            event = input(">> {}".format(" What do you want to do? Choose the number: "))
+
             if event == '1':
-                self.abook.pickle_changes()
+                self.abook.pickle_changes(resolve=self.resolve_conflict)
                 print("The AddressBook has been saved.")
-                self.action_next()
+                return self.action_next
             elif event == '2':
                 name = input(">> Enter filename/filepath \n"
                              ">> or press 'd' if you want to save file with default name: ").lower()
@@ -460,24 +577,39 @@ class MainApp(object):
                     name = None
                 self.abook.pickle_base(filename=name)
                 print("The AddressBook has been saved.")
-                self.action_next()
+                return self.action_next
             elif event == '3':
-                self.action_exit()
+                return self.action_exit
             else:
                 print(">> '{}' is not a proper input. Try again.".format(event))
 
+    def resolve_conflict(self, mine, theirs):
+        """Ask which version of an entry changed both here and in the file by somebody else should be saved.
+        Return True to keep the version made here."""
+
+        print("\n>> This entry has been changed by somebody else since the AddressBook was opened.")
+        for label, entry in (("Your version", mine), ("Saved version", theirs)):
+            details = "(removed)" if entry is None else ' | '.join(entry.get_details())
+            print(">> {0}:\n{1}".format(label, tw.fill(details, width=80, initial_indent='\t',
+                                                      subsequent_indent='\t')))
+        while True:
+            ask = input(">> Press 'y' to keep your version, 's' to keep the saved one: ").lower()
+            if ask in ('y', 's'):
+                return ask == 'y'
+            print(">> '{}' is not a proper input. Try again.".format(ask))
+
     def action_exit(self):
-        """Exit options"""
+        """Exit options. Returning None ends the program."""
 
         # if any changes have been made, user decides whether to save them before exiting
-        if self.abook != self.before_abook:
+        if self.abook.modified:
             save_ask = input("The Addressbook has been changed. Do you want to save it?\n"
                              ">> If so, press 's', if you don't - press any other key: ").lower()
             if save_ask == 's':
-                self.action_save()
+                return self.action_save
 
         print("\n>> ...Exiting...\n")
-        sys.exit()
+        return None
 
 
 def find_pkl(fname, directory=None):
@@ -508,5 +640,5 @@ def find_pkl(fname, directory=None):
 
 
 if __name__ == '__main__':
-    with keyboard_catcher():
-        MainApp()
+    with keyboard_catcher(), profiling(from_environment()):
+        MainApp(lazy=ab_lazy.from_environment()).run()
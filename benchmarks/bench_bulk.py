@@ -0,0 +1,70 @@
+"""Benchmark of bulk removal: deleting 50k matching entries from an AddressBook of 1M entries.
+
+The old way of removing all the matches ('list.remove' called for every match) is quadratic, so it is
+timed for a sample of matches only and the result is extrapolated to all of them.
+
+Usage:
+    python benchmarks/bench_bulk.py [--size 1000000] [--matches 50000] [--sample 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from addressbook.ab_abook import AddressBook, Person
+
+
+def make_people(size, matches):
+    """Create 'size' entries, every (size // matches)-th of them called Roy Batty.
+    Entries are copied from templates, so that building a huge book doesn't take ages of parsing."""
+
+    roy = Person('roy', 'batty', 'nexus6@gmail.com', '668678678').__getstate__()
+    other = Person('rick', 'deckard', 'deckard@gmail.com', '508123456').__getstate__()
+    step = size // matches
+    people = []
+    for i in range(size):
+        p = Person.__new__(Person)
+        p.__dict__.update(roy if i % step == 0 else other)
+        people.append(p)
+    return people
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--matches', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=200, help='matches removed one by one the old way')
+    args = parser.parse_args()
+
+    book = AddressBook()
+    elapsed, _ = timed(book.bulk_add, make_people(args.size, args.matches))
+    print('bulk_add of {0} entries: {1:.3f} s'.format(args.size, elapsed))
+
+    found = [p for p in book if p.name == 'Roy']
+    elapsed, removed = timed(book.bulk_remove, found)
+    print('bulk_remove of {0} matches: {1:.3f} s'.format(removed, elapsed))
+
+    book = AddressBook()
+    book.bulk_add(make_people(args.size, args.matches))
+    found = [p for p in book if p.name == 'Roy'][:args.sample]
+
+    def remove_one_by_one(items):
+        for p in items:
+            book.remove(p)
+
+    elapsed, _ = timed(remove_one_by_one, found)
+    print('list.remove of {0} matches: {1:.3f} s (~{2:.1f} s for {3} matches)'.format(
+        len(found), elapsed, elapsed / len(found) * args.matches, args.matches))
+
+
+if __name__ == '__main__':
+    main()
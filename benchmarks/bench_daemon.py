@@ -0,0 +1,84 @@
+"""Benchmark of the AddressBook daemon: latency of repeated searches sent over the Unix socket,
+compared with opening the pickled AddressBook and searching it for every query.
+
+Usage:
+    python benchmarks/bench_daemon.py [--size 100000] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from addressbook.ab_daemon import BookClient, BookServer, BookService, default_socket
+from addressbook.ab_export import load_book
+from bench_sort import SURNAMES, make_book
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def report(name, samples):
+    print('{0:<32}  p50 {1:9.3f} ms   p99 {2:9.3f} ms   mean {3:9.3f} ms'.format(
+        name, percentile(samples, 50) * 1000, percentile(samples, 99) * 1000, statistics.mean(samples) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--cold', type=int, default=5, help='number of queries opening the file every time')
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'book.pkl')
+        make_book(args.size).pickle_base(path[:-4])
+
+        cold = []
+        for _ in range(args.cold):
+            start = time.perf_counter()
+            load_book(path).search_base(surname=rnd.choice(SURNAMES))
+            cold.append(time.perf_counter() - start)
+
+        server = BookServer(BookService(path), default_socket(path))
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        with BookClient(default_socket(path)) as client:
+            start = time.perf_counter()
+            client.request('search', attribute='surname', value=SURNAMES[0])
+            first = time.perf_counter() - start
+
+            warm = []
+            for _ in range(args.queries):
+                # query for the uid of a single entry, so that the size of the response doesn't dominate
+                uid = rnd.randrange(1, args.size + 1)
+                start = time.perf_counter()
+                client.request('get', uid=uid)
+                warm.append(time.perf_counter() - start)
+            email = []
+            for _ in range(args.queries):
+                start = time.perf_counter()
+                client.request('search', attribute='email', value='nobody@example.com')
+                email.append(time.perf_counter() - start)
+            client.shutdown()
+        thread.join()
+        server.server_close()
+
+    print('{0} entries'.format(args.size))
+    report('open + search_base', cold)
+    print('{0:<32}  {1:9.3f} ms (index built)'.format('daemon: first search', first * 1000))
+    report('daemon: get by uid', warm)
+    report('daemon: repeated search', email)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark of importing people from a big CSV file with a growing number of parsing processes.
+
+Usage:
+    python benchmarks/bench_import.py [--rows 200000] [--workers 1 2 4 8] [--chunk 5000]
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from addressbook.ab_export import FIELDS, read_people
+from bench_sort import CITIES, NAMES, SURNAMES
+
+STREETS = ['Piotrkowska', 'Marszałkowska', 'Długa', 'Floriańska', 'Świętojańska']
+
+
+def write_csv(path, rows, seed=0):
+    """Write rows of random, valid people (and a few invalid ones) to a CSV file"""
+    rnd = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for i in range(rows):
+            name, surname = rnd.choice(NAMES), rnd.choice(SURNAMES)
+            email = '{0}.{1}{2}@example.com'.format(name, surname, i) if i % 100 else 'invalid'
+            writer.writerow([name, surname, email, '6{0:08d}'.format(rnd.randrange(10 ** 8)),
+                             '{0}-{1}-{2}'.format(rnd.randint(1, 28), rnd.randint(1, 12), rnd.randint(1940, 2010)),
+                             rnd.choice(CITIES) or '', rnd.choice(STREETS), rnd.randint(1, 200)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--chunk', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'people.csv')
+        write_csv(path, args.rows)
+        print('{0} rows, {1} CPUs, chunks of {2}'.format(args.rows, os.cpu_count(), args.chunk))
+        base = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            people, rejected = read_people(path, workers=workers, chunk_size=args.chunk)
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print('\t{0} workers: {1:7.2f} s  {2:9.0f} rows/s  speedup {3:.2f}x  ({4} people, {5} rejected)'.format(
+                workers, elapsed, args.rows / elapsed, base / elapsed, len(people), len(rejected)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark of opening AddressBook files of growing sizes: loading the whole book compared with opening it
+lazily (reading its record file index) and showing the first page of entries.
+
+Usage:
+    python benchmarks/bench_lazy.py [--sizes 10000 100000 1000000] [--budget 32]
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from addressbook import ab_export, ab_lazy
+from addressbook.ab_abook import AddressBook
+from addressbook.ab_render import page
+from bench_merge import make_people
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def first_page(book):
+    page(book, io.StringIO(), height=24, ask=lambda prompt: 'q')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--budget', type=float, default=32, help='budget of the record cache (MiB)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, 'book{0}.pkl'.format(size))
+            book = AddressBook()
+            book.bulk_add(make_people(size))
+            book.record_file = True
+            saved, _ = timed(book.pickle_base, path)
+            del book
+
+            loaded, book = timed(ab_export.load_book, path)
+            shown, _ = timed(first_page, book)
+            del book
+            opened, lazy = timed(ab_lazy.open_book, path, int(args.budget * 1024 * 1024))
+            lazy_shown, _ = timed(first_page, lazy)
+            lazy.close()
+            print('{0:>9} entries: save {1:.3f} s, load {2:.3f} s + first page {3:.4f} s, '
+                  'lazy open {4:.4f} s + first page {5:.4f} s'.format(size, saved, loaded, shown, opened, lazy_shown))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark of comparing and merging two AddressBooks of 1M entries differing in a few percent of them.
+
+Usage:
+    python benchmarks/bench_merge.py [--size 1000000] [--changes 0.01]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from addressbook.ab_abook import AddressBook, Person
+from bench_sort import CITIES, NAMES, SURNAMES
+
+
+def make_people(size, seed=0, start=0):
+    """Create entries with random names and unique e-mail addresses, copying them from a template
+    instead of parsing them"""
+    rnd = random.Random(seed)
+    template = Person('jan', 'kowalski', 'jan@kowalski.pl', '668678678').__getstate__()
+    people = []
+    for i in range(start, start + size):
+        p = Person.__new__(Person)
+        p.__dict__.update(template)
+        name, surname = rnd.choice(NAMES), rnd.choice(SURNAMES)
+        p.__dict__.update(name=name, surname=surname, personid=surname + '_' + name, city=rnd.choice(CITIES),
+                          email='user{0}@example.com'.format(i))
+        people.append(p)
+    return people
+
+
+def make_books(size, changes):
+    """Create two AddressBooks: the second one has 'changes' of the entries changed, removed and added"""
+    mine, theirs = AddressBook(), AddressBook()
+    mine.bulk_add(make_people(size))
+    people = make_people(size)
+    n = int(size * changes)
+    rnd = random.Random(1)
+    for p in rnd.sample(people, n):
+        p.__dict__['city'] = 'Changed'
+    removed = {id(p) for p in rnd.sample(people, n)}
+    theirs.bulk_add([p for p in people if id(p) not in removed] + make_people(n, seed=2, start=size))
+    return mine, theirs
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--changes', type=float, default=0.01, help='part of the entries changed, removed and added')
+    args = parser.parse_args()
+
+    mine, theirs = make_books(args.size, args.changes)
+    elapsed, d = timed(mine.diff, theirs)
+    print('diff of {0} and {1} entries: {2:.3f} s {3}'.format(len(mine), len(theirs), elapsed, d.summary()))
+    elapsed, report = timed(mine.merge, theirs, 'theirs', True)
+    print('merge (theirs, delete): {0:.3f} s {1}'.format(elapsed, report.summary()))
+    elapsed, _ = timed(mine.undo)
+    print('undo of the merge: {0:.3f} s'.format(elapsed))
+
+
+if __name__ == '__main__':
+    main()
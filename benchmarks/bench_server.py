@@ -0,0 +1,98 @@
+"""Load test of the asyncio AddressBook server: many concurrent local clients sending a mix of reads
+and writes. Reports p50/p99 latency per operation and the overall throughput.
+
+Usage:
+    python benchmarks/bench_server.py [--size 10000] [--clients 100] [--requests 200] [--writes 5] [--sorts 0]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from addressbook.ab_daemon import default_socket
+from addressbook.ab_server import AsyncBookClient
+from bench_sort import make_book
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+async def run_client(socket_path, size, requests, writes, sorts, seed, latencies):
+    rnd = random.Random(seed)
+    async with AsyncBookClient(socket_path) as client:
+        for _ in range(requests):
+            roll = rnd.random() * 100
+            uid = rnd.randrange(1, size + 1)
+            if roll < sorts:
+                op, params = 'sort', {'keys': ['surname', 'name']}
+            elif roll < sorts + writes:
+                op, params = 'edit', {'uid': uid, 'changes': {'city': rnd.choice(['Kraków', 'Łódź', 'Gdańsk'])}}
+            elif roll < 50:
+                op, params = 'get', {'uid': uid}
+            else:
+                op, params = 'search', {'attribute': 'email', 'value': 'nobody{0}@example.com'.format(uid)}
+            start = time.perf_counter()
+            await client.request(op, **params)
+            latencies.setdefault(op, []).append(time.perf_counter() - start)
+
+
+async def load(socket_path, args):
+    latencies = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(socket_path, args.size, args.requests, args.writes, args.sorts, i, latencies)
+                           for i in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    async with AsyncBookClient(socket_path) as client:
+        await client.request('shutdown')
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200, help='requests sent by every client')
+    parser.add_argument('--writes', type=float, default=5, help='percentage of edits')
+    parser.add_argument('--sorts', type=float, default=0, help='percentage of sorts')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'book.pkl')
+        make_book(args.size).pickle_base(path[:-4])
+        socket_path = default_socket(path)
+        server = subprocess.Popen([sys.executable, '-m', 'addressbook.ab_server', 'serve', path],
+                                  env=dict(os.environ, PYTHONPATH=ROOT))
+        try:
+            while not os.path.exists(socket_path):
+                if server.poll() is not None:
+                    sys.exit('The server has failed to start')
+                time.sleep(0.05)
+            latencies, elapsed = asyncio.run(load(socket_path, args))
+            server.wait(timeout=60)
+        finally:
+            if server.poll() is None:
+                server.kill()
+
+    total = sum(len(v) for v in latencies.values())
+    print('{0} entries, {1} clients, {2} requests in {3:.2f} s: {4:.0f} requests/s'.format(
+        args.size, args.clients, total, elapsed, total / elapsed))
+    everything = [t for v in latencies.values() for t in v]
+    for op, samples in sorted(latencies.items()) + [('all', everything)]:
+        print('\t{0:<8} {1:7d} requests   p50 {2:8.3f} ms   p99 {3:8.3f} ms   mean {4:8.3f} ms'.format(
+            op, len(samples), percentile(samples, 50) * 1000, percentile(samples, 99) * 1000,
+            statistics.mean(samples) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark of sorting: the old single-key sort against a three-key sort with Polish collation.
+
+Usage:
+    python benchmarks/bench_sort.py [--size 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from addressbook.ab_abook import AddressBook, Person
+
+NAMES = ['Anna', 'Łucja', 'Żaneta', 'Zofia', 'Ścibor', 'Stefan', 'Ćwirek', 'Cezary', 'Ewa', 'Ignacy']
+SURNAMES = ['Nowak', 'Kowalski', 'Wiśniewski', 'Wójcik', 'Łukasik', 'Lewandowski', 'Żak', 'Zieliński',
+            'Śliwa', 'Szymański', 'Ćwik', 'Dąbrowski', 'Kozłowski', 'Jankowski', 'Mazur']
+CITIES = ['Warszawa', 'Łódź', 'Kraków', 'Wrocław', 'Poznań', 'Gdańsk', 'Szczecin', 'Żory', None]
+
+
+def make_book(size, seed=0):
+    """Create an AddressBook with random names, copying entries from a template instead of parsing them"""
+    rnd = random.Random(seed)
+    template = Person('jan', 'kowalski', 'jan@kowalski.pl', '668678678').__getstate__()
+    people = []
+    for i in range(size):
+        p = Person.__new__(Person)
+        p.__dict__.update(template)
+        p.__dict__.update(name=rnd.choice(NAMES), surname=rnd.choice(SURNAMES), city=rnd.choice(CITIES))
+        people.append(p)
+    book = AddressBook()
+    book.bulk_add(people)
+    return book
+
+
+def shuffle(book, seed):
+    items = list(book)
+    random.Random(seed).shuffle(items)
+    list.__setitem__(book, slice(None), items)
+
+
+def old_sorting(book, att):
+    """Sorting as it was done before multi-key sorting was introduced"""
+    book.sort(key=lambda x: (x.__getattribute__(att) is None, x.__getattribute__(att)))
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1000000)
+    args = parser.parse_args()
+
+    book = make_book(args.size)
+    keys = ('surname', 'name', ('city', True))
+
+    # every sort starts from the same shuffled order
+    shuffle(book, 1)
+    print('old single-key sort by surname: {0:.3f} s'.format(timed(old_sorting, book, 'surname')))
+    shuffle(book, 1)
+    print('single-key sort by surname: {0:.3f} s'.format(timed(book.sorting, 'surname')))
+    shuffle(book, 1)
+    print('three-key sort, pl collation: {0:.3f} s'.format(timed(book.sorting, *keys, collation='pl')))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark of the start of the program: time of importing AddressBook modules, measured with
+'python -X importtime' in fresh interpreters.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--budget 100] [--top 10] [module ...]
+
+Reports the median import time of every module (addressbook.ab_cli and addressbook.main_ab by default)
+together with its slowest imports. With --budget, exits with code 1 if any module exceeds the budget (ms).
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['addressbook.ab_cli', 'addressbook.main_ab']
+
+
+def import_times(module):
+    """Import the module in a fresh interpreter and return a dict: imported module - cumulative time (us)"""
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure(module, runs):
+    """Return the median import time of the module (ms) and median times of all its imports (ms)"""
+
+    # the first run compiles the modules if their bytecode is outdated, so it is not counted
+    import_times(module)
+    samples = [import_times(module) for _ in range(runs)]
+    names = set.intersection(*(set(s) for s in samples))
+    medians = {name: statistics.median(s[name] for s in samples) / 1000 for name in names}
+    return medians[module], medians
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget', type=float, help='maximum import time of a module (ms)')
+    parser.add_argument('--top', type=int, default=10, help='number of the slowest imports shown')
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in args.modules:
+        total, medians = measure(module, args.runs)
+        print('{0}: {1:.1f} ms (median of {2} runs)'.format(module, total, args.runs))
+        slowest = sorted((t, name) for name, t in medians.items() if name != module)[::-1][:args.top]
+        for t, name in slowest:
+            print('\t{0:8.1f} ms  {1}'.format(t, name))
+        if args.budget is not None and total > args.budget:
+            print('\t-- over the budget of {0:.1f} ms'.format(args.budget))
+            over_budget = True
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
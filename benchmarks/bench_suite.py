@@ -0,0 +1,165 @@
+"""Benchmark suite of the AddressBook's main operations at growing sizes: add_new, search_base, sorting,
+removal, show_all_results and a pickle round trip (dumps + loads).
+
+For every operation and size it reports operations per second, latency percentiles and the peak memory
+allocated while the operation runs (measured in a separate run, as tracing memory slows everything down).
+Results can be written as JSON and compared with a baseline written before; the exit code is 1 if the
+median latency of any operation grew by more than the threshold (the median is compared rather than
+ops/sec, as it is hardly affected by single slow runs). show_all_results is timed with formatted entries
+cached after the first run, as in the interactive menu.
+
+Usage:
+    python benchmarks/bench_suite.py [--sizes 1000 10000 100000 1000000] [--ops search_base sorting]
+                                     [--repeat 20] [--budget 2] [--json results.json]
+                                     [--baseline baseline.json] [--threshold 20]
+"""
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from addressbook.ab_abook import Person
+from bench_sort import SURNAMES, make_book
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class Operations(object):
+    """Operations benchmarked on one AddressBook. Every operation is a method taking the number of the run;
+    'setup_<operation>' methods prepare a run without being timed."""
+
+    NAMES = ('add_new', 'search_base', 'sorting', 'removal', 'show_all_results', 'pickle')
+
+    def __init__(self, book):
+        self.book = book
+        self.rnd = random.Random(1)
+        self.out = open(os.devnull, 'w')
+
+    def add_new(self, i):
+        # names are unique, so add_new never asks about duplicates
+        with redirect_stdout(self.out):
+            self.book.add_new('bench', 'added{0}'.format(i), 'bench{0}@example.com'.format(i), '668678678')
+
+    def setup_search_base(self, i):
+        # a few surnames are searched again and again, so without this almost every run would be a hit
+        # of the query cache instead of a search
+        self.book.query_cache.clear()
+
+    def search_base(self, i):
+        self.book.search_base(surname=self.rnd.choice(SURNAMES))
+
+    def sorting(self, i):
+        keys = (('surname', 'name'), ('city', 'surname'), ('name',))[i % 3]
+        self.book.sorting(*keys)
+
+    def setup_removal(self, i):
+        self.book.bulk_add([Person('bench', 'removed{0}'.format(i), 'bench{0}@example.com'.format(i), '668678678')])
+
+    def removal(self, i):
+        self.book.removal(personid='Removed{0}_Bench'.format(i))
+
+    def show_all_results(self, i):
+        with redirect_stdout(self.out):
+            self.book.show_all_results(paged=False)
+
+    def pickle(self, i):
+        pickle.loads(pickle.dumps(self.book, 2))
+
+    def run(self, name, i):
+        """Run the operation once, return its time (seconds)"""
+        setup = getattr(self, 'setup_' + name, None)
+        if setup is not None:
+            setup(i)
+        func = getattr(self, name)
+        start = time.perf_counter()
+        func(i)
+        return time.perf_counter() - start
+
+
+def measure(ops, name, repeat, budget):
+    """Time the operation 'repeat' times (at least 3 times, fewer if the time budget runs out) and measure
+    its peak memory in one more run. Return the results as a dictionary."""
+
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < repeat and (len(samples) < 3 or time.perf_counter() < deadline):
+        samples.append(ops.run(name, len(samples)))
+
+    tracemalloc.start()
+    try:
+        ops.run(name, len(samples))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'runs': len(samples), 'ops_per_sec': len(samples) / sum(samples),
+            'p50_ms': percentile(samples, 50) * 1000, 'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000, 'max_ms': max(samples) * 1000, 'peak_memory': peak}
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (key, current, baseline median latency) for operations with median latency higher
+    than the baseline by more than 'threshold' percent"""
+    slower = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before and result['p50_ms'] > before['p50_ms'] * (1 + threshold / 100):
+            slower.append((key, result['p50_ms'], before['p50_ms']))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--ops', nargs='+', choices=Operations.NAMES, default=list(Operations.NAMES))
+    parser.add_argument('--repeat', type=int, default=20, help='maximum number of timed runs')
+    parser.add_argument('--budget', type=float, default=2, help='seconds spent on timed runs of an operation')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare the results with this file (written with --json)')
+    parser.add_argument('--threshold', type=float, default=20,
+                        help='growth of the median latency (percent) reported as a regression')
+    args = parser.parse_args()
+
+    results = {}
+    print('{0:<24} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8} {6:>10}'.format(
+        'operation', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms', 'runs', 'peak MB'))
+    for size in args.sizes:
+        ops = Operations(make_book(size))
+        for name in args.ops:
+            key = '{0}@{1}'.format(name, size)
+            r = results[key] = measure(ops, name, args.repeat, args.budget)
+            print('{0:<24} {1:>10.2f} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>8} {6:>10.1f}'.format(
+                key, r['ops_per_sec'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['runs'], r['peak_memory'] / 2 ** 20))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        slower = compare(results, baseline, args.threshold)
+        for key, now, before in slower:
+            print('REGRESSION {0}: p50 {1:.3f} ms, baseline {2:.3f} ms ({3:+.1f}%)'.format(
+                key, now, before, (now / before - 1) * 100))
+        if slower:
+            return 1
+        print('No regressions beyond {0}% of the baseline'.format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
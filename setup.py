@@ -10,8 +10,10 @@ config = {
     'author_email': 'brzozowskaanna5@gmail.com',
     'version': '1.0',
     'install_requires': [],
+    'extras_require': {'analytics': ['numpy']},
     'packages': ['addressbook'],
     'scripts': [],
+    'entry_points': {'console_scripts': ['addressbook = addressbook.ab_cli:main']},
     'name': 'AddressBook'
 }
 
@@ -1,8 +1,22 @@
+import asyncio
 import copy
+import io
+import json
+import os
+import pickle
+import subprocess
+import tempfile
+import threading
+import textwrap as tw
 import unittest
+import weakref
 from random import shuffle
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+from addressbook import (ab_analytics, ab_bloom, ab_cache, ab_cli, ab_daemon, ab_export, ab_generator, ab_lazy,
+                         ab_merge, ab_metrics, ab_profile, ab_render, ab_server, ab_storage, ab_summary, ab_tags,
+                         ab_threads)
+from addressbook.ab_index import AttributeIndex
 from addressbook.main_ab import *
 
 
@@ -34,7 +48,7 @@ def abook_example(mock_input):
 
     for nm, sur, em, ph in zip(names, surnames, emails, phones):
         with suppress_stdout():
-            book.__append__(nm, sur, em, ph)
+            book.add_new(nm, sur, em, ph)
 
     for contact, c, st, b in zip(book, cities, streets, birthdays):
         to_set = {'city': c, 'street': st, 'birthday': b}
@@ -44,6 +58,29 @@ def abook_example(mock_input):
     return book
 
 
+def people_example(names, **columns):
+    """Create people sharing an e-mail address and a phone number
+
+    Attributes:
+        names (iterable): (name, surname) pairs
+        **columns (keyword=list): Values of other attributes, one for every person (None leaves it unset)
+    """
+    people = [Person(name, surname, 'nexus6@gmail.com', '668678678') for name, surname in names]
+    for key, values in columns.items():
+        for person, value in zip(people, values):
+            if value is not None:
+                setattr(person, key, value)
+    return people
+
+
+def book_example(names, **columns):
+    """Create AddressBook of people_example(names, **columns), with no changes logged"""
+    book = AddressBook()
+    book.bulk_add(people_example(names, **columns))
+    book.reset_changes()
+    return book
+
+
 class NewDate(dt.date):
     @classmethod
     def today(cls):
@@ -327,7 +364,7 @@ class TestAddressBook(unittest.TestCase):
         """no duplicates found - user adds new item"""
         people001 = copy.deepcopy(self.people)
         print(len(people001))
-        people001.__append__(*self.none_vals[:4])
+        people001.add_new(*self.none_vals[:4])
         self.assertEqual(len(people001), 23)
         self.assertIsInstance(people001[-1], Person)
 
@@ -336,7 +373,7 @@ class TestAddressBook(unittest.TestCase):
         """duplicates found - user chooses not to add anything"""
         people002 = copy.deepcopy(self.people)
         length = len(people002)
-        people002.__append__(*self.standard_vals[:4])
+        people002.add_new(*self.standard_vals[:4])
         self.assertEqual(len(people002), length)
 
     @patch('builtins.input', return_value='y')
@@ -344,7 +381,7 @@ class TestAddressBook(unittest.TestCase):
         """duplicates found - user adds new item"""
         people003 = copy.deepcopy(self.people)
         length = len(people003)
-        people003.__append__(*self.standard_vals[:4])
+        people003.add_new(*self.standard_vals[:4])
         self.assertEqual(len(people003), length + 1)
 
     def test004_clear_base(self):
@@ -452,6 +489,1638 @@ class TestAddressBook(unittest.TestCase):
             self.assertEqual(people013.search_base(**pair), None)
 
 
+class TestAnalytics(unittest.TestCase):
+    today = dt.date(2020, 1, 9)
+
+    # small AddressBook with birthdays and cities set for most of the people
+    names = [('roy', 'batty'), ('pris', 'stratton'), ('leon', 'kowalski'), ('zhora', 'salome'),
+             ('rick', 'deckard'), ('ellen', 'ripley')]
+    birthdays = ['8-1-2016', '30-11-1968', '18/3/1970', '15-12-1991', None, '10-1-2019']
+    cities = ['los angeles', 'los angeles', 'los angeles', None, 'san francisco', 'nostromo']
+
+    def setUp(self):
+        self.book = book_example(self.names, birthday=self.birthdays, city=self.cities)
+
+    def test_compute_stats(self):
+        """Ages, histograms and missing fields should be computed for the whole AddressBook"""
+        stats = compute_stats(self.book, self.today, use_numpy=False)
+        self.assertEqual(stats['count'], 6)
+        self.assertEqual(stats['age']['count'], 5)
+        self.assertEqual((stats['age']['min'], stats['age']['max']), (0, 51))
+        self.assertEqual(stats['age']['median'], 28.0)
+        self.assertEqual(stats['age_distribution'], {'0-9': 2, '20-29': 1, '40-49': 1, '50-59': 1})
+        self.assertEqual(stats['birth_months'][1], 2)
+        self.assertEqual(stats['birth_months'][12], 1)
+        self.assertEqual(stats['age_by_city']['Los Angeles']['count'], 3)
+        self.assertEqual(stats['age_by_city']['Los Angeles']['median'], 49.0)
+        self.assertNotIn('San Francisco', stats['age_by_city'])
+        self.assertEqual(stats['missing'], {'birthday': 1, 'city': 1, 'streetname': 6, 'streetnumber': 6})
+
+    @unittest.skipIf(not ab_analytics.np, 'NumPy is not installed')
+    def test_compute_stats_numpy(self):
+        """NumPy and pure-Python computations should give the same results"""
+        book = self.book
+        self.assertEqual(compute_stats(book, self.today, use_numpy=True),
+                         compute_stats(book, self.today, use_numpy=False))
+
+    def test_statistics_cache(self):
+        """statistics should be cached until the AddressBook or any of its entries changes"""
+        book = self.book
+        stats = book.statistics(self.today)
+        self.assertIs(book.statistics(self.today), stats)
+        book[3].city = 'los angeles'
+        self.assertIsNot(book.statistics(self.today), stats)
+        self.assertEqual(book.statistics(self.today)['age_by_city']['Los Angeles']['count'], 4)
+        stats = book.statistics(self.today)
+        book.pop()
+        self.assertEqual(book.statistics(self.today)['count'], 5)
+
+
+class TestChangeTracking(unittest.TestCase):
+
+    names = [('roy', 'batty'), ('pris', 'batty'), ('leon', 'batty')]
+
+    def test_generation(self):
+        """every change of the AddressBook or of its entries should increase the generation"""
+        book = book_example(self.names)
+        self.assertFalse(book.modified)
+        gen = book.generation
+        book[0].city = 'los angeles'
+        book.append(Person('zhora', 'salome', 'nexus6@gmail.com', '668678678'))
+        book.pop(1)
+        self.assertEqual(book.generation, gen + 3)
+        self.assertTrue(book.modified)
+        book.mark_saved()
+        self.assertFalse(book.modified)
+
+    def test_sorting_not_modified(self):
+        """sorting doesn't change the entries, so it doesn't count as a modification"""
+        book = book_example(self.names)
+        book.sorting('name')
+        self.assertFalse(book.modified)
+
+    def test_changes_since(self):
+        """changes_since should return entries changed and removed after the given generation"""
+        book = book_example(self.names)
+        roy, pris, leon = book
+        gen = book.generation
+        roy.phone = '668678600'
+        self.assertEqual(book.changes_since(gen), ([roy], []))
+        gen = book.generation
+        book.remove(pris)
+        leon.city = 'los angeles'
+        changed, removed = book.changes_since(gen)
+        self.assertEqual(changed, [leon])
+        self.assertIs(removed[0], pris)
+        self.assertEqual(book.dirty_entries(), [roy, leon])
+        self.assertIsNone(book.changes_since(gen - 10))
+
+    def test_removed_entry_not_tracked(self):
+        """entries removed from the AddressBook don't affect it anymore"""
+        book = book_example(self.names)
+        pris = book.pop(1)
+        gen = book.generation
+        pris.city = 'los angeles'
+        self.assertEqual(book.generation, gen)
+
+    def test_log_trimmed(self):
+        """changes made before the last save and before the oldest consumer are forgotten with removed entries"""
+        book = book_example(self.names)
+        index = AttributeIndex(book, 'city')
+        index.refresh()
+        gen = book.generation
+        pris = weakref.ref(book.pop(1))
+        book[0].city = 'los angeles'
+        book.history.clear()
+        book.mark_saved()
+        # the index hasn't been refreshed yet, so the changes are still logged for it
+        changed, removed = book.changes_since(gen)
+        self.assertEqual(changed, [book[0]])
+        self.assertIs(removed[0], pris())
+        del changed, removed
+        self.assertEqual(index.lookup('Los Angeles'), [book[0]])
+        book.mark_saved()
+        self.assertIsNone(book.changes_since(gen))
+        self.assertEqual(book.changes_since(book.generation), ([], []))
+        self.assertIsNone(pris())
+
+    def test_copy_not_modified(self):
+        """a copy of the AddressBook tracks changes of its own entries only"""
+        book = book_example(self.names)
+        book[0].city = 'los angeles'
+        book_copy = copy.deepcopy(book)
+        self.assertFalse(book_copy.modified)
+        book_copy[0].city = 'metropolis'
+        self.assertTrue(book_copy.modified)
+        self.assertEqual(book[0].city, 'Los Angeles')
+        self.assertEqual(book.dirty_entries(), [book[0]])
+
+
+class TestHistory(unittest.TestCase):
+
+    names = [('roy', 'batty'), ('pris', 'stratton'), ('roy', 'batty'), ('leon', 'kowalski')]
+
+    def test_undo_redo_edit(self):
+        """undo should restore all the attributes set together with the changed one"""
+        book = book_example(self.names)
+        roy = book[0]
+        roy.phone = '(42)5109999'
+        roy.birthday = '8-1-2016'
+        self.assertTrue(book.undo())
+        self.assertIsNone(roy.birthday)
+        self.assertTrue(book.undo())
+        self.assertEqual((roy.phone, roy.phone_area), ('668678678', ''))
+        self.assertFalse(book.undo())
+        self.assertTrue(book.redo())
+        self.assertEqual((roy.phone, roy.phone_area), ('5109999', '42'))
+
+    @patch('builtins.input', return_value='a')
+    def test_undo_removal_all(self, mock_input):
+        """removing all the matching entries is undone in one step and the entries get back to their positions"""
+        book = book_example(self.names)
+        book.sorting('name')
+        before = list(book)
+        book.removal(name='roy')
+        self.assertEqual(len(book), 2)
+        book.undo()
+        self.assertEqual([id(p) for p in book], [id(p) for p in before])
+        book.redo()
+        self.assertEqual(len(book), 2)
+
+    @patch('builtins.input', return_value='y')
+    def test_undo_add_new(self, mock_input):
+        """adding a new entry can be undone, a new change makes redoing impossible"""
+        book = book_example(self.names)
+        with suppress_stdout():
+            book.add_new('zhora', 'salome', 'nexus6@gmail.com', '668678678')
+        book.undo()
+        self.assertEqual(len(book), 4)
+        book[0].city = 'los angeles'
+        self.assertFalse(book.redo())
+
+    def test_history_size(self):
+        """history holds only the changed values, not copies of the AddressBook"""
+        book = book_example(self.names)
+        book[1].city = 'los angeles'
+        self.assertEqual(list(book.history.undo_stack), [('set', book[1], {'city': None})])
+
+
+class TestBulkOperations(unittest.TestCase):
+
+    names = [('roy', 'batty'), ('pris', 'stratton'), ('roy', 'batty'), ('leon', 'kowalski')]
+
+    def test_bulk_add(self):
+        """bulk_add adds all the entries as one change"""
+        book = AddressBook()
+        book.bulk_add(people_example(self.names))
+        self.assertEqual(len(book), 4)
+        self.assertEqual(book.generation, 1)
+        self.assertEqual(len(book.history.undo_stack), 1)
+
+    def test_bulk_add_wrong_input(self):
+        """bulk_add should fail without adding anything if any of the items is not a Person"""
+        book = AddressBook()
+        self.assertRaises(TypeError, book.bulk_add, people_example(self.names) + ['roy batty'])
+        self.assertEqual(len(book), 0)
+
+    def test_bulk_remove_identity(self):
+        """bulk_remove removes exactly the given entries, not other people with the same name"""
+        book = AddressBook()
+        book.bulk_add(people_example(self.names))
+        roy1, pris, roy2, leon = book
+        self.assertEqual(book.bulk_remove([roy2, leon]), 2)
+        self.assertEqual([id(p) for p in book], [id(roy1), id(pris)])
+        book.undo()
+        self.assertEqual([id(p) for p in book], [id(roy1), id(pris), id(roy2), id(leon)])
+
+    @patch('builtins.input', return_value='2')
+    def test_removal_chosen_entry(self, mock_input):
+        """removal should remove the entry chosen by user, even if it is equal to another one"""
+        book = AddressBook()
+        book.bulk_add(people_example(self.names))
+        found = book.search_base(name='roy')
+        with suppress_stdout():
+            book.removal(name='roy')
+        self.assertEqual(len(book), 3)
+        self.assertTrue(any(p is found[0] for p in book))
+        self.assertFalse(any(p is found[1] for p in book))
+
+
+class TestUids(unittest.TestCase):
+
+    names = [('roy', 'batty'), ('roy', 'batty'), ('pris', 'batty')]
+
+    def test_unique_uids(self):
+        """every entry gets its own uid, even if it is equal to another entry"""
+        book = book_example(self.names)
+        self.assertEqual([p.uid for p in book], [1, 2, 3])
+        self.assertIs(book.get(2), book[1])
+        self.assertIsNone(book.get(10))
+
+    def test_uid_immutable(self):
+        """uid cannot be set directly"""
+        book = book_example(self.names)
+        self.assertRaises(AttributeError, setattr, book[0], 'uid', 5)
+
+    def test_uids_not_reused(self):
+        """uids of removed entries are not given to new ones, undo brings back the old uid"""
+        book = book_example(self.names)
+        pris = book.pop()
+        book.append(Person('leon', 'kowalski', 'nexus6@gmail.com', '668678678'))
+        self.assertEqual(book[-1].uid, 4)
+        book.undo()
+        book.undo()
+        self.assertEqual([p.uid for p in book], [1, 2, 3])
+        self.assertIs(book.get(3), pris)
+
+    def test_uids_saved(self):
+        """uids are kept when the AddressBook is saved and opened again"""
+        book = book_example(self.names)
+        book.pop(0)
+        book_copy = pickle.loads(pickle.dumps(book, 2))
+        self.assertEqual([p.uid for p in book_copy], [2, 3])
+        book_copy.append(Person('leon', 'kowalski', 'nexus6@gmail.com', '668678678'))
+        self.assertEqual(book_copy[-1].uid, 4)
+
+    def test_old_book_migration(self):
+        """entries of books saved without uids get them when the book is opened"""
+        people = people_example([('roy', 'batty'), ('pris', 'batty')])
+        # this is how books saved by older versions are unpickled
+        book = AddressBook.__new__(AddressBook)
+        book.extend(people)
+        book.__setstate__({'filename': 'abook.pkl'})
+        self.assertEqual([p.uid for p in book], [1, 2])
+        self.assertEqual(book.filename, 'abook.pkl')
+        self.assertFalse(book.modified)
+
+    def test_rename_personid(self):
+        """personid follows changes of name and surname"""
+        book = book_example(self.names)
+        book[2].surname = 'stratton'
+        self.assertEqual(book[2].personid, 'Stratton_Pris')
+        self.assertIs(book.search_base(personid='stratton_pris'.title()), book.get(3))
+
+    def test_identity(self):
+        """remove, index and 'in' match entries by identity, not by equal personid"""
+        book = book_example(self.names)
+        first, second = book[0], book[1]
+        other = Person('roy', 'batty', 'nexus6@gmail.com', '668678678')
+        self.assertEqual(book.index(second), 1)
+        self.assertNotIn(other, book)
+        self.assertRaises(ValueError, book.index, other)
+        self.assertRaises(ValueError, book.index, second, 2)
+        book.remove(second)
+        self.assertNotIn(second, book)
+        self.assertIn(first, book)
+        self.assertEqual([p.uid for p in book], [1, 3])
+        self.assertRaises(ValueError, book.remove, second)
+
+
+class TestSorting(unittest.TestCase):
+
+    names = [('anna', 'żak'), ('zofia', 'zając'), ('łucja', 'lis'), ('anna', 'lis'), ('ewa', 'lis'),
+             ('stefan', 'śliwa')]
+    cities = ['łódź', None, 'kraków', 'warszawa', 'łódź', None]
+
+    def setUp(self):
+        self.book = book_example(self.names, city=self.cities)
+
+    def test_collation_pl(self):
+        """Polish letters are sorted next to their base letters, not after 'z'"""
+        book = self.book
+        book.sorting('surname', collation='pl')
+        self.assertEqual([p.surname for p in book], ['Lis', 'Lis', 'Lis', 'Śliwa', 'Zając', 'Żak'])
+        book.sorting('surname')
+        self.assertEqual([p.surname for p in book][-2:], ['Śliwa', 'Żak'])
+
+    def test_multiple_keys(self):
+        """entries are sorted by next keys when previous ones are equal, every key in its own order"""
+        book = self.book
+        book.sorting('surname', ('city', True), collation='pl')
+        self.assertEqual([(p.surname, p.city) for p in book][:3],
+                         [('Lis', 'Warszawa'), ('Lis', 'Łódź'), ('Lis', 'Kraków')])
+        book.sorting('city', 'name', collation='en')
+        self.assertEqual([p.name for p in book], ['Łucja', 'Anna', 'Ewa', 'Anna', 'Stefan', 'Zofia'])
+        book.sorting('city', reverse=True, collation='pl')
+        self.assertEqual([p.city for p in book][:2], [None, None])
+
+    def test_sorting_stable(self):
+        """entries with equal keys keep their order"""
+        book = self.book
+        before = [p.uid for p in book if p.surname == 'Lis']
+        book.sorting('surname', collation='pl')
+        self.assertEqual([p.uid for p in book][:3], before)
+
+    def test_unknown_collation(self):
+        book = self.book
+        self.assertRaises(WrongInput, book.sorting, 'name', collation='xx')
+
+
+class TestRendering(unittest.TestCase):
+
+    def test_block_format(self):
+        """details are separated with '|' and wrapped like before"""
+        person = Person('roy', 'batty', 'nexus6@gmail.com', '668678678')
+        person.city = 'Los Angeles'
+        block = ab_render.person_block(person)
+        self.assertTrue(block.startswith('\tSurname: Batty |  Name: Roy |  Email: nexus6@gmail.com'))
+        old = str(person.get_details()).replace(',', ' | ').replace("'", '').replace('[', '').replace(']', '')
+        self.assertEqual(block.split('\n'), tw.wrap(old, width=80, initial_indent='\t',
+                                                    subsequent_indent='\t', break_long_words=False))
+
+    def test_block_cached(self):
+        """block is formatted once and formatted again only after the person changes"""
+        person = Person('roy', 'batty', 'nexus6@gmail.com', '668678678')
+        with patch.object(ab_render, '_format', wraps=ab_render._format) as fmt:
+            ab_render.person_block(person)
+            ab_render.person_block(person)
+            self.assertEqual(fmt.call_count, 1)
+            person.city = 'Los Angeles'
+            self.assertIn('Los Angeles', ab_render.person_block(person))
+            self.assertEqual(fmt.call_count, 2)
+        self.assertNotIn('_cache', pickle.loads(pickle.dumps(person)).__dict__)
+
+    def test_write_all(self):
+        """all the entries are written, in chunks"""
+        book = book_example([('roy', 'batty')] * 5)
+        out = io.StringIO()
+        with patch.object(out, 'write', wraps=out.write) as write:
+            ab_render.write_all(book, out, chunk=2)
+            self.assertEqual(write.call_count, 3)
+        self.assertEqual(out.getvalue().count('Name: Roy'), 5)
+        self.assertTrue(out.getvalue().startswith(' <1>  \n\t'))
+        self.assertIn(' <5>  \n', out.getvalue())
+
+    def test_pager(self):
+        """pager shows only the entries fitting on a page, moves forward, back and quits"""
+        book = book_example([('roy', 'batty')] * 10)
+        out = io.StringIO()
+        answers = iter(['', 'b', '', '', 'q'])
+        with patch.object(ab_render, '_format', wraps=ab_render._format) as fmt:
+            ab_render.page(book, out, height=9, ask=lambda prompt: next(answers))
+            # entries 1-9 are shown, the 10th is formatted only to find out it doesn't fit
+            self.assertEqual(fmt.call_count, 10)
+        text = out.getvalue()
+        self.assertEqual(text.count(' <1>  '), 2)
+        self.assertIn(' <9>  ', text)
+        self.assertNotIn(' <10>  ', text)
+
+    @patch('builtins.input')
+    def test_pager_single_page(self, mock_input):
+        """user is not asked anything if all the entries fit on one page"""
+        book = book_example([('roy', 'batty')] * 2)
+        ab_render.page(book, io.StringIO(), height=24)
+        self.assertFalse(mock_input.called)
+
+
+class TestMainApp(unittest.TestCase):
+
+    @staticmethod
+    def run_script(answers):
+        """Run MainApp answering its questions with the given answers, return depths of the stack
+        measured whenever the user is asked a question"""
+
+        answers = iter(answers)
+        depths = []
+
+        def scripted_input(prompt=''):
+            frame, depth = sys._getframe(), 0
+            while frame is not None:
+                frame, depth = frame.f_back, depth + 1
+            depths.append(depth)
+            return next(answers)
+
+        app = MainApp()
+        with patch('builtins.input', scripted_input), suppress_stdout():
+            app.run()
+        return app, depths
+
+    def test_long_session(self):
+        """thousands of moves between menus don't make the stack grow"""
+        script = ['1']
+        for i in range(500):
+            # add an entry, change its name, go back to AddressBook Options
+            surname = 'batty' + ''.join(chr(ord('a') + int(d)) for d in str(i))
+            script += ['4', 'roy', surname, 'nexus6@gmail.com', '668678678', 'y', '1', 'rick', '11']
+        for i in range(1000):
+            # search, leave the results, go to Main Menu and back to AddressBook Options
+            script += ['2', '3', 'rbatty@gmail.com', '8', '1']
+        script += ['9', 'n']
+
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(200)
+        try:
+            app, depths = self.run_script(script)
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertEqual(len(app.abook), 500)
+        self.assertTrue(all(p.name == 'Rick' for p in app.abook))
+        self.assertLessEqual(max(depths), min(depths) + 10)
+
+    def test_exit_ends_run(self):
+        """choosing 'Exit' makes run return instead of calling sys.exit"""
+        app, depths = self.run_script(['3'])
+        self.assertEqual(len(depths), 1)
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.csv = self.path('people.csv')
+        with open(self.csv, 'w') as f:
+            f.write('name,surname,email,phone,birthday,city,streetname,streetnumber\n'
+                    'roy,batty,nexus6@gmail.com,668678678,08-01-2016,Los Angeles,,\n'
+                    'pris,stratton,nero65@walla.com,609876543,,,Piotrkowska,12\n'
+                    'leon,kowalski,not-an-email,508123456,,,,\n'
+                    'roy,batty,rbatty@gmail.com,508123456,,,,\n')
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def cli(self, *argv):
+        """Run the command, return its exit code and the parsed JSON output"""
+        out = io.StringIO()
+        with patch('sys.stdout', out), patch('sys.stderr', io.StringIO()):
+            code = ab_cli.main(list(argv))
+        return code, json.loads(out.getvalue()) if out.getvalue() else None
+
+    def test_import_and_search(self):
+        book = self.path('book.pkl')
+        code, result = self.cli('import', book, self.csv)
+        self.assertEqual(code, ab_cli.EXIT_REJECTED)
+        self.assertEqual((result['imported'], result['count']), (3, 3))
+        self.assertEqual(result['rejected'][0]['record'], 3)
+
+        code, result = self.cli('search', book, 'surname', 'batty')
+        self.assertEqual((code, result['found']), (ab_cli.EXIT_OK, 2))
+        self.assertEqual({p['email'] for p in result['people']}, {'nexus6@gmail.com', 'rbatty@gmail.com'})
+        code, result = self.cli('search', book, 'city', 'Paris')
+        self.assertEqual((code, result['found']), (ab_cli.EXIT_NOT_FOUND, 0))
+
+    def test_sort_dedupe_stats(self):
+        book = self.path('book.pkl')
+        self.cli('import', book, self.csv)
+        self.assertEqual(self.cli('sort', book, 'surname:desc', 'email')[0], ab_cli.EXIT_OK)
+        with open(book, 'rb') as f:
+            self.assertEqual([p.surname for p in pickle.load(f)], ['Stratton', 'Batty', 'Batty'])
+
+        # by default only copies of the same entry are duplicates, not different people with the same name
+        code, result = self.cli('dedupe', book)
+        self.assertEqual((code, result['removed'], result['count']), (ab_cli.EXIT_OK, 0, 3))
+        self.cli('import', book, self.csv)
+        code, result = self.cli('dedupe', book)
+        self.assertEqual((code, result['removed'], result['count']), (ab_cli.EXIT_OK, 3, 3))
+        code, result = self.cli('dedupe', book, '--by', 'personid')
+        self.assertEqual((code, result['removed'], result['count']), (ab_cli.EXIT_OK, 1, 2))
+        self.assertEqual(result['duplicates'][0]['email'], 'rbatty@gmail.com')
+        code, result = self.cli('stats', book, '--today', '2026-01-01')
+        self.assertEqual((result['count'], result['age']['max']), (2, 9))
+
+    def test_convert_round_trip(self):
+        """records survive conversion from CSV to pickle to JSON and back to CSV"""
+        self.cli('convert', self.csv, self.path('book.pkl'))
+        self.cli('convert', self.path('book.pkl'), self.path('book.json'))
+        code, result = self.cli('convert', self.path('book.json'), self.path('copy.csv'))
+        self.assertEqual((code, result['converted']), (ab_cli.EXIT_OK, 3))
+        with open(self.csv) as a, open(self.path('copy.csv')) as b:
+            rows = [r.lower() for r in a.read().splitlines() if 'not-an-email' not in r]
+            self.assertEqual(rows, b.read().lower().splitlines())
+
+    def test_errors(self):
+        code, result = self.cli('search', self.path('missing.pkl'), 'name', 'roy')
+        self.assertEqual((code, result), (ab_cli.EXIT_ERROR, None))
+        self.assertEqual(self.cli('export', self.csv, self.path('out.json'))[0], ab_cli.EXIT_ERROR)
+        book = self.path('book.pkl')
+        self.cli('import', book, self.csv)
+        # invalid values given in the arguments are usage errors, not file errors
+        for argv in (('sort', book, 'height'), ('stats', book, '--today', '2026-13-01'),
+                     ('select', book, 'vip and'), ('exists', book, '--name', 'roy')):
+            self.assertEqual(self.cli(*argv), (ab_cli.EXIT_USAGE, None), argv)
+        with patch('sys.stderr', io.StringIO()), self.assertRaises(SystemExit) as cm:
+            ab_cli.main(['unknown'])
+        self.assertEqual(cm.exception.code, ab_cli.EXIT_USAGE)
+
+
+class TestStartup(unittest.TestCase):
+
+    # maximum time of importing the command-line interface (ms)
+    BUDGET = 100
+    # modules that shouldn't be imported until they are used
+    LAZY = ('numpy', 'pickle', 'csv', 'textwrap', 'statistics', 'glob', 'shutil', 'hashlib')
+
+    @staticmethod
+    def python(*args):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.run((sys.executable,) + args, env=dict(os.environ, PYTHONPATH=root),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    def test_lazy_imports(self):
+        """rarely used modules are not imported by the command-line interface"""
+        proc = self.python('-c', 'import sys, addressbook.ab_cli; '
+                                 'print(" ".join(m for m in {0!r} if m in sys.modules))'.format(self.LAZY))
+        self.assertEqual(proc.stdout.split(), [])
+
+    def test_lazy_module(self):
+        module = LazyModule('json')
+        self.assertEqual(module.loads('[1]'), [1])
+        self.assertFalse(LazyModule('no_such_module_', optional=True))
+        self.assertRaises(ImportError, getattr, LazyModule('no_such_module_'), 'anything')
+
+    def test_startup_budget(self):
+        """importing the command-line interface takes less than BUDGET (the best of 3 runs)"""
+        times = []
+        for _ in range(3):
+            stderr = self.python('-X', 'importtime', '-c', 'import addressbook.ab_cli').stderr
+            last = stderr.strip().splitlines()[-1]
+            self.assertTrue(last.endswith('| addressbook.ab_cli'))
+            times.append(int(last.split('|')[1]) / 1000)
+        self.assertLess(min(times), self.BUDGET)
+
+
+class TestAttributeIndex(unittest.TestCase):
+
+    def check(self, index, values):
+        for value in values:
+            expected = [p.uid for p in index.book if getattr(p, index.attribute) == value]
+            self.assertEqual(sorted(p.uid for p in index.lookup(value)), expected)
+
+    def test_follows_changes(self):
+        """index stays consistent with the AddressBook after adding, modifying, removing and undoing"""
+        book = abook_example()
+        index = AttributeIndex(book, 'surname')
+        self.check(index, ['Batty', 'Stratton', 'Deckard'])
+        book.bulk_remove(book[:3])
+        book[0].surname = 'deckard'
+        book.append(Person('rick', 'deckard', 'rick@lapd.com', '668678678'))
+        self.check(index, ['Batty', 'Stratton', 'Deckard'])
+        book.undo()
+        book.undo()
+        self.check(index, ['Batty', 'Stratton', 'Deckard'])
+        self.assertEqual(len(index), len(book))
+
+    def test_rebuilt_after_reset(self):
+        """changes that are no longer logged make the index rebuild itself"""
+        book = abook_example()
+        index = AttributeIndex(book, 'name')
+        self.check(index, ['Roy'])
+        book[0].name = 'rachael'
+        book.reset_changes()
+        book.pop()
+        self.check(index, ['Roy', 'Rachael', 'Harry'])
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'book.pkl')
+        book = abook_example()
+        book.pickle_base(self.path[:-4])
+        self.socket = ab_daemon.default_socket(self.path)
+        self.server = ab_daemon.BookServer(ab_daemon.BookService(self.path), self.socket)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+        self.client = ab_daemon.BookClient(self.socket, timeout=10)
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            self.client.shutdown()
+            self.thread.join()
+        self.client.close()
+        self.server.server_close()
+
+    def test_search_and_edit(self):
+        found = self.client.search('surname', 'stratton')
+        self.assertEqual(sorted(p['name'] for p in found), ['Pris', 'Zhora'])
+        uid = found[0]['uid']
+        self.client.edit(uid, surname='deckard', city='Paris')
+        self.assertEqual(len(self.client.search('surname', 'stratton')), 1)
+        self.assertEqual([p['uid'] for p in self.client.search('city', 'paris')], [uid])
+        self.assertRaises(RequestFailed, self.client.edit, uid, city='Oslo', birthday='31-02-1990')
+        self.assertEqual(self.client.get(uid)['city'], 'Paris')
+
+    def test_add_remove_save(self):
+        uid = self.client.add({'name': 'rick', 'surname': 'deckard', 'email': 'rick@lapd.com',
+                               'phone': '668678678'})
+        self.client.remove(self.client.search('surname', 'batty')[0]['uid'])
+        self.assertEqual(self.client.request('ping')['count'], 22)
+        self.assertRaises(RequestFailed, self.client.get, 1000)
+        self.assertRaises(RequestFailed, self.client.request, 'drop')
+        self.client.shutdown()
+        self.thread.join()
+        with open(self.path, 'rb') as f:
+            book = pickle.load(f)
+        self.assertEqual(len(book), 22)
+        self.assertEqual(book.get(uid).personid, 'Deckard_Rick')
+
+    def test_idle_client(self):
+        """an idle client doesn't hold up the others, and its connection is closed after a while"""
+        self.server.idle_timeout = 0.3
+        with ab_daemon.BookClient(self.socket, timeout=10) as idle:
+            self.assertEqual(idle.request('ping')['count'], 22)
+            self.assertEqual(len(self.client.search('surname', 'stratton')), 2)
+            idle._sock.settimeout(10)
+            self.assertEqual(idle._sock.recv(1), b'')
+            # the client connects again
+            self.assertEqual(idle.request('ping')['count'], 22)
+
+    def test_protocol(self):
+        """messages are preceded by their length"""
+        message = ab_daemon.encode_message({'op': 'ping'})
+        self.assertEqual(message[:4], len(message[4:]).to_bytes(4, 'big'))
+        self.assertEqual(ab_daemon.read_message(io.BytesIO(message)), {'op': 'ping'})
+        self.assertIsNone(ab_daemon.read_message(io.BytesIO(b'')))
+        self.assertRaises(EOFError, ab_daemon.read_message, io.BytesIO(message[:-1]))
+
+
+class TestAsyncServer(unittest.TestCase):
+
+    def test_read_write_lock(self):
+        """readers share the lock, a writer holds it alone and goes before readers coming after it"""
+        events = []
+
+        async def reader(lock, name, delay):
+            await asyncio.sleep(delay)
+            async with lock.read():
+                events.append((name, 'start', lock.readers))
+                await asyncio.sleep(0.02)
+                events.append((name, 'end'))
+
+        async def writer(lock, delay):
+            await asyncio.sleep(delay)
+            async with lock.write():
+                events.append(('w', 'start', lock.readers))
+                await asyncio.sleep(0.02)
+                events.append(('w', 'end'))
+
+        async def run():
+            lock = ab_server.ReadWriteLock()
+            await asyncio.gather(reader(lock, 'r1', 0), reader(lock, 'r2', 0), writer(lock, 0.005),
+                                 reader(lock, 'r3', 0.01))
+
+        asyncio.run(run())
+        names = [e[0] for e in events if e[1] == 'start']
+        self.assertEqual(names, ['r1', 'r2', 'w', 'r3'])
+        self.assertEqual(events[1], ('r2', 'start', 2))
+        w = events.index(('w', 'start', 0))
+        self.assertEqual(events[w + 1], ('w', 'end'))
+
+    def test_concurrent_clients(self):
+        """many clients read and write at once, sorting runs in the thread pool"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'book.pkl')
+        abook_example().pickle_base(path[:-4])
+        sock = ab_daemon.default_socket(path)
+
+        async def client(number):
+            async with ab_server.AsyncBookClient(sock) as c:
+                for i in range(20):
+                    if i == 10:
+                        await c.request('add', person={'name': 'rick', 'surname': 'deckard{0}'.format('x' * number),
+                                                       'email': 'rick@lapd.com', 'phone': '668678678'})
+                    elif i == 15 and number % 5 == 0:
+                        await c.request('sort', keys=['surname', 'name:desc'])
+                    else:
+                        found = await c.request('search', attribute='surname', value='stratton')
+                        self.assertEqual(found['found'], 2)
+
+        async def run():
+            server = ab_server.AsyncBookServer(ab_daemon.BookService(path), sock, workers=2)
+            serving = asyncio.ensure_future(server.serve())
+            while not os.path.exists(sock):
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*(client(n) for n in range(20)))
+            async with ab_server.AsyncBookClient(sock) as c:
+                self.assertEqual((await c.request('ping'))['count'], 42)
+                await c.request('shutdown')
+            await serving
+
+        asyncio.run(run())
+        self.assertFalse(os.path.exists(sock))
+        with open(path, 'rb') as f:
+            self.assertEqual(len(pickle.load(f)), 42)
+
+
+class TestSharedSaving(unittest.TestCase):
+    """Two users open the same file, change it and save it one after another"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'shared.pkl')
+        abook_example().pickle_base(self.path)
+        self.alice, self.bob = self.open(), self.open()
+
+    def open(self):
+        with open(self.path, 'rb') as f:
+            book = pickle.load(f)
+        book.filename = self.path
+        return book
+
+    def test_versions(self):
+        self.assertEqual(self.alice.version, 1)
+        self.alice.pickle_changes()
+        self.assertEqual((self.alice.version, self.open().version), (2, 2))
+        with open(ab_storage.lock_path(self.path)) as f:
+            self.assertEqual(f.read(), '2')
+
+    def test_file_names(self):
+        """pickle_base adds '.pkl' only to names without it, and gives a dated name if there is none"""
+        folder = os.path.dirname(self.path)
+        book = abook_example()
+        book.pickle_base(os.path.join(folder, 'mine'))
+        self.assertEqual(book.filename, os.path.join(folder, 'mine.pkl'))
+        book.pickle_base(self.path)
+        self.assertEqual(book.filename, self.path)
+        self.assertFalse(os.path.exists(self.path + '.pkl'))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(folder)
+        book.pickle_base()
+        self.assertRegex(book.filename, r'^abook\d{4}-\d\d-\d\d\.pkl$')
+        self.assertTrue(os.path.exists(os.path.join(folder, book.filename)))
+
+    def test_merge_different_entries(self):
+        """changes of different entries (including adding entries with the same new uid) are merged"""
+        self.alice.get(12).city = 'Paris'
+        self.alice.append(Person('rick', 'deckard', 'rick@lapd.com', '668678678'))
+        self.alice.pickle_changes()
+        self.bob.get(13).city = 'Oslo'
+        self.bob.remove(self.bob.get(14))
+        self.bob.append(Person('rachael', 'tyrell', 'rachael@tyrell.com', '668678678'))
+        self.bob.pickle_changes()
+
+        saved = self.open()
+        self.assertEqual((saved.get(12).city, saved.get(13).city, saved.get(14)), ('Paris', 'Oslo', None))
+        self.assertEqual(sorted(p.surname for p in saved if p.uid > 22), ['Deckard', 'Tyrell'])
+        self.assertEqual(len({p.uid for p in saved}), len(saved))
+        self.assertEqual(self.bob.get(12).city, 'Paris')
+        self.assertFalse(self.bob.modified)
+
+        # the first user merges the second user's changes on the next save
+        self.alice.pickle_changes()
+        self.assertEqual(sorted(p.uid for p in self.alice), sorted(p.uid for p in saved))
+        self.assertEqual(self.alice.get(13).city, 'Oslo')
+
+    def test_uid_collision(self):
+        """an entry saved first keeps its uid, an entry added by another user with the same uid gets a new one"""
+        leon = Person('leon', 'kowalski', 'leon@tyrell.com', '668678678')
+        self.alice.append(leon)
+        self.alice.pickle_changes()
+        zhora = Person('zhora', 'salome', 'zhora@tyrell.com', '668678600')
+        self.bob.append(zhora)
+        self.assertEqual(zhora.uid, leon.uid)
+        self.bob.pickle_changes()
+
+        saved = self.open()
+        self.assertEqual(saved.get(leon.uid).name, 'Leon')
+        self.assertGreater(zhora.uid, leon.uid)
+        self.assertEqual(saved.get(zhora.uid).name, 'Zhora')
+        self.assertEqual(self.bob.get(leon.uid).name, 'Leon')
+        self.assertIs(self.bob.get(zhora.uid), zhora)
+        self.assertIs(self.bob.search_base(surname='salome'), zhora)
+
+        self.alice.pickle_changes()
+        self.assertIs(self.alice.get(leon.uid), leon)
+        self.assertEqual(leon.name, 'Leon')
+        self.assertEqual(self.alice.get(zhora.uid).name, 'Zhora')
+
+    def test_conflict(self):
+        """a conflict is raised (and nothing saved) unless resolved"""
+        self.alice.get(12).city = 'Paris'
+        self.alice.pickle_changes()
+        self.bob.get(12).city = 'Oslo'
+        self.bob.get(13).city = 'Rome'
+        self.assertRaises(SaveConflict, self.bob.pickle_changes)
+        self.assertEqual(self.open().get(12).city, 'Paris')
+        self.assertEqual(self.bob.get(12).city, 'Oslo')
+
+        asked = []
+        self.bob.pickle_changes(resolve=lambda mine, theirs: asked.append((mine.city, theirs.city)))
+        self.assertEqual(asked, [('Oslo', 'Paris')])
+        self.assertEqual((self.open().get(12).city, self.open().get(13).city), ('Paris', 'Rome'))
+
+    def test_same_change_is_not_conflict(self):
+        self.alice.get(12).city = 'Paris'
+        self.alice.pickle_changes()
+        self.bob.get(12).city = 'Paris'
+        self.bob.pickle_changes()
+        self.assertEqual(self.open().version, 3)
+
+    def test_removed_and_changed(self):
+        """entry removed by one user and changed by the other comes back if the change is kept"""
+        self.alice.bulk_remove([self.alice.get(12), self.alice.get(13)])
+        self.alice.pickle_changes()
+        self.bob.get(12).city = 'Oslo'
+        self.bob.get(13).city = 'Rome'
+        self.bob.pickle_changes(resolve=lambda mine, theirs: mine.uid == 13)
+        saved = self.open()
+        self.assertIsNone(saved.get(12))
+        self.assertEqual(saved.get(13).city, 'Rome')
+        self.assertIsNone(self.bob.get(12))
+
+        self.alice.get(14).city = 'Paris'
+        self.alice.pickle_changes()
+        self.bob.remove(self.bob.get(14))
+        self.bob.pickle_changes(resolve=lambda mine, theirs: False)
+        self.assertEqual((self.bob.get(14).city, self.open().get(14).city), ('Paris', 'Paris'))
+
+    def test_readers_not_blocked(self):
+        """the file can be read while a writer holds the lock"""
+        with ab_storage.locked(self.path):
+            self.assertEqual(len(self.open()), 22)
+        self.assertEqual([n for n in os.listdir(os.path.dirname(self.path)) if n.startswith('.')], [])
+
+
+class TestParallelImport(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.csv = os.path.join(tmp.name, 'people.csv')
+        book = abook_example()
+        # every fourth record is invalid
+        for number, person in enumerate(book):
+            if number % 4 == 3:
+                person.__dict__['email'] = 'not-an-email'
+        ab_export.write_people(book, self.csv)
+
+    def test_tuple_round_trip(self):
+        person = abook_example()[12]
+        copied = Person.from_tuple(person.to_tuple())
+        self.assertEqual(copied.__dict__, {k: v for k, v in person.__dict__.items() if k in Person.ATTRIBUTES})
+        self.assertEqual(copied.get_details(), person.get_details())
+
+    def test_chunks(self):
+        """results don't depend on the size of the chunks"""
+        people, rejected = ab_export.read_people(self.csv)
+        self.assertEqual(len(people), 17)
+        self.assertEqual([n for n, _ in rejected], [4, 8, 12, 16, 20])
+        for size in (1, 3, 100):
+            chunked, bad = ab_export.read_people(self.csv, chunk_size=size)
+            self.assertEqual([p.to_tuple() for p in chunked], [p.to_tuple() for p in people])
+            self.assertEqual(bad, rejected)
+
+    def test_workers(self):
+        """people parsed by several processes come back in the order of the records"""
+        people, rejected = ab_export.read_people(self.csv)
+        parallel, bad = ab_export.read_people(self.csv, workers=2, chunk_size=3)
+        self.assertEqual([p.to_tuple() for p in parallel], [p.to_tuple() for p in people])
+        self.assertEqual(bad, rejected)
+
+
+class TestThreadSafeBook(unittest.TestCase):
+
+    def setUp(self):
+        self.shared = ab_threads.ThreadSafeBook(abook_example())
+
+    def test_snapshot(self):
+        snapshot = self.shared.snapshot()
+        city = snapshot.get(12).city
+        self.assertEqual(len(self.shared.search_base(name='roy')), 11)
+        self.assertEqual(self.shared.search_base(surname='ripley').name, 'Ellen')
+        self.assertIsNone(self.shared.search_base(city='paris'))
+        with self.assertRaises(AttributeError):
+            snapshot.get(12).city = 'Paris'
+
+        with self.shared.write() as book:
+            book.get(12).city = 'Paris'
+            book.remove(book.get(13))
+        self.assertEqual((snapshot.get(12).city, len(snapshot)), (city, 22))
+        self.assertEqual((self.shared.get(12).city, len(self.shared)), ('Paris', 21))
+        # unchanged entries are shared by consecutive snapshots
+        self.assertIs(self.shared.get(14), snapshot.get(14))
+
+    def test_reads_dont_sort(self):
+        order = [p.uid for p in self.shared]
+        self.shared.search_base(surname='stratton')
+        self.assertEqual([p.surname for p in self.shared.sorted('surname')][:2], ['Batty', 'Batty'])
+        self.assertEqual([p.uid for p in self.shared], order)
+        self.assertEqual([p.uid for p in self.shared.book], order)
+
+    def test_hammer(self):
+        """readers running alongside a sorting and editing writer always see a whole, consistently sorted book"""
+        errors = []
+        done = threading.Event()
+        with self.shared.write() as book:
+            book.sorting('surname')
+
+        def write():
+            try:
+                for i in range(200):
+                    with self.shared.write() as book:
+                        book.get(12 + i % 10).city = 'City {0}'.format(i)
+                        book.sorting('surname', reverse=bool(i % 2))
+            finally:
+                done.set()
+
+        def read():
+            while not done.is_set():
+                snapshot = self.shared.snapshot()
+                surnames = [p.surname for p in snapshot]
+                try:
+                    self.assertEqual(len(snapshot), 22)
+                    self.assertIn(surnames, (sorted(surnames), sorted(surnames, reverse=True)))
+                    self.assertEqual(len(snapshot.search_base(surname='batty')), 11)
+                except AssertionError as ex:
+                    errors.append(ex)
+                    return
+
+        threads = [threading.Thread(target=read) for _ in range(8)] + [threading.Thread(target=write)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.shared.get(12).city, 'City 190')
+        self.assertEqual(self.shared.snapshot().generation, self.shared.book.generation)
+
+
+class TestGenerator(unittest.TestCase):
+
+    def test_deterministic(self):
+        first = list(ab_generator.Generator(seed=3).records(200))
+        self.assertEqual(first, list(ab_generator.Generator(seed=3).records(200)))
+        self.assertNotEqual(first, list(ab_generator.Generator(seed=4).records(200)))
+
+    def test_valid_entries(self):
+        """generated entries go through the parsers, in both modes"""
+        for mode in ('PL', 'US'):
+            people = list(ab_generator.Generator(mode=mode, missing=0.2, duplicates=0.1).people(500))
+            self.assertEqual(len(people), 500)
+            self.assertTrue(all(p.phone and '@' in p.email for p in people))
+
+    def test_distributions(self):
+        records = list(ab_generator.Generator(seed=1, duplicates=0.2, missing=0.5).records(2000))
+        emails = {r['email'] for r in records}
+        self.assertAlmostEqual(1 - len(emails) / len(records), 0.2, delta=0.05)
+        self.assertAlmostEqual(sum(r['city'] is None for r in records) / len(records), 0.5, delta=0.05)
+        # surnames follow the Zipf distribution: the most popular one is far more common than the median one
+        counts = sorted((sum(r['surname'] == s.lower() for r in records) for s in ab_generator.SURNAMES['PL']),
+                        reverse=True)
+        self.assertGreater(counts[0], 5 * counts[len(counts) // 2])
+
+    def test_write(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        generator = ab_generator.Generator(seed=2)
+        expected = list(generator.people(300))
+        for name in ('book.pkl', 'book.csv', 'book.json'):
+            path = os.path.join(tmp.name, name)
+            generator.write(path, 300)
+            if name.endswith('.pkl'):
+                people = ab_export.load_book(path)
+                self.assertFalse(people.modified)
+                self.assertEqual(sorted(p.uid for p in people), list(range(1, 301)))
+                self.assertEqual([p.to_tuple() for p in people], [p.to_tuple() for p in expected])
+            else:
+                people, rejected = ab_export.read_people(path)
+                self.assertEqual(rejected, [])
+            self.assertEqual(list(map(ab_export.person_record, people)),
+                             list(map(ab_export.person_record, expected)))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, ab_metrics, 'enabled', ab_metrics.enabled)
+        ab_metrics.enabled = True
+        self.book = abook_example()
+        ab_metrics.reset()
+
+    def test_default_off(self):
+        env = {k: v for k, v in os.environ.items() if k != 'ADDRESSBOOK_METRICS'}
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = root
+        code = 'from addressbook import ab_metrics; print(ab_metrics.enabled)'
+        proc = subprocess.run((sys.executable, '-c', code), env=env, stdout=subprocess.PIPE,
+                              universal_newlines=True, check=True)
+        self.assertEqual(proc.stdout.strip(), 'False')
+
+    def test_operations(self):
+        self.book.search_base(name='roy')
+        self.book.search_base(surname='ripley')
+        self.book.append(Person('rick', 'deckard', 'rick@lapd.com', '668678678'))
+        search = ab_metrics.operations['search_base']
+        self.assertEqual((search.calls, search.scanned, search.returned), (2, 44, 12))
+        self.assertGreaterEqual(search.max, 0)
+        self.assertGreaterEqual(search.total, search.max)
+        self.assertEqual(ab_metrics.operations['sorting'].calls, 2)
+        # the parsers run for every field of every entry, so they are not timed one by one
+        self.assertNotIn('email_valid', ab_metrics.operations)
+
+    def test_parsing(self):
+        """the parsers are timed once for every chunk of imported records"""
+        rows = [('roy', 'batty', 'nexus6@gmail.com', '508123456', None, 'los angeles', None, None),
+                ('leon', 'kowalski', 'not-an-email', '508123456', None, None, None, None)]
+        ab_export.parse_chunk((1, rows))
+        ab_export.parse_chunk((3, rows[:1]))
+        parse = ab_metrics.operations['parse_chunk']
+        self.assertEqual((parse.calls, parse.scanned, parse.returned), (2, 3, 2))
+        ab_metrics.enabled = False
+        ab_export.parse_chunk((1, rows))
+        self.assertEqual(parse.calls, 2)
+
+    def test_caches(self):
+        with open(os.devnull, 'w') as out, patch('sys.stdout', out):
+            self.book.show_all_results(paged=False)
+            self.book.show_all_results(paged=False)
+        self.book.statistics()
+        self.book.statistics()
+        block, stats = ab_metrics.caches['block'], ab_metrics.caches['statistics']
+        self.assertEqual((block.hits, block.misses, block.hit_rate), (22, 22, 0.5))
+        self.assertEqual((stats.hits, stats.misses), (1, 1))
+
+    def test_disabled(self):
+        ab_metrics.enabled = False
+        self.book.search_base(name='roy')
+        self.book.statistics()
+        self.assertEqual(ab_metrics.snapshot(), {'enabled': False, 'operations': {}, 'caches': {}})
+        self.assertTrue(ab_metrics.format_metrics().startswith('Operation counters are turned off'))
+
+    def test_json_dump(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        book, dump = os.path.join(tmp.name, 'book.pkl'), os.path.join(tmp.name, 'metrics.json')
+        self.book.pickle_base(book)
+        # --metrics turns the counters on
+        ab_metrics.enabled = False
+        with patch('sys.stdout', io.StringIO()):
+            ab_cli.main(['--metrics', dump, 'search', book, 'name', 'roy'])
+        with open(dump) as f:
+            counters = json.load(f)
+        self.assertEqual(counters['operations']['load']['calls'], 1)
+        self.assertEqual(counters['operations']['search_base']['returned'], 11)
+
+    def test_menu(self):
+        answers = iter(['1', '4', 'roy', 'batty', 'nexus6@gmail.com', '668678678', '8', '13', '9', 'n'])
+        out = io.StringIO()
+        with patch('builtins.input', lambda prompt='': next(answers)), patch('sys.stdout', out):
+            MainApp().run()
+        self.assertIn('add_new', out.getvalue())
+        self.assertNotIn('email_valid', out.getvalue())
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(setattr, ab_metrics, 'enabled', ab_metrics.enabled)
+        self.dir = os.path.join(tmp.name, 'profiles')
+
+    def test_reports(self):
+        book = abook_example()
+        with ab_profile.profiling(self.dir) as profiler:
+            book.search_base(surname='ripley')
+            book.sorting('city')
+            AttributeIndex(book, 'city').lookup('Stepford')
+        self.assertIsNone(ab_metrics.profiler)
+        self.assertEqual(profiler.count, 2)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['0001-search_base.prof', '0002-sorting.prof', 'memory.txt',
+                                                         'operations.txt', 'session.prof'])
+        with open(os.path.join(self.dir, 'operations.txt')) as f:
+            self.assertEqual([line.split()[1] for line in f][1:], ['search_base', 'sorting'])
+        with open(os.path.join(self.dir, 'memory.txt')) as f:
+            report = f.read()
+        for kind in ('people', 'indexes', 'caches'):
+            self.assertRegex(report, r'{0} +\d'.format(kind))
+
+    def test_footprint(self):
+        book = abook_example()
+        before = ab_profile.footprint()
+        with open(os.devnull, 'w') as out, patch('sys.stdout', out):
+            book.show_all_results(paged=False)
+        after = ab_profile.footprint()
+        self.assertGreater(after['caches'], before['caches'])
+        self.assertEqual(after['people'], before['people'])
+
+    def test_off(self):
+        with ab_profile.profiling(None) as profiler:
+            abook_example().search_base(name='roy')
+        self.assertIsNone(profiler)
+        self.assertFalse(os.path.exists(self.dir))
+
+    def test_cli(self):
+        with patch('sys.stderr', io.StringIO()), patch.dict(os.environ, {ab_profile.ENVIRON: self.dir}):
+            ab_cli.main(['stats', os.path.join(self.dir, 'missing.pkl')])
+        self.assertIn('session.prof', os.listdir(self.dir))
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.mine = ab_generator.Generator(seed=5).book(300)
+        self.theirs = ab_generator.Generator(seed=5).book(300)
+        self.theirs[3].city = 'Berlin'
+        self.theirs[4].email = self.theirs[4].email.upper()     # only the case differs, not a change
+        self.theirs.remove(self.theirs[7])
+        self.theirs.append(Person('deckard', 'rick', 'rick@example.com', '668678678'))
+        self.changed, self.removed = self.mine[3], self.mine[7]
+
+    def test_diff(self):
+        d = self.mine.diff(self.theirs)
+        self.assertEqual(d.summary(), {'added': 1, 'removed': 1, 'changed': 1, 'unchanged': 298})
+        self.assertEqual(d.added[0].personid, 'Rick_Deckard')
+        self.assertIs(d.removed[0], self.removed)
+        self.assertIs(d.changed[0][0], self.changed)
+        self.assertEqual(ab_merge.differences(*d.changed[0]), ['city'])
+        self.assertFalse(self.mine.diff(copy.deepcopy(self.mine)))
+
+    def test_duplicates(self):
+        """duplicated entries are matched one to one"""
+        book = abook_example()
+        other = abook_example()
+        other.remove(other[0])
+        other[0].city = 'Paris'
+        d = book.diff(other)
+        self.assertEqual(d.summary(), {'added': 0, 'removed': 1, 'changed': 1, 'unchanged': 20})
+
+    def test_rules(self):
+        self.changed.city = None
+        for rule, city in [('mine', None), ('theirs', 'Berlin'), ('fill', 'Berlin'), ('both', None),
+                           (lambda a, b: False, 'Berlin')]:
+            book = copy.deepcopy(self.mine)
+            book.merge(self.theirs, rule)
+            self.assertEqual(book[3].city, city)
+            self.assertEqual(len(book), 302 if rule == 'both' else 301)
+            self.assertIn(self.removed.personid, [p.personid for p in book])
+        self.assertRaises(ValueError, self.mine.merge, self.theirs, 'newest')
+
+    def test_merge_and_undo(self):
+        report = self.mine.merge(self.theirs, 'theirs', delete=True)
+        self.assertEqual((report.replaced, report.deleted), (1, 1))
+        self.assertFalse(self.mine.diff(self.theirs))
+        # entries are copied rather than moved
+        self.assertIsNot(self.mine[-1], self.theirs[-1])
+        self.assertIsNotNone(self.theirs.get(self.theirs[-1].uid))
+        self.mine.undo()
+        self.assertEqual(self.mine.diff(self.theirs).summary()['changed'], 1)
+        self.assertEqual(len(self.mine), 300)
+
+    def test_add(self):
+        book = abook_example()
+        total = book + self.theirs
+        self.assertEqual(len(total), len(book) + len(self.theirs))
+        self.assertIsNot(total[0], book[0])
+        self.assertEqual(len({p.uid for p in total}), len(total))
+        self.assertRaises(TypeError, book.__add__, ['roy'])
+
+    def test_repeat(self):
+        """'*=' adds copies of the entries as a change of the AddressBook"""
+        book = abook_example()
+        count, gen = len(book), book.generation
+        index = AttributeIndex(book, 'surname')
+        batty = len(index.lookup('Batty'))
+        book *= 2
+        self.assertIsInstance(book, AddressBook)
+        self.assertEqual(len(book), 2 * count)
+        self.assertEqual(len({p.uid for p in book}), len(book))
+        self.assertEqual(len(book.changes_since(gen)[0]), count)
+        self.assertEqual(len(index.lookup('Batty')), 2 * batty)
+        book.undo()
+        self.assertEqual(len(book), count)
+        book *= 0
+        self.assertEqual((len(book), len(index)), (0, 0))
+        self.assertRaises(TypeError, book.__imul__, 'x')
+
+    def test_cli(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        mine, theirs = os.path.join(tmp.name, 'mine.pkl'), os.path.join(tmp.name, 'theirs.pkl')
+        ab_export.save_book(self.mine, mine)
+        ab_export.save_book(self.theirs, theirs)
+        cli = TestCli.cli.__get__(self)
+        code, result = cli('diff', mine, theirs)
+        self.assertEqual((code, result['unchanged'], result['changed'][0]['fields']),
+                         (ab_cli.EXIT_OK, 298, ['city']))
+        code, result = cli('merge', mine, theirs, '--prefer', 'theirs', '--delete')
+        self.assertEqual((code, result['count'], result['replaced']), (ab_cli.EXIT_OK, 300, 1))
+        code, result = cli('diff', mine, theirs, '--summary')
+        self.assertEqual(result, {'added': 0, 'removed': 0, 'changed': 0, 'unchanged': 300})
+
+
+class TestFingerprints(unittest.TestCase):
+
+    def setUp(self):
+        self.book = ab_generator.Generator(seed=6).book(2000)
+
+    def test_fingerprint(self):
+        p = self.book[0]
+        fingerprint = p.fingerprint
+        self.assertEqual(fingerprint, copy.deepcopy(p).fingerprint)
+        self.assertEqual(fingerprint, ab_merge.copy_entry(p).fingerprint)
+        self.addCleanup(setattr, ab_metrics, 'enabled', ab_metrics.enabled)
+        ab_metrics.enabled = True
+        ab_metrics.reset()
+        self.assertEqual(p.fingerprint, fingerprint)
+        self.assertEqual(ab_metrics.caches['fingerprint'].hits, 1)
+        p.city = 'Berlin'
+        self.assertNotEqual(p.fingerprint, fingerprint)
+        fingerprint = p.fingerprint
+        p.email = p.email.upper()
+        self.assertEqual(p.fingerprint, fingerprint)
+        self.assertEqual(Person('roy', 'batty', 'NEXUS6@gmail.com', '668678678').fingerprint,
+                         Person('roy', 'batty', 'nexus6@gmail.com', '668-678-678').fingerprint)
+
+    def test_stable(self):
+        """fingerprints are the same in another process"""
+        p = next(p for p in self.book if p.birthday is not None)
+        values = list(p.to_tuple())
+        values[Person.ATTRIBUTES.index('birthday')] = p.birthday.isoformat()
+        code = ('import datetime, json, sys; from addressbook.ab_person import Person; '
+                'values = json.loads(sys.argv[1]); values[7] = datetime.date.fromisoformat(values[7]); '
+                'print(Person.from_tuple(values).fingerprint)')
+        self.assertEqual(int(TestStartup.python('-c', code, json.dumps(values)).stdout), p.fingerprint)
+
+    def test_canonical(self):
+        """fingerprints depend on the values only, not on their classes"""
+        p = next(p for p in self.book if p.birthday is not None)
+        fingerprint = p.fingerprint
+        birthday = p.birthday
+        p.__dict__.pop('_cache')
+        p.__dict__['birthday'] = NewDate(birthday.year, birthday.month, birthday.day)
+        self.assertEqual(p.fingerprint, fingerprint)
+        p.tags = 'b, a'
+        tagged = p.fingerprint
+        self.assertNotEqual(tagged, fingerprint)
+        p.tags = 'a, b'
+        self.assertEqual(p.fingerprint, tagged)
+
+    def test_summary(self):
+        before = self.book.summary().copy()
+        self.assertEqual(len(before), 2000)
+        self.book[5].city = 'Berlin'
+        self.book.remove(self.book[1500])
+        self.book.append(Person('deckard', 'rick', 'rick@example.com', '668678678'))
+        removed = [p.uid for p in self.book[:3]]
+        self.book[:3] = []
+        summary = self.book.summary()
+        expected = {self.book[2].uid, 1501, self.book[-1].uid} | set(removed)
+        self.assertEqual(summary.diff(before), expected)
+        self.assertEqual(before.diff(summary), expected)
+        # the summary kept up to date is the same as the one computed from scratch
+        rebuilt = ab_summary.Summary()
+        rebuilt.build(self.book)
+        self.assertEqual(summary, rebuilt)
+        self.assertEqual(rebuilt.diff(summary), set())
+
+    def test_reverted_change(self):
+        """entries changed and changed back don't differ"""
+        before = self.book.summary().copy()
+        city = self.book[7].city
+        self.book[7].city = 'Berlin'
+        self.book.summary()
+        self.book[7].city = city
+        self.assertEqual(self.book.summary().diff(before), set())
+        self.assertEqual(self.book.summary().root, before.root)
+
+    def test_peers(self):
+        """copies of a book loaded from its file find changes made to one another"""
+        mine, theirs = pickle.loads(pickle.dumps(self.book)), pickle.loads(pickle.dumps(self.book))
+        theirs[10].birthday = '01-02-1990'
+        theirs.bulk_remove(theirs[20:22])
+        uids = {theirs[10].uid, self.book[20].uid, self.book[21].uid}
+        self.assertEqual(pickle.loads(pickle.dumps(mine.summary())).diff(theirs.summary()), uids)
+
+
+class TestTags(unittest.TestCase):
+
+    def setUp(self):
+        self.book = abook_example()
+        for p in self.book:
+            if p.city in ('Pleasantville', 'Stepford'):
+                p.tags = 'customers'
+        self.book[11].tag('Customers', 'Conference  2026')
+        self.book[12].tag('unsubscribed')
+        self.book[18].tag('unsubscribed')
+
+    def names(self, query):
+        return sorted(p.name for p in self.book.select(query))
+
+    def test_person_tags(self):
+        p = self.book[11]
+        self.assertEqual(p.tags, {'customers', 'conference 2026'})
+        self.assertIn('Tags: conference 2026, customers', p.get_details())
+        p.untag('CUSTOMERS')
+        self.assertEqual(p.tags, {'conference 2026'})
+        self.assertRaises(WrongInput, setattr, p, 'tags', 'a=b')
+        self.assertRaises(WrongInput, p.tag, ' ')
+        self.book.undo()
+        self.assertEqual(p.tags, {'customers', 'conference 2026'})
+        p.tags = ''
+        self.assertEqual(p.tags, frozenset())
+        # equal sets of tags are shared
+        self.assertIs(self.book[15].tags, self.book[16].tags)
+
+    def test_select(self):
+        self.assertEqual(self.names('customers'), ['Ellen', 'Leon', 'Tony', 'Travis'])
+        self.assertEqual(self.names('customers AND city=pleasantville AND NOT unsubscribed'), ['Leon'])
+        self.assertEqual(self.names('(unsubscribed OR "conference 2026") and not city=Springfield'),
+                         ['Ellen', 'Rick'])
+        self.assertEqual(self.names('city="los angeles" AND name=roy'), ['Roy'] * 11)
+        self.assertEqual(self.names('nobody OR NOT (customers OR city="Los Angeles")'),
+                         ['Annie', 'Beatrix', 'Harry', 'Pris', 'Rick', 'Tony', 'Zhora'])
+        self.assertEqual(self.book.tag_counts(), {'customers': 4, 'conference 2026': 1, 'unsubscribed': 2})
+        for query in ('', 'customers AND', 'customers unsubscribed', '(customers', 'colour=red', 'NOT'):
+            self.assertRaises(WrongInput, self.book.select, query)
+
+    def test_index_refresh(self):
+        self.assertEqual(len(self.book.select('customers')), 4)
+        self.book[11].untag('customers')
+        self.book.remove(self.book[16])
+        self.book.append(Person('rick', 'deckard', 'deckard@gmail.com', '508123456'))
+        self.book[-1].tags = 'customers, blade runners'
+        self.assertEqual(self.names('customers'), ['Ellen', 'Leon', 'Rick'])
+        self.assertEqual(self.book.tag_counts()['blade runners'], 1)
+        self.book.undo()
+        self.assertNotIn('blade runners', self.book.tag_counts())
+
+    def test_bitmaps(self):
+        uids = [0, 5, 63, 64, 1000, 100000]
+        bitmap = ab_tags.from_uids(uids)
+        self.assertEqual(list(ab_tags.members(bitmap)), uids)
+        self.assertEqual(list(ab_tags.members(0)), [])
+
+        # a big-endian machine reads the words of the little-endian bytes swapped
+        def swapped(typecode, data, native=ab_tags.array):
+            words = native(typecode, data)
+            words.byteswap()
+            return words
+        big_endian = MagicMock(byteorder='big')
+        with patch('addressbook.ab_tags.array', swapped), patch('addressbook.ab_tags.sys', big_endian):
+            self.assertEqual(list(ab_tags.members(bitmap)), uids)
+
+    def test_persisted(self):
+        loaded = pickle.loads(pickle.dumps(self.book))
+        self.assertEqual([p.tags for p in loaded], [p.tags for p in self.book])
+        self.assertIs(loaded[15].tags, loaded[16].tags)
+        self.assertEqual(len(loaded.select('customers AND NOT unsubscribed')), 3)
+        # a set of tags shared by many people is written once, the rest takes a few bytes per person
+        book = ab_generator.Generator(seed=1).book(1000)
+        size = len(pickle.dumps(book))
+        for p in book:
+            p.tags = 'customers, conference 2026'
+        self.assertLess(len(pickle.dumps(book)) - size, 5 * len(book))
+
+    def test_cli(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'book.pkl')
+        ab_export.save_book(self.book, path)
+        cli = TestCli.cli.__get__(self)
+        code, result = cli('tag', path, 'vip, friends', 'city=Pleasantville')
+        self.assertEqual((code, result['tagged'], result['tags']['vip']), (ab_cli.EXIT_OK, 2, 2))
+        code, result = cli('select', path, 'vip AND NOT unsubscribed')
+        self.assertEqual((code, result['found'], result['people'][0]['tags']),
+                         (ab_cli.EXIT_OK, 1, ['customers', 'friends', 'vip']))
+        self.assertEqual(cli('select', path, 'nobody')[0], ab_cli.EXIT_NOT_FOUND)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.book = abook_example()
+        # searches done while the book was built are not counted
+        self.book.query_cache = ab_cache.QueryCache('search_base')
+        self.addCleanup(setattr, ab_metrics, 'enabled', ab_metrics.enabled)
+        ab_metrics.enabled = True
+        ab_metrics.reset()
+
+    def search(self, **kwargs):
+        found = self.book.search_base(**kwargs)
+        return [] if found is None else [found] if isinstance(found, Person) else found
+
+    def test_normalized_query(self):
+        first = self.search(city='los angeles')
+        self.assertEqual(len(first), 11)
+        first.clear()
+        self.assertEqual(len(self.search(city='LOS ANGELES')), 11)
+        self.assertEqual(self.book.query_cache.info()['hits'], 1)
+        self.assertEqual(ab_metrics.caches['search_base'].as_dict()['hits'], 1)
+        self.assertEqual(ab_metrics.operations['search_base'].scanned, len(self.book))
+
+    def test_invalidation(self):
+        cache = self.book.query_cache
+        found = self.search(city='Stepford')
+        # changes of other attributes keep the result
+        found[0].email = 'tony@example.com'
+        self.book.search_base(city='Stepford')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # so do sorting and searches by other attributes
+        self.book.search_base(surname='kiddo')
+        self.assertEqual(len(self.search(city='Stepford')), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        self.book[0].city = 'Stepford'
+        self.assertEqual(len(self.search(city='Stepford')), 2)
+        self.book.undo()
+        self.assertEqual(len(self.search(city='Stepford')), 1)
+        self.book.append(Person('rick', 'deckard', 'deckard@gmail.com', '508123456'))
+        self.assertEqual(self.search(name='rick')[0].surname, 'Blaine')
+        self.book.remove(self.search(city='Stepford')[0])
+        self.assertEqual(self.search(city='Stepford'), [])
+        self.assertEqual(cache.hits, 2)
+
+    def test_bounded(self):
+        book = abook_example()
+        book.query_cache = ab_cache.QueryCache('search_base', maxsize=2)
+        for city in ('Stepford', 'Metropolis', 'Stepford', 'Springfield', 'Metropolis'):
+            book.search_base(city=city)
+        self.assertEqual(book.query_cache.info(), {'hits': 1, 'misses': 4, 'hit_rate': 0.2, 'size': 2,
+                                                   'maxsize': 2})
+        book.query_cache = ab_cache.QueryCache('search_base', maxsize=0)
+        book.search_base(city='Stepford')
+        book.search_base(city='Stepford')
+        self.assertEqual((book.query_cache.hits, len(book.query_cache)), (0, 0))
+
+    def test_not_saved(self):
+        self.book.search_base(city='Stepford')
+        loaded = pickle.loads(pickle.dumps(self.book))
+        self.assertEqual(len(loaded.query_cache), 0)
+        self.assertIsNotNone(loaded.search_base(city='Stepford'))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.paths = []
+        for seed in range(3):
+            path = os.path.join(self.tmp.name, 'archive{0}.pkl'.format(seed))
+            ab_export.save_book(ab_generator.Generator(seed=seed).book(500), path)
+            self.paths.append(path)
+        self.person = ab_export.load_book(self.paths[1])[7]
+
+    def keys(self, **query):
+        return ab_bloom.query_keys(**query)
+
+    def test_filter(self):
+        bloom = ab_bloom.BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bloom.add('key{0}'.format(i))
+        self.assertTrue(all('key{0}'.format(i) in bloom for i in range(10000)))
+        false = sum('other{0}'.format(i) in bloom for i in range(10000))
+        self.assertLess(false, 200)
+
+    def test_saved_filter(self):
+        p = self.person
+        self.assertTrue(os.path.exists(ab_bloom.filter_path(self.paths[1])))
+        self.assertTrue(ab_bloom.might_contain(self.paths[1], self.keys(email=p.email.upper())))
+        self.assertTrue(ab_bloom.might_contain(self.paths[1], self.keys(name=p.name, surname=p.surname)))
+        self.assertTrue(ab_bloom.might_contain(self.paths[1], self.keys(phone=p.phone_num)))
+        self.assertFalse(ab_bloom.might_contain(self.paths[1], self.keys(email='nobody@example.com')))
+        self.assertFalse(ab_bloom.might_contain(self.paths[1], self.keys(phone='668 000 001')))
+        self.assertRaises(ValueError, self.keys, name='roy')
+
+    def test_lookup_without_loading(self):
+        load = MagicMock(side_effect=ab_export.load_book)
+        result = ab_bloom.lookup(self.paths, self.keys(email=self.person.email), load)
+        self.assertEqual(result, {self.paths[0]: 'no', self.paths[1]: 'maybe', self.paths[2]: 'no'})
+        self.assertFalse(load.called)
+
+    def test_outdated_filter(self):
+        """a filter that doesn't match its book is ignored and the book is loaded"""
+        book = ab_export.load_book(self.paths[0])
+        book.append(Person('rick', 'deckard', 'deckard@gmail.com', '508123456'))
+        with open(self.paths[0], 'wb') as f:
+            pickle.dump(book, f)
+        keys = self.keys(email='deckard@gmail.com')
+        self.assertIsNone(ab_bloom.might_contain(self.paths[0], keys))
+        load = MagicMock(side_effect=ab_export.load_book)
+        self.assertEqual(ab_bloom.lookup(self.paths[:1], keys, load), {self.paths[0]: 'yes'})
+        self.assertEqual(load.call_count, 1)
+
+    def test_phone_forms(self):
+        """a phone number is found in the form it has been saved in and in other forms of the same number"""
+        book = abook_example()
+        book.append(Person('rick', 'deckard', 'deckard@gmail.com', '+48 668678679'))
+        path = os.path.join(self.tmp.name, 'book.pkl')
+        ab_export.save_book(book, path)
+        for phone in ('+48 668678679', '8678679', '(22)7790123', '22 779 01 23'):
+            keys = self.keys(phone=phone)
+            self.assertTrue(ab_bloom.might_contain(path, keys), phone)
+            self.assertTrue(ab_bloom.contains(book, keys), phone)
+
+    def test_no_filter(self):
+        book = abook_example()
+        book.bloom_error_rate = None
+        path = os.path.join(self.tmp.name, 'book.pkl')
+        ab_export.save_book(book, path)
+        self.assertFalse(os.path.exists(ab_bloom.filter_path(path)))
+
+    def test_cli(self):
+        cli = TestCli.cli.__get__(self)
+        code, result = cli('exists', *self.paths, '--email', self.person.email, '--verify')
+        self.assertEqual((code, result['found'], result['loaded']), (ab_cli.EXIT_OK, [self.paths[1]], 1))
+        code, result = cli('exists', *self.paths, '--name', 'rick', '--surname', 'deckard')
+        self.assertEqual((code, result['found'], result['loaded']), (ab_cli.EXIT_NOT_FOUND, [], 0))
+
+
+class TestLazyOpen(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'book.pkl')
+        self.book = ab_generator.Generator(seed=3).book(1000)
+        self.book[5].tags = 'family'
+        self.book.record_file = True
+        ab_export.save_book(self.book, self.path)
+        self.lazy = ab_lazy.LazyBook(self.path)
+        self.addCleanup(self.lazy.close)
+
+    @staticmethod
+    def uids(found):
+        return [] if found is None else [found.uid] if isinstance(found, Person) else sorted(p.uid for p in found)
+
+    def test_entries(self):
+        lazy = self.lazy
+        self.assertEqual(len(lazy), 1000)
+        for i in (0, 5, 63, 64, 999, -1):
+            self.assertEqual(lazy[i].__getstate__(), self.book[i].__getstate__())
+        self.assertEqual([p.uid for p in lazy[10:20]], [p.uid for p in self.book[10:20]])
+        self.assertEqual(lazy[5].tags, {'family'})
+        self.assertRaises(IndexError, lambda: lazy[1000])
+        self.assertIs(lazy.get(self.book[700].uid), lazy[700])
+        self.assertIsNone(lazy.get(10 ** 6))
+
+    def test_search(self):
+        p = self.book[300]
+        queries = [('personid', p.personid), ('city', p.city), ('email', p.email), ('surname', 'nobody')]
+        for key, value in queries:
+            self.assertEqual(self.uids(self.lazy.search_base(**{key: value})),
+                             self.uids(self.book.search_base(**{key: value})))
+
+    def test_budget(self):
+        lazy = ab_lazy.LazyBook(self.path, budget=50 * 1024)
+        self.addCleanup(lazy.close)
+        self.assertEqual([p.uid for p in lazy], [p.uid for p in self.book])
+        self.assertLessEqual(lazy.cache.size, 50 * 1024)
+        self.assertLess(len(lazy.cache), 500)
+        hits = lazy.cache.hits
+        self.assertIs(lazy[999], lazy[999])
+        self.assertEqual(lazy.cache.hits, hits + 2)
+
+    def test_load(self):
+        found = self.lazy[300]
+        book = self.lazy.load()
+        self.assertIsInstance(book, AddressBook)
+        self.assertEqual([p.__getstate__() for p in book], [p.__getstate__() for p in self.book])
+        self.assertEqual((book.filename, book.version, book.modified), (self.path, self.book.version, False))
+        # entries read before belong to the loaded AddressBook
+        self.assertIs(book.get(found.uid), found)
+        found.name = 'rick'
+        book.pickle_changes()
+        self.assertEqual(ab_export.load_book(self.path)[300].name, 'Rick')
+
+    def test_outdated_records(self):
+        """a record file that doesn't match its AddressBook file is ignored"""
+        with open(self.path, 'wb') as f:
+            pickle.dump(self.book, f)
+        self.assertRaises(ValueError, ab_lazy.LazyBook, self.path)
+        self.assertIsInstance(ab_lazy.open_book(self.path), AddressBook)
+
+    def test_opt_in(self):
+        """the record file is written only for AddressBooks saved in the lazy mode, the setting isn't saved"""
+        book = abook_example()
+        path = os.path.join(os.path.dirname(self.path), 'example.pkl')
+        book.pickle_base(path)
+        self.assertFalse(os.path.exists(ab_lazy.records_path(path)))
+        self.assertIsInstance(ab_lazy.open_book(path), AddressBook)
+
+        app = MainApp(lazy=ab_lazy.BUDGET)
+        app.abook = ab_export.load_book(path)
+        app.full_book().pickle_changes()
+        lazy = ab_lazy.open_book(path)
+        self.addCleanup(lazy.close)
+        self.assertIsInstance(lazy, ab_lazy.LazyBook)
+        self.assertFalse(ab_export.load_book(path).record_file)
+
+    def test_menu(self):
+        """the whole AddressBook is loaded only when an entry found in the lazily opened one is modified"""
+        email = self.book[300].email
+        for answers, loaded in ((['2', self.path, '1', '2', '3', email, 'n', '9'], False),
+                                (['2', self.path, '2', '3', email, 'y', '1', 'rick', '11', '9', 'n'], True)):
+            app = MainApp(lazy=ab_lazy.BUDGET)
+            answers = iter(answers)
+            with patch('builtins.input', lambda prompt='': next(answers)), suppress_stdout():
+                app.run()
+            self.assertEqual(isinstance(app.abook, AddressBook), loaded)
+        self.assertEqual(app.abook.get(self.book[300].uid).name, 'Rick')
+        self.assertTrue(app.abook.modified)
+
+    def test_environment(self):
+        with patch.dict(os.environ, {ab_lazy.ENVIRON: '8'}):
+            self.assertEqual(ab_lazy.from_environment(), 8 * 1024 * 1024)
+        with patch.dict(os.environ, {ab_lazy.ENVIRON: ''}):
+            self.assertIsNone(ab_lazy.from_environment())
+
+
 if __name__ == '__main__':
     with suppress_stdout():
         unittest.main()